@@ -0,0 +1,13 @@
+"""
+Offline benchmarks for the scraper pipeline.
+
+Run from the clone_django directory, e.g. ``python -m benchmarks.bench_transport``.
+"""
+import os
+
+
+def setup_django():
+    """Configure Django so scraper_api modules can be imported"""
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'clone_django.settings')
+    import django
+    django.setup()
@@ -0,0 +1,88 @@
+"""
+Compare cloning a list of pages one /api/scrape/ request at a time, with
+threads sharing one process (the GIL), and with /api/batch/, which parses
+and renders the pages in the worker process pool. The pages are large
+and share a few assets, so the parse / render work dominates.
+
+    python -m benchmarks.bench_batch [pages] [page_kb] [workers]
+"""
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from . import setup_django
+from .fixture_server import FixtureProcess
+from .fixture_site import generate_site
+
+setup_django()
+
+from django.conf import settings  # noqa: E402
+from django.test import Client  # noqa: E402
+
+from scraper_api import processes  # noqa: E402
+from scraper_api.batch import get_batch_concurrency  # noqa: E402
+
+
+def scrape(client, url):
+    response = client.post('/api/scrape/', {'url': url}, content_type='application/json')
+    if response.status_code != 200:
+        raise RuntimeError(f'scrape failed: {response.status_code}')
+
+
+def run_sequential(client, urls):
+    for url in urls:
+        scrape(client, url)
+
+
+def run_threads(client, urls):
+    with ThreadPoolExecutor(max_workers=get_batch_concurrency()) as executor:
+        list(executor.map(lambda url: scrape(Client(), url), urls))
+
+
+def run_batch(client, urls):
+    response = client.post('/api/batch/', {'urls': urls}, content_type='application/json')
+    records = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+    if records[-1]['failed']:
+        raise RuntimeError(f"{records[-1]['failed']} pages of the batch failed")
+
+
+def main():
+    page_count = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+    page_kb = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    settings.SCRAPER_PROCESS_WORKERS = (int(sys.argv[3]) if len(sys.argv) > 3
+                                        else os.cpu_count())
+
+    site = generate_site(page_bytes=page_kb * 1024, asset_count=20)
+    files = dict(site)
+    for i in range(page_count):
+        files[f'/page-{i}.html'] = site['/']
+    server = FixtureProcess(files).start()
+    urls = [f'{server.base_url}/page-{i}.html' for i in range(page_count)]
+    client = Client()
+
+    print(f'{page_count} pages of {page_kb} KB, '
+          f'{settings.SCRAPER_PROCESS_WORKERS} worker processes\n')
+    print(f'{"run":<12}{"seconds":>9}{"pages/s":>9}')
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            # Warm-up: start the worker processes and fill the HTTP cache
+            run_batch(client, urls[:1])
+            scrape(client, urls[0])
+        for name, run in (('sequential', run_sequential), ('threads', run_threads),
+                          ('batch', run_batch)):
+            with contextlib.redirect_stdout(io.StringIO()):
+                started = time.perf_counter()
+                run(client, urls)
+                elapsed = time.perf_counter() - started
+            print(f'{name:<12}{elapsed:>9.3f}{page_count / elapsed:>9.1f}')
+    finally:
+        server.stop()
+        processes.get_process_pool().shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""
+Compare per-rule find_all discovery, as it was before the single-pass
+DomIndex (frozen in find_all_discovery), with the DomIndex.
+
+    python -m benchmarks.bench_discovery [megabytes ...]
+"""
+import sys
+import time
+
+from bs4 import BeautifulSoup
+
+from . import setup_django
+from .synthetic_html import generate_page
+
+setup_django()
+
+from scraper_api import views  # noqa: E402
+from . import find_all_discovery  # noqa: E402
+
+BASE_URL = 'https://example.com/'
+
+
+def timed(func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - started
+
+
+def main():
+    sizes = [float(arg) for arg in sys.argv[1:]] or [5, 10, 20]
+
+    rows = []
+    for megabytes in sizes:
+        html = generate_page(int(megabytes * 1024 * 1024))
+        soup = BeautifulSoup(html, 'html.parser')
+
+        find_all_resources, find_all_time = timed(
+            find_all_discovery.discover_all_resources, soup, BASE_URL)
+        index_resources, index_time = timed(
+            views.discover_all_resources, soup, BASE_URL)
+        rows.append((megabytes, find_all_time, index_time,
+                     len(find_all_resources), len(index_resources)))
+
+    # Discovery has found more kinds of references since, and dedups by
+    # canonical URL, so the counts differ
+    print(f'{"MB":>6}{"find_all s":>12}{"index s":>10}{"speedup":>9}'
+          f'{"resources (find_all / index)":>30}')
+    for megabytes, find_all_time, index_time, find_all_count, index_count in rows:
+        print(f'{megabytes:>6.1f}{find_all_time:>12.3f}{index_time:>10.3f}'
+              f'{find_all_time / index_time:>8.1f}x'
+              f'{f"{find_all_count} / {index_count}":>30}')
+
+
+if __name__ == '__main__':
+    main()
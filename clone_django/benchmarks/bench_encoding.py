@@ -0,0 +1,116 @@
+"""
+Size and CPU cost of a clone response in each encoding the API offers:
+JSON and MessagePack, uncompressed and with gzip, br and zstd.
+
+The response is built like a real clone's, from a synthetic page and
+text and binary resources (binary bodies are random bytes, as
+incompressible as real images). Encode time covers rendering plus
+compression, decode time decompression plus parsing. Codings and formats
+whose package isn't installed are skipped.
+
+    python -m benchmarks.bench_encoding [assets] [asset_kb] [repeat]
+"""
+import json
+import random
+import sys
+import time
+
+from . import setup_django
+from .synthetic_html import generate_page
+
+setup_django()
+
+from rest_framework.renderers import JSONRenderer  # noqa: E402
+
+from scraper_api import views  # noqa: E402
+from scraper_api.compression import (  # noqa: E402
+    AVAILABLE_ENCODINGS, compress_body, decompress_body)
+from scraper_api.renderers import MessagePackRenderer, msgpack  # noqa: E402
+
+# Share of each kind of resource body
+RESOURCE_MIX = (('css', 'text/css', 0.2), ('js', 'application/javascript', 0.2),
+                ('img', 'image/png', 0.5), ('font', 'font/woff2', 0.1))
+
+
+def text_body(kind, size, rng):
+    rule = ('.c{n}{{color:#{n:06x};margin:{m}px}}\n' if kind == 'css'
+            else 'function f{n}(a){{return a+{m};}}\n')
+    lines, length = [], 0
+    while length < size:
+        line = rule.format(n=rng.randrange(1 << 24), m=rng.randrange(100))
+        lines.append(line)
+        length += len(line)
+    return ''.join(lines).encode('utf-8')
+
+
+def make_result(asset_count, asset_bytes, seed=0):
+    """A single-page clone response with inline (base64) binary bodies"""
+    rng = random.Random(seed)
+    resources = []
+    for i in range(asset_count):
+        kind, content_type, _ = rng.choices(
+            RESOURCE_MIX, weights=[share for *_, share in RESOURCE_MIX])[0]
+        size = max(16, int(rng.uniform(0.5, 1.5) * asset_bytes))
+        body = text_body(kind, size, rng) if kind in ('css', 'js') else rng.randbytes(size)
+        resource = {
+            'url': f'https://example.com/assets/{kind}/{kind}-{i}',
+            'original_path': f'/assets/{kind}/{kind}-{i}',
+            'filename': f'{kind}-{i}',
+            'category': kind,
+            'type': 'external',
+        }
+        views.store_resource_body(resource, body, content_type)
+        resources.append(resource)
+
+    return {
+        'html': generate_page(200 * 1024, seed),
+        'resources': resources,
+        'url': 'https://example.com/',
+        'title': 'Synthetic page',
+        'scraped_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'stats': views.build_stats(resources),
+    }
+
+
+def best_of(repeat, func, *args):
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        value = func(*args)
+        times.append(time.perf_counter() - started)
+    return min(times), value
+
+
+def main():
+    asset_count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    asset_kb = float(sys.argv[2]) if len(sys.argv) > 2 else 16
+    repeat = int(sys.argv[3]) if len(sys.argv) > 3 else 3
+    result = make_result(asset_count, int(asset_kb * 1024))
+
+    formats = [('json', JSONRenderer(), json.loads)]
+    if msgpack is not None:
+        formats.append(('msgpack', MessagePackRenderer(), msgpack.unpackb))
+    else:
+        print('msgpack is not installed, skipping MessagePack')
+
+    print(f'{"format":<9}{"coding":<10}{"MB":>8}{"ratio":>8}{"encode ms":>11}{"decode ms":>11}')
+    baseline = None
+    for name, renderer, parse in formats:
+        for coding in (None,) + AVAILABLE_ENCODINGS:
+            def encode():
+                body = renderer.render(result)
+                return compress_body(body, coding) if coding else body
+
+            def decode(body):
+                return parse(decompress_body(body, coding) if coding else body)
+
+            encode_seconds, body = best_of(repeat, encode)
+            decode_seconds, _ = best_of(repeat, decode, body)
+            baseline = baseline or len(body)
+            print(f'{name:<9}{coding or "identity":<10}{len(body) / 1024 ** 2:>8.2f}'
+                  f'{baseline / len(body):>8.2f}{encode_seconds * 1000:>11.1f}'
+                  f'{decode_seconds * 1000:>11.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+"""
+Compare the thread-pool and asyncio download engines.
+
+    python -m benchmarks.bench_engines [asset_count] [latency_seconds]
+"""
+import sys
+import time
+
+from . import setup_django
+from .fixture_server import FixtureProcess, build_site
+
+setup_django()
+
+from scraper_api import views  # noqa: E402
+
+
+def make_resources(server):
+    return [
+        {'filename': path.rsplit('/', 1)[-1], 'url': server.base_url + path,
+         'original_path': path.lstrip('/'), 'category': 'other',
+         'content': '', 'downloaded': False}
+        for path in server.files if path != '/'
+    ]
+
+
+def main():
+    asset_count = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.05
+    server = FixtureProcess(build_site(asset_count), latency=latency).start()
+
+    print(f'{"engine":<10}{"seconds":>10}{"downloaded":>12}{"connections":>14}')
+    try:
+        for engine in views.DOWNLOAD_ENGINES:
+            resources = make_resources(server)
+            server.reset_counters()
+            started = time.perf_counter()
+            views.download_all_resources(
+                resources, {}, {'engine': engine, 'cache': False})
+            elapsed = time.perf_counter() - started
+            ok = sum(1 for r in resources if r['downloaded'])
+            print(f'{engine:<10}{elapsed:>10.3f}{ok:>12}{server.connections:>14}')
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+Compare HTTP/1.1 downloads (threads and async engines) with the http2
+engine multiplexing them over one connection, against local fixture
+servers with simulated latency. The http2 engine is also run against the
+HTTP/1.1 server, where it falls back to HTTP/1.1.
+
+Needs httpx and h2 (pip install -r requirements-optional.txt).
+
+    python -m benchmarks.bench_http2 [asset_count] [latency_seconds]
+"""
+import sys
+import time
+
+from . import setup_django
+from .bench_engines import make_resources
+from .fixture_server import FixtureProcess, H2FixtureServer, build_site
+
+setup_django()
+
+from django.conf import settings  # noqa: E402
+
+from scraper_api import throttle, views  # noqa: E402
+from scraper_api.http2 import HTTP2_AVAILABLE  # noqa: E402
+
+
+def run(server, engine):
+    # Same starting window for every run
+    throttle._host_limits = None
+    resources = make_resources(server)
+    server.reset_counters()
+    started = time.perf_counter()
+    views.download_all_resources(resources, {}, {'engine': engine, 'cache': False})
+    elapsed = time.perf_counter() - started
+    return elapsed, sum(1 for r in resources if r['downloaded']), server.connections
+
+
+def main():
+    if not HTTP2_AVAILABLE:
+        sys.exit('This benchmark needs httpx and h2 '
+                 '(pip install -r requirements-optional.txt)')
+
+    asset_count = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.05
+    files = build_site(asset_count)
+    http1 = FixtureProcess(files, latency=latency).start()
+    http2 = FixtureProcess(files, latency=latency, server_class=H2FixtureServer).start()
+    # h2c can't be negotiated, the client has to know the origin speaks it
+    host, port = http2.server_address[:2]
+    settings.SCRAPER_HTTP2_CLEARTEXT_HOSTS = (f'{host}:{port}',)
+
+    runs = [
+        ('HTTP/1.1', http1, 'threads'),
+        ('HTTP/1.1', http1, 'async'),
+        ('HTTP/1.1', http1, 'http2'),
+        ('HTTP/2', http2, 'http2'),
+    ]
+
+    print(f'{"server":<10}{"engine":<9}{"seconds":>9}{"files/s":>9}'
+          f'{"downloaded":>12}{"connections":>13}')
+    try:
+        for label, server, engine in runs:
+            elapsed, ok, connections = run(server, engine)
+            print(f'{label:<10}{engine:<9}{elapsed:>9.3f}{ok / elapsed:>9.0f}'
+                  f'{ok:>12}{connections:>13}')
+    finally:
+        http1.stop()
+        http2.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+Time the optimize stage on synthetic bodies: the size saved per kind, and
+the whole batch in-process (serially) against process pools of growing
+size. JavaScript needs rjsmin and images Pillow; kinds whose package is
+missing are skipped.
+
+    python -m benchmarks.bench_optimize [bodies_per_kind] [max_workers]
+"""
+import io
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from . import setup_django
+from .bench_encoding import text_body
+from .synthetic_html import generate_page
+
+setup_django()
+
+from scraper_api.minify import Image, can_optimize, optimize_body  # noqa: E402
+from scraper_api.optimize import body_length, get_image_quality  # noqa: E402
+
+
+def make_image(fmt, rng, size=(400, 300)):
+    """A noisy gradient, so it compresses about like a photo"""
+    image = Image.new('RGB', size)
+    image.putdata([(x % 256, (x // 7) % 256, rng.randrange(64))
+                   for x in range(size[0] * size[1])])
+    out = io.BytesIO()
+    image.save(out, fmt, **({'quality': 100} if fmt == 'JPEG' else {}))
+    return out.getvalue()
+
+
+def make_bodies(count, seed=0):
+    """[(kind, body)] with count bodies of each kind that can be optimized"""
+    rng = random.Random(seed)
+    bodies = []
+    for i in range(count):
+        bodies.append(('css', '\n'.join(
+            line.replace('{', ' {\n    ').replace(';', ';\n    ')
+            for line in text_body('css', 32 * 1024, rng).decode().splitlines())))
+        if can_optimize('js'):
+            bodies.append(('js', text_body('js', 32 * 1024, rng).decode().replace(
+                '{', ' {\n    // body\n    ')))
+        bodies.append(('html', generate_page(100 * 1024, seed + i).replace('><', '>\n    <')))
+        if can_optimize('image'):
+            bodies.append(('image', make_image('JPEG' if i % 2 else 'PNG', rng)))
+    return bodies
+
+
+def run_serial(bodies, quality):
+    return [optimize_body(kind, body, quality) for kind, body in bodies]
+
+
+def run_pool(bodies, quality, workers):
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # Start every worker before timing, as the clone pool stays up
+        list(pool.map(abs, range(workers)))
+        started = time.perf_counter()
+        futures = [pool.submit(optimize_body, kind, body, quality) for kind, body in bodies]
+        results = [future.result() for future in futures]
+        return time.perf_counter() - started, results
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    max_workers = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count() or 1
+    quality = get_image_quality()
+    bodies = make_bodies(count)
+
+    started = time.perf_counter()
+    results = run_serial(bodies, quality)
+    serial = time.perf_counter() - started
+
+    print(f'{"kind":<8}{"files":>7}{"before KB":>11}{"after KB":>10}{"saved":>8}')
+    for kind in ('css', 'js', 'html', 'image'):
+        pairs = [(body, result) for (k, body), result in zip(bodies, results) if k == kind]
+        if not pairs:
+            continue
+        before = sum(body_length(body) for body, _ in pairs)
+        after = sum(body_length(result if result is not None and
+                                body_length(result) < body_length(body) else body)
+                    for body, result in pairs)
+        print(f'{kind:<8}{len(pairs):>7}{before / 1024:>11.0f}{after / 1024:>10.0f}'
+              f'{1 - after / before:>8.0%}')
+
+    print(f'\n{"run":<12}{"seconds":>9}{"speedup":>9}')
+    print(f'{"serial":<12}{serial:>9.3f}{1:>9.2f}')
+    workers = 1
+    while workers <= max_workers:
+        elapsed, _ = run_pool(bodies, quality, workers)
+        print(f'{f"{workers} workers":<12}{elapsed:>9.3f}{serial / elapsed:>9.2f}')
+        workers *= 2
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""
+Compare BeautifulSoup parser backends on synthetic pages: parse time,
+discovery + rewrite + serialize time, output size, and whether the
+discovered resources match the html.parser baseline.
+
+    python -m benchmarks.bench_parsers [megabytes ...]
+"""
+import sys
+import time
+
+from . import setup_django
+from .synthetic_html import generate_page
+
+setup_django()
+
+from scraper_api import views  # noqa: E402
+from scraper_api.parsing import PARSER_BACKENDS, parse_html  # noqa: E402
+
+BASE_URL = 'https://example.com/'
+
+
+def run_backend(html, backend):
+    started = time.perf_counter()
+    soup = parse_html(html, backend)
+    parsed = time.perf_counter()
+    resources = views.discover_all_resources(soup, BASE_URL)
+    output = str(views.process_html_links(soup, resources, BASE_URL))
+    finished = time.perf_counter()
+    return {
+        'parse': parsed - started,
+        'pipeline': finished - parsed,
+        'output_bytes': len(output.encode('utf-8')),
+        'resources': resources,
+    }
+
+
+def main():
+    sizes = [float(arg) for arg in sys.argv[1:]] or [0.5, 1, 2]
+
+    print(f'{"MB":>6}{"backend":>13}{"parse s":>10}{"pipeline s":>12}'
+          f'{"output MB":>11}{"resources":>11}{"equal":>7}')
+    for megabytes in sizes:
+        html = generate_page(int(megabytes * 1024 * 1024)).encode('utf-8')
+        baseline = None
+        for backend in PARSER_BACKENDS:
+            result = run_backend(html, backend)
+            if baseline is None:
+                baseline = result['resources']
+            print(f'{megabytes:>6.1f}{backend:>13}{result["parse"]:>10.3f}'
+                  f'{result["pipeline"]:>12.3f}'
+                  f'{result["output_bytes"] / 1024 / 1024:>11.2f}'
+                  f'{len(result["resources"]):>11}'
+                  f'{str(result["resources"] == baseline):>7}')
+
+
+if __name__ == '__main__':
+    main()
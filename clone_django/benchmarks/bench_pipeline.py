@@ -0,0 +1,167 @@
+"""
+End-to-end benchmark of the scrape view against a local synthetic site.
+
+Measures wall time, throughput, per-phase time (from the pipeline metrics)
+and peak Python memory (tracemalloc, in a separate run so it doesn't skew
+the timings). Needs no network access. Results are printed and, with
+--output, written as JSON so runs can be compared.
+
+    python -m benchmarks.bench_pipeline --assets 300 --latency 0.02 \\
+        --distribution lognormal --error-rate 0.05 --output results.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+import tracemalloc
+
+from . import setup_django
+from .fixture_server import FixtureProcess
+from .fixture_site import SIZE_DISTRIBUTIONS, FlakyFixtureServer, generate_site
+
+setup_django()
+
+from django.test import Client  # noqa: E402
+
+from scraper_api.metrics import PHASE_SECONDS  # noqa: E402
+from scraper_api.transport import DOWNLOAD_ENGINES  # noqa: E402
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--page-kb', type=int, default=100, help='HTML page size')
+    parser.add_argument('--assets', type=int, default=200, help='assets on the page')
+    parser.add_argument('--asset-kb', type=float, default=8, help='mean asset size')
+    parser.add_argument('--distribution', choices=SIZE_DISTRIBUTIONS, default='fixed')
+    parser.add_argument('--latency', type=float, default=0.02, help='seconds per response')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='share of assets answered with a 500')
+    parser.add_argument('--engine', choices=DOWNLOAD_ENGINES, action='append',
+                        help='download engine(s) to run, default all')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write results as JSON to this file')
+    return parser.parse_args()
+
+
+def phase_totals():
+    return {key[0]: total for key, (total, _) in PHASE_SECONDS.totals().items()}
+
+
+def scrape(client, url, engine):
+    """Run one clone through the view, with its console logging silenced"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        response = client.post(
+            '/api/scrape/', {'url': url, 'engine': engine, 'cache': False},
+            content_type='application/json')
+    if response.status_code != 200:
+        raise RuntimeError(f'scrape failed: {response.status_code} {response.content[:200]}')
+    return response.json()
+
+
+def run_engine(client, server, engine, repeat):
+    # Warm-up: imports, pooled connections, first-use allocations
+    scrape(client, server.base_url + '/', engine)
+
+    timings = []
+    phases = []
+    for _ in range(repeat):
+        before = phase_totals()
+        server.reset_counters()
+        started = time.perf_counter()
+        data = scrape(client, server.base_url + '/', engine)
+        timings.append(time.perf_counter() - started)
+        after = phase_totals()
+        phases.append({phase: after[phase] - before.get(phase, 0) for phase in after})
+
+    # Counters of the last timed run
+    requests, connections = server.requests, server.connections
+    resources = data['resources']
+    downloaded = [r for r in resources if r['downloaded'] and r['type'] != 'inline']
+    downloaded_bytes = sum(r['size'] for r in downloaded)
+
+    # Separate run for memory: tracemalloc slows allocation-heavy code down
+    tracemalloc.start()
+    scrape(client, server.base_url + '/', engine)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    median = statistics.median(timings)
+    return {
+        'engine': engine,
+        'seconds': timings,
+        'median_seconds': median,
+        'resources': len(resources),
+        'downloaded': len(downloaded),
+        'failed': sum(1 for r in resources if r.get('error')),
+        'downloaded_bytes': downloaded_bytes,
+        'resources_per_second': len(downloaded) / median,
+        'megabytes_per_second': downloaded_bytes / median / 1024 / 1024,
+        'requests': requests,
+        'connections': connections,
+        'phase_seconds': {
+            phase: statistics.median(run.get(phase, 0.0) for run in phases)
+            for phase in sorted(set().union(*phases))},
+        'peak_memory_bytes': peak,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+            cwd=os.path.dirname(__file__)).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    args = parse_args()
+    files = generate_site(
+        page_bytes=args.page_kb * 1024, asset_count=args.assets,
+        asset_bytes=int(args.asset_kb * 1024), distribution=args.distribution,
+        seed=args.seed)
+    server = FixtureProcess(
+        files, latency=args.latency, server_class=FlakyFixtureServer,
+        error_rate=args.error_rate).start()
+    client = Client()
+
+    results = {
+        'benchmark': 'pipeline',
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'config': {key: value for key, value in vars(args).items() if key != 'output'},
+        'site': {'files': len(files), 'bytes': sum(len(body) for _, body in files.values())},
+        'runs': [],
+    }
+
+    print(f'{"engine":<8}{"median s":>10}{"res/s":>9}{"MB/s":>8}{"failed":>8}'
+          f'{"peak MB":>9}  slowest phases')
+    try:
+        for engine in args.engine or DOWNLOAD_ENGINES:
+            run = run_engine(client, server, engine, args.repeat)
+            results['runs'].append(run)
+            slowest = sorted(run['phase_seconds'].items(), key=lambda item: -item[1])
+            slowest = [(phase, seconds) for phase, seconds in slowest if phase != 'clone'][:3]
+            print(f'{engine:<8}{run["median_seconds"]:>10.3f}'
+                  f'{run["resources_per_second"]:>9.0f}{run["megabytes_per_second"]:>8.1f}'
+                  f'{run["failed"]:>8}{run["peak_memory_bytes"] / 1024 / 1024:>9.1f}  '
+                  + ', '.join(f'{phase} {seconds:.3f}s' for phase, seconds in slowest))
+    finally:
+        server.stop()
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+        print(f'Results written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
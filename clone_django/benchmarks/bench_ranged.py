@@ -0,0 +1,83 @@
+"""
+Download one large file from a server capping the rate of each response
+(as a far-away server does per connection), in one GET and in parallel
+Range segments; then from a server that also cuts responses off part way,
+where a plain download starts over from zero on every retry and a ranged
+one carries on from its checkpoint.
+
+    python -m benchmarks.bench_ranged [file_mb] [rate_mb_per_s]
+"""
+import contextlib
+import hashlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+from . import setup_django
+from .fixture_server import FixtureProcess, RangeFixtureServer
+
+setup_django()
+
+from django.conf import settings  # noqa: E402
+
+from scraper_api import views  # noqa: E402
+from scraper_api.spool import iter_body  # noqa: E402
+
+
+def download(server, size):
+    """Seconds to download /big.bin, checking what arrived"""
+    resource = views.create_media_resource('/big.bin', server.base_url, 'video')
+    digests = []
+
+    def store_body(resource, content, content_type, text=None):
+        hasher = hashlib.sha256()
+        for chunk in iter_body(content):
+            hasher.update(chunk)
+        digests.append(hasher.hexdigest())
+        resource['downloaded'] = True
+
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        views.download_all_resources(
+            [resource], views.BROWSER_HEADERS, {'cache': False}, store_body=store_body)
+    if not resource['downloaded']:
+        raise RuntimeError(f"download failed: {resource.get('error')}")
+    return time.perf_counter() - started, digests[0]
+
+
+def main():
+    size = int(sys.argv[1] if len(sys.argv) > 1 else 32) * 1024 ** 2
+    rate = float(sys.argv[2] if len(sys.argv) > 2 else 8) * 1024 ** 2
+    body = os.urandom(size)
+    files = {'/big.bin': ('application/octet-stream', body)}
+    expected = hashlib.sha256(body).hexdigest()
+
+    settings.SCRAPER_RETRY_BACKOFF = 0.1
+    flaky = {'drop_after': size // 10, 'drops': 3}
+
+    print(f'{size // 1024 ** 2} MB file, {rate / 1024 ** 2:.0f} MB/s per response; '
+          f'flaky: the first {flaky["drops"]} responses cut off after '
+          f'{flaky["drop_after"] / 1024 ** 2:.1f} MB\n')
+    print(f'{"server":<8}{"download":<14}{"seconds":>9}{"requests":>10}')
+    with tempfile.TemporaryDirectory() as root:
+        settings.SCRAPER_RANGED_ROOT = root
+        for server_name, options in (('steady', {}), ('flaky', flaky)):
+            for name, min_bytes, segments in (('one GET', size + 1, 1),
+                                              ('4 segments', 1, 4), ('8 segments', 1, 8)):
+                settings.SCRAPER_RANGED_MIN_BYTES = min_bytes
+                settings.SCRAPER_RANGE_SEGMENTS = segments
+                server = FixtureProcess(
+                    files, server_class=RangeFixtureServer, rate=rate, **options).start()
+                try:
+                    elapsed, digest = download(server, size)
+                finally:
+                    server.stop()
+                if digest != expected:
+                    raise RuntimeError(f'{name}: corrupted download')
+                print(f'{server_name:<8}{name:<14}{elapsed:>9.2f}{server.requests:>10}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""
+Compare the multi-pass process_html_links, as it was before the rewrite
+module (frozen in multi_pass_rewrite), with the single-pass rewriter.
+
+Besides the time, counts the references to downloaded resources each one
+leaves pointing at the origin (srcset, <source>, posters, inline styles and
+<style> blocks are only covered by the single pass).
+
+    python -m benchmarks.bench_rewrite [megabytes ...]
+"""
+import sys
+import time
+from urllib.parse import urljoin
+
+from bs4 import BeautifulSoup
+
+from . import setup_django
+from .synthetic_html import generate_page
+
+setup_django()
+
+from scraper_api import views  # noqa: E402
+from scraper_api.css import find_css_references  # noqa: E402
+from scraper_api.dedup import ResourceIndex, _canonicalize, canonical_url  # noqa: E402
+from scraper_api.rewrite import (  # noqa: E402
+    SRCSET_ATTRIBUTES, URL_ATTRIBUTES, build_link_table)
+from . import multi_pass_rewrite  # noqa: E402
+
+BASE_URL = 'https://example.com/'
+
+
+def references(soup):
+    """Every URL a page references through attributes and <style> blocks"""
+    for tag in soup.find_all(True):
+        for name, value in tag.attrs.items():
+            if not isinstance(value, str):
+                continue
+            if name in URL_ATTRIBUTES:
+                yield value
+            elif name in SRCSET_ATTRIBUTES:
+                yield from views.parse_srcset(value)
+            elif name == 'style':
+                yield from (ref for ref, _ in find_css_references(value))
+        if tag.name == 'style' and tag.string:
+            yield from (ref for ref, _ in find_css_references(str(tag.string)))
+
+
+def origin_links(soup, table):
+    """
+    References still pointing at a downloaded resource's origin URL (local
+    links are always relative, never root-relative or absolute)
+    """
+    return sum(1 for ref in references(soup)
+               if ref.startswith(('/', 'http:', 'https:'))
+               and canonical_url(urljoin(BASE_URL, ref)) in table)
+
+
+def warm_url_cache(resources):
+    """Leave canonical_url's cache as discovery does in a real clone"""
+    _canonicalize.cache_clear()
+    ResourceIndex(resources)
+
+
+def timed(func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - started
+
+
+def main():
+    sizes = [float(arg) for arg in sys.argv[1:]] or [1, 5, 10]
+
+    rows = []
+    for megabytes in sizes:
+        html = generate_page(int(megabytes * 1024 * 1024))
+        resources = views.discover_all_resources(BeautifulSoup(html, 'html.parser'), BASE_URL)
+        for resource in resources:
+            resource['downloaded'] = True
+        table = build_link_table(resources)
+
+        warm_url_cache(resources)
+        multi_soup, multi_time = timed(
+            multi_pass_rewrite.process_html_links, BeautifulSoup(html, 'html.parser'),
+            resources, BASE_URL)
+        warm_url_cache(resources)
+        single_soup, single_time = timed(
+            views.process_html_links, BeautifulSoup(html, 'html.parser'), resources, BASE_URL)
+
+        rows.append((megabytes, multi_time, single_time, len(resources),
+                     origin_links(multi_soup, table), origin_links(single_soup, table)))
+
+    print(f'{"MB":>6}{"multi-pass s":>14}{"single s":>10}{"speedup":>9}{"resources":>11}'
+          f'{"origin refs (multi / single)":>30}')
+    for megabytes, multi_time, single_time, count, multi_left, single_left in rows:
+        print(f'{megabytes:>6.1f}{multi_time:>14.3f}{single_time:>10.3f}'
+              f'{multi_time / single_time:>8.1f}x{count:>11}'
+              f'{f"{multi_left} / {single_left}":>30}')
+
+
+if __name__ == '__main__':
+    main()
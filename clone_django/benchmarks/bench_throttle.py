@@ -0,0 +1,70 @@
+"""
+Download from an origin that rate-limits concurrent requests (429 with
+Retry-After) and fails now and then (503), with a fixed wide window and
+no retries versus the adaptive per-host window with retries.
+
+    python -m benchmarks.bench_throttle [asset_count] [max_concurrent] [latency_seconds]
+"""
+import sys
+import time
+
+from . import setup_django
+from .bench_engines import make_resources
+from .fixture_server import FixtureProcess, RateLimitedFixtureServer, build_site
+
+setup_django()
+
+from django.conf import settings  # noqa: E402
+
+from scraper_api import throttle, views  # noqa: E402
+
+POLICIES = {
+    # Every resource started at once, one try each
+    'fixed': {'SCRAPER_RETRY_ATTEMPTS': 1, 'SCRAPER_HOST_CONCURRENCY': 32,
+              'SCRAPER_HOST_LATENCY_TARGET': 3600},
+    'adaptive': {},
+}
+
+
+def run(server, engine, overrides):
+    saved = {name: getattr(settings, name) for name in overrides}
+    for name, value in overrides.items():
+        setattr(settings, name, value)
+    # Start every run from a fresh window
+    throttle._host_limits = None
+    try:
+        resources = make_resources(server)
+        server.reset_counters()
+        started = time.perf_counter()
+        views.download_all_resources(resources, {}, {'engine': engine, 'cache': False})
+        return resources, time.perf_counter() - started
+    finally:
+        for name, value in saved.items():
+            setattr(settings, name, value)
+
+
+def main():
+    asset_count = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    max_concurrent = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    latency = float(sys.argv[3]) if len(sys.argv) > 3 else 0.05
+    server = FixtureProcess(
+        build_site(asset_count), latency=latency, server_class=RateLimitedFixtureServer,
+        max_concurrent=max_concurrent, error_every=50).start()
+
+    print(f'{"engine":<9}{"policy":<10}{"seconds":>9}{"downloaded":>12}{"missing":>9}'
+          f'{"retries":>9}{"throttled":>11}{"requests":>10}')
+    try:
+        for engine in views.DOWNLOAD_ENGINES:
+            for policy, overrides in POLICIES.items():
+                resources, elapsed = run(server, engine, overrides)
+                ok = sum(1 for r in resources if r['downloaded'])
+                retries = sum(r.get('retries', 0) for r in resources)
+                throttled = sum(r.get('throttled', 0) for r in resources)
+                print(f'{engine:<9}{policy:<10}{elapsed:>9.2f}{ok:>12}{len(resources) - ok:>9}'
+                      f'{retries:>9}{throttled:>11}{server.requests:>10}')
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
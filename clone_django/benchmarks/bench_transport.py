@@ -0,0 +1,48 @@
+"""
+Compare bare requests.get downloads with the pooled keep-alive transport.
+
+    python -m benchmarks.bench_transport [asset_count]
+"""
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from . import setup_django
+from .fixture_server import FixtureProcess, build_site
+
+setup_django()
+
+from scraper_api.transport import SessionPool, get_download_workers  # noqa: E402
+
+
+def run(server, get, urls):
+    server.reset_counters()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=get_download_workers()) as executor:
+        for response in executor.map(lambda u: get(u, timeout=30), urls):
+            response.content
+    return time.perf_counter() - started, server.connections
+
+
+def main():
+    asset_count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    server = FixtureProcess(build_site(asset_count)).start()
+    urls = [server.base_url + path for path in server.files if path != '/']
+
+    try:
+        bare_time, bare_conns = run(server, requests.get, urls)
+        pool = SessionPool()
+        pooled_time, pooled_conns = run(server, pool.get, urls)
+        pool.close()
+    finally:
+        server.stop()
+
+    print(f'{"transport":<12}{"seconds":>10}{"connections":>14}')
+    print(f'{"bare":<12}{bare_time:>10.3f}{bare_conns:>14}')
+    print(f'{"pooled":<12}{pooled_time:>10.3f}{pooled_conns:>14}')
+
+
+if __name__ == '__main__':
+    main()
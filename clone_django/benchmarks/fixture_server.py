@@ -0,0 +1,435 @@
+"""
+Local HTTP fixture server used by the benchmarks.
+
+The server is a small asyncio HTTP/1.1 keep-alive implementation so it can
+hold hundreds of concurrent connections with simulated latency without
+becoming the bottleneck itself. H2FixtureServer speaks HTTP/2 (h2c) instead.
+"""
+import asyncio
+import hashlib
+import multiprocessing
+import re
+import threading
+
+
+def build_site(asset_count=200, asset_size=2048):
+    """Build a page plus ``asset_count`` same-origin assets"""
+    files = {}
+    tags = []
+    for i in range(asset_count):
+        kind = ('css', 'js', 'png')[i % 3]
+        path = f'/assets/{kind}/asset-{i}.{kind}'
+        if kind == 'css':
+            tags.append(f'<link rel="stylesheet" href="{path}">')
+            files[path] = ('text/css', b'.a{color:red}' + b' ' * asset_size)
+        elif kind == 'js':
+            tags.append(f'<script src="{path}"></script>')
+            files[path] = ('application/javascript', b'var a=1;' + b' ' * asset_size)
+        else:
+            tags.append(f'<img src="{path}">')
+            files[path] = ('image/png', b'\x89PNG' + b'\0' * asset_size)
+
+    html = '<html><head><title>Fixture</title></head><body>{}</body></html>'.format(
+        '\n'.join(tags))
+    files['/'] = ('text/html', html.encode())
+    return files
+
+
+class FixtureCounters:
+    """Connection and request counters that can be shared with a child process"""
+
+    def __init__(self):
+        self._connections = multiprocessing.Value('i', 0)
+        self._requests = multiprocessing.Value('i', 0)
+
+    @property
+    def connections(self):
+        return self._connections.value
+
+    @property
+    def requests(self):
+        return self._requests.value
+
+    def count_connection(self):
+        with self._connections.get_lock():
+            self._connections.value += 1
+
+    def count_request(self):
+        with self._requests.get_lock():
+            self._requests.value += 1
+
+    def reset_counters(self):
+        with self._connections.get_lock():
+            self._connections.value = 0
+        with self._requests.get_lock():
+            self._requests.value = 0
+
+
+class FixtureServer:
+    """
+    Keep-alive HTTP/1.1 server over a dict of ``path -> (content_type, body)``.
+
+    Subclasses override ``respond`` to add behaviour (errors, ranges, ...).
+    """
+
+    def __init__(self, files, host='127.0.0.1', port=0, latency=0.0, counters=None,
+                 cache_control=None):
+        self.files = files
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.cache_control = cache_control
+        self.counters = counters or FixtureCounters()
+        self.server_address = None
+        self._loop = None
+        self._server = None
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    @property
+    def connections(self):
+        return self.counters.connections
+
+    @property
+    def requests(self):
+        return self.counters.requests
+
+    def reset_counters(self):
+        self.counters.reset_counters()
+
+    async def respond(self, method, path, headers):
+        """Return ``(status, headers, body)`` for one request"""
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        entry = self.files.get(path.split('?')[0])
+        if entry is None:
+            return 404, {}, b''
+
+        content_type, body = entry
+        etag = '"%s"' % hashlib.sha1(body).hexdigest()[:16]
+        response_headers = {
+            'Content-Type': content_type,
+            'ETag': etag,
+            'Last-Modified': 'Mon, 01 Jan 2024 00:00:00 GMT',
+        }
+        if self.cache_control:
+            response_headers['Cache-Control'] = self.cache_control
+
+        if headers.get('if-none-match') == etag:
+            return 304, response_headers, b''
+        return 200, response_headers, body
+
+    async def write_body(self, writer, body):
+        writer.write(body)
+
+    async def _handle(self, reader, writer):
+        self.counters.count_connection()
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, path, _ = request_line.decode('latin-1').split(' ', 2)
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                self.counters.count_request()
+                status, response_headers, body = await self.respond(
+                    method, path, headers)
+
+                response_headers.setdefault('Content-Length', str(len(body)))
+                head = [f'HTTP/1.1 {status} {STATUS_REASONS.get(status, "OK")}']
+                head += [f'{k}: {v}' for k, v in response_headers.items()]
+                writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1'))
+                if method != 'HEAD':
+                    await self.write_body(writer, body)
+                await writer.drain()
+
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (ConnectionError, ValueError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+    async def _start_server(self):
+        self._server = await asyncio.start_server(
+            self._handle, self.host, self.port, backlog=1024)
+        self.server_address = self._server.sockets[0].getsockname()
+
+    def start(self):
+        """Serve from a background thread of this process"""
+        started = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            self._loop.run_until_complete(self._start_server())
+            started.set()
+            self._loop.run_forever()
+
+            # Close open keep-alive connections before dropping the loop
+            self._server.close()
+            tasks = asyncio.all_tasks(self._loop)
+            for task in tasks:
+                task.cancel()
+            self._loop.run_until_complete(
+                asyncio.gather(*tasks, return_exceptions=True))
+            self._loop.close()
+
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+        started.wait()
+        return self
+
+    async def _shutdown(self):
+        self._server.close()
+        tasks = [task for task in asyncio.all_tasks()
+                 if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._loop.stop()
+
+    def stop(self):
+        if self._loop is not None:
+            asyncio.run_coroutine_threadsafe(self._shutdown(), self._loop).result()
+
+
+class RateLimitedFixtureServer(FixtureServer):
+    """
+    Answers 429 with a Retry-After to requests beyond max_concurrent in
+    flight at once, and a plain 503 to every error_every-th request
+    """
+
+    def __init__(self, files, max_concurrent=8, retry_after=1, error_every=0, **kwargs):
+        super().__init__(files, **kwargs)
+        self.max_concurrent = max_concurrent
+        self.retry_after = retry_after
+        self.error_every = error_every
+        self._active = 0
+        self._seen = 0
+
+    async def respond(self, method, path, headers):
+        self._seen += 1
+        if self.error_every and self._seen % self.error_every == 0:
+            return 503, {}, b''
+        if self._active >= self.max_concurrent:
+            return 429, {'Retry-After': str(self.retry_after)}, b''
+        self._active += 1
+        try:
+            return await super().respond(method, path, headers)
+        finally:
+            self._active -= 1
+
+
+RANGE_RE = re.compile(r'bytes=(\d*)-(\d*)')
+
+
+class RangeFixtureServer(FixtureServer):
+    """
+    Serves single byte ranges (Accept-Ranges, Range, If-Range) like a
+    static file server. ``rate`` caps the bytes per second of each
+    response, as a far-away server does per connection; the first
+    ``drops`` responses going past ``drop_after`` body bytes are cut off
+    there, like a flaky network.
+    """
+
+    def __init__(self, files, rate=None, drop_after=None, drops=0, **kwargs):
+        super().__init__(files, **kwargs)
+        self.rate = rate
+        self.drop_after = drop_after
+        self.drops = drops
+
+    async def respond(self, method, path, headers):
+        status, response_headers, body = await super().respond(method, path, headers)
+        if status != 200:
+            return status, response_headers, body
+        response_headers['Accept-Ranges'] = 'bytes'
+
+        match = RANGE_RE.fullmatch(headers.get('range', ''))
+        if_range = headers.get('if-range')
+        if not match or not any(match.groups()) or (
+                if_range and if_range not in (response_headers['ETag'],
+                                              response_headers['Last-Modified'])):
+            return status, response_headers, body
+
+        first, last = match.groups()
+        size = len(body)
+        if first:
+            start, end = int(first), min(int(last), size - 1) if last else size - 1
+        else:
+            start, end = max(size - int(last), 0), size - 1
+        if start >= size or start > end:
+            return 416, {'Content-Range': f'bytes */{size}'}, b''
+        response_headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+        return 206, response_headers, body[start:end + 1]
+
+    async def write_body(self, writer, body):
+        sent = 0
+        for offset in range(0, len(body), 64 * 1024):
+            chunk = body[offset:offset + 64 * 1024]
+            if self.drops and self.drop_after is not None and sent + len(chunk) > self.drop_after:
+                self.drops -= 1
+                writer.write(chunk[:self.drop_after - sent])
+                await writer.drain()
+                raise ConnectionResetError('Dropped by the fixture')
+            writer.write(chunk)
+            await writer.drain()
+            sent += len(chunk)
+            if self.rate:
+                await asyncio.sleep(len(chunk) / self.rate)
+
+
+class H2FixtureServer(FixtureServer):
+    """
+    Serves HTTP/2 over cleartext with prior knowledge (h2c, no upgrade):
+    every request on a connection is a stream, answered as soon as its
+    respond() finishes. Needs the h2 package.
+    """
+
+    async def _handle(self, reader, writer):
+        import h2.config
+        import h2.connection
+        import h2.events
+        import h2.exceptions
+
+        self.counters.count_connection()
+        conn = h2.connection.H2Connection(
+            config=h2.config.H2Configuration(client_side=False, header_encoding='utf-8'))
+        conn.initiate_connection()
+        writer.write(conn.data_to_send())
+
+        # Streams waiting for the peer to open its flow control window
+        window_open = {}
+        tasks = set()
+
+        async def send_body(stream_id, body):
+            while body:
+                size = min(conn.local_flow_control_window(stream_id),
+                           conn.max_outbound_frame_size, len(body))
+                if size <= 0:
+                    event = window_open[stream_id] = asyncio.Event()
+                    await event.wait()
+                    continue
+                conn.send_data(stream_id, body[:size], end_stream=size == len(body))
+                body = body[size:]
+                writer.write(conn.data_to_send())
+            await writer.drain()
+
+        async def answer(stream_id, headers):
+            self.counters.count_request()
+            status, response_headers, body = await self.respond(
+                headers.get(':method', 'GET'), headers.get(':path', '/'), headers)
+            if headers.get(':method') == 'HEAD':
+                body = b''
+            response_headers.setdefault('Content-Length', str(len(body)))
+            conn.send_headers(
+                stream_id,
+                [(':status', str(status))] + [(k.lower(), v) for k, v in response_headers.items()],
+                end_stream=not body)
+            writer.write(conn.data_to_send())
+            await send_body(stream_id, body)
+
+        try:
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                for event in conn.receive_data(data):
+                    if isinstance(event, h2.events.RequestReceived):
+                        task = asyncio.ensure_future(
+                            answer(event.stream_id, dict(event.headers)))
+                        tasks.add(task)
+                        task.add_done_callback(tasks.discard)
+                    elif isinstance(event, h2.events.WindowUpdated):
+                        # Stream 0 opens every stream's window
+                        for stream_id in ([event.stream_id] if event.stream_id
+                                          else list(window_open)):
+                            if stream_id in window_open:
+                                window_open.pop(stream_id).set()
+                    elif isinstance(event, h2.events.ConnectionTerminated):
+                        return
+                writer.write(conn.data_to_send())
+                await writer.drain()
+        except (ConnectionError, h2.exceptions.ProtocolError, asyncio.CancelledError):
+            pass
+        finally:
+            for task in tasks:
+                task.cancel()
+            writer.close()
+
+
+STATUS_REASONS = {
+    200: 'OK', 206: 'Partial Content', 304: 'Not Modified',
+    404: 'Not Found', 416: 'Range Not Satisfiable', 429: 'Too Many Requests',
+    500: 'Internal Server Error', 503: 'Service Unavailable',
+}
+
+
+def _serve(server_class, files, latency, counters, options, conn):
+    server = server_class(files, latency=latency, counters=counters, **options)
+    server._loop = asyncio.new_event_loop()
+    server._loop.run_until_complete(server._start_server())
+    conn.send(server.server_address)
+    server._loop.run_forever()
+
+
+class FixtureProcess:
+    """
+    Run a fixture server in a child process.
+
+    An in-process server competes with the client under test for the GIL,
+    which skews any concurrency comparison, so benchmarks use this instead.
+    """
+
+    def __init__(self, files, latency=0.0, server_class=FixtureServer, **options):
+        self.files = files
+        self.latency = latency
+        self.server_class = server_class
+        self.options = options
+        self.counters = FixtureCounters()
+        self.process = None
+        self.server_address = None
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    @property
+    def connections(self):
+        return self.counters.connections
+
+    @property
+    def requests(self):
+        return self.counters.requests
+
+    def reset_counters(self):
+        self.counters.reset_counters()
+
+    def start(self):
+        parent_conn, child_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(
+            target=_serve,
+            args=(self.server_class, self.files, self.latency,
+                  self.counters, self.options, child_conn),
+            daemon=True,
+        )
+        self.process.start()
+        self.server_address = parent_conn.recv()
+        return self
+
+    def stop(self):
+        self.process.terminate()
+        self.process.join()
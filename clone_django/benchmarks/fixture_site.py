@@ -0,0 +1,136 @@
+"""
+Synthetic fixture sites for end-to-end benchmarks: a page of a given size
+referencing stylesheets, scripts, images and fonts with configurable body
+sizes, served by a fixture server that can fail a share of requests.
+"""
+import asyncio
+import hashlib
+import math
+import random
+
+from .fixture_server import FixtureServer
+
+SIZE_DISTRIBUTIONS = ('fixed', 'uniform', 'lognormal', 'pareto')
+
+# Share of each asset kind; fonts are referenced from stylesheets
+ASSET_MIX = (('css', 0.2), ('js', 0.2), ('img', 0.5), ('font', 0.1))
+
+CONTENT_TYPES = {
+    'css': 'text/css',
+    'js': 'application/javascript',
+    'img': 'image/png',
+    'font': 'font/woff2',
+}
+
+
+def asset_sizes(count, mean_bytes, distribution='fixed', seed=0):
+    """``count`` body sizes averaging about ``mean_bytes``"""
+    rng = random.Random(seed)
+    if distribution == 'fixed':
+        sizes = [mean_bytes] * count
+    elif distribution == 'uniform':
+        sizes = [rng.uniform(0.5, 1.5) * mean_bytes for _ in range(count)]
+    elif distribution == 'lognormal':
+        # sigma=1 gives a long tail; mu chosen so the mean is mean_bytes
+        mu = math.log(mean_bytes) - 0.5
+        sizes = [rng.lognormvariate(mu, 1.0) for _ in range(count)]
+    elif distribution == 'pareto':
+        # alpha=1.5: most bodies small, a few very large
+        alpha = 1.5
+        scale = mean_bytes * (alpha - 1) / alpha
+        sizes = [scale * rng.paretovariate(alpha) for _ in range(count)]
+    else:
+        raise ValueError(f'Unknown size distribution: {distribution}')
+    return [max(16, int(size)) for size in sizes]
+
+
+def _body(kind, size, extra=b''):
+    if kind == 'css':
+        head = b'.a{color:red}' + extra
+        return head + b' ' * max(0, size - len(head))
+    if kind == 'js':
+        return b'var a=1;' + b' ' * max(0, size - 8)
+    if kind == 'img':
+        return b'\x89PNG' + b'\0' * max(0, size - 4)
+    return b'wOF2' + b'\0' * max(0, size - 4)
+
+
+def generate_site(page_bytes=100 * 1024, asset_count=200, asset_bytes=8 * 1024,
+                  distribution='fixed', seed=0):
+    """
+    Build ``{path: (content_type, body)}`` for one page plus its assets.
+    The page is padded with text blocks up to ``page_bytes``.
+    """
+    rng = random.Random(seed)
+    sizes = asset_sizes(asset_count, asset_bytes, distribution, seed)
+
+    kinds = []
+    for kind, share in ASSET_MIX:
+        kinds += [kind] * round(asset_count * share)
+    kinds = (kinds + ['img'] * asset_count)[:asset_count]
+    rng.shuffle(kinds)
+
+    files = {}
+    tags = []
+    fonts = [f'/assets/font/font-{i}.woff2' for i, kind in enumerate(kinds) if kind == 'font']
+    stylesheets = [i for i, kind in enumerate(kinds) if kind == 'css']
+
+    for i, (kind, size) in enumerate(zip(kinds, sizes)):
+        if kind == 'css':
+            path = f'/assets/css/style-{i}.css'
+            # Spread the fonts over the stylesheets so the CSS crawler finds them
+            own_fonts = fonts[stylesheets.index(i)::len(stylesheets)] if stylesheets else []
+            faces = b''.join(
+                b'@font-face{font-family:f%d;src:url("%s")}' % (n, font.encode())
+                for n, font in enumerate(own_fonts))
+            files[path] = (CONTENT_TYPES[kind], _body(kind, size, faces))
+            tags.append(f'<link rel="stylesheet" href="{path}">')
+        elif kind == 'js':
+            path = f'/assets/js/script-{i}.js'
+            files[path] = (CONTENT_TYPES[kind], _body(kind, size))
+            tags.append(f'<script src="{path}"></script>')
+        elif kind == 'img':
+            path = f'/assets/img/image-{i}.png'
+            files[path] = (CONTENT_TYPES[kind], _body(kind, size))
+            tags.append(f'<img src="{path}" alt="Image {i}">')
+        else:
+            files[f'/assets/font/font-{i}.woff2'] = (CONTENT_TYPES[kind], _body(kind, size))
+
+    html = ['<!DOCTYPE html><html><head><title>Fixture site</title></head><body>']
+    html += tags
+    length = sum(len(part) + 1 for part in html)
+    block = 0
+    while length < page_bytes:
+        part = (f'<div class="card"><h2>Section {block}</h2><p>Lorem ipsum dolor '
+                f'sit amet, consectetur adipiscing elit {block}.</p></div>')
+        html.append(part)
+        length += len(part) + 1
+        block += 1
+    html.append('</body></html>')
+
+    files['/'] = ('text/html', '\n'.join(html).encode('utf-8'))
+    return files
+
+
+class FlakyFixtureServer(FixtureServer):
+    """
+    Fixture server that answers 500 for a fixed share of asset paths.
+    Failing paths are picked by hash, so every run fails the same ones.
+    """
+
+    def __init__(self, files, error_rate=0.0, **kwargs):
+        super().__init__(files, **kwargs)
+        self.error_rate = error_rate
+
+    def fails(self, path):
+        if path == '/' or not self.error_rate:
+            return False
+        bucket = int(hashlib.sha1(path.encode('utf-8')).hexdigest()[:8], 16)
+        return bucket / 0xffffffff < self.error_rate
+
+    async def respond(self, method, path, headers):
+        if self.fails(path.split('?')[0]):
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            return 500, {}, b''
+        return await super().respond(method, path, headers)
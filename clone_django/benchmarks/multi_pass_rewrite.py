@@ -0,0 +1,70 @@
+"""
+Link rewriting as it was before the rewrite module, frozen as the
+reference bench_rewrite compares against: one find_all pass over the tree
+per kind of tag, covering only <link href>, <script src>, <img src> and
+data-src.
+
+A verbatim copy of process_html_links from scraper_api/views.py (and
+relative_link from the crawler) at that point; don't update it along with
+views. URLs are still canonicalized with scraper_api's canonical_url.
+"""
+import posixpath
+from urllib.parse import urljoin
+
+from scraper_api.dedup import canonical_url
+
+UNFETCHED_URLS = ('inline', 'data:embedded')
+
+
+def process_html_links(soup, resources, base_url, page_path='index.html'):
+    """
+    Process HTML and update all links to point to local files, relative to
+    page_path (where the page itself is saved)
+    """
+    print("🔗 Processing HTML links...")
+
+    # Create URL to local path mapping, keyed by canonical URL so every
+    # spelling of a deduplicated resource's URL is rewritten
+    url_to_local = {}
+    for resource in resources:
+        if resource['url'] not in UNFETCHED_URLS:
+            url_to_local[canonical_url(resource['url'])] = relative_link(
+                resource['original_path'], page_path)
+
+    # Update CSS links
+    for link in soup.find_all('link', href=True):
+        href = link.get('href')
+        full_url = canonical_url(urljoin(base_url, href))
+        if full_url in url_to_local:
+            link['href'] = url_to_local[full_url]
+
+    # Update script sources
+    for script in soup.find_all('script', src=True):
+        src = script.get('src')
+        full_url = canonical_url(urljoin(base_url, src))
+        if full_url in url_to_local:
+            script['src'] = url_to_local[full_url]
+
+    # Update image sources
+    for img in soup.find_all('img', src=True):
+        src = img.get('src')
+        full_url = canonical_url(urljoin(base_url, src))
+        if full_url in url_to_local:
+            img['src'] = url_to_local[full_url]
+
+    # Update other attributes that might contain URLs
+    for element in soup.find_all(attrs={'data-src': True}):
+        data_src = element.get('data-src')
+        full_url = canonical_url(urljoin(base_url, data_src))
+        if full_url in url_to_local:
+            element['data-src'] = url_to_local[full_url]
+
+    return soup
+
+
+def relative_link(target_path, from_path):
+    """Link to target_path from a file saved at from_path"""
+    from_dir = posixpath.dirname(from_path)
+    if not from_dir:
+        return target_path
+    return posixpath.relpath(target_path, from_dir)
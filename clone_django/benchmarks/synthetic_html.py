@@ -0,0 +1,41 @@
+"""
+Synthetic HTML pages that exercise every discovery rule
+"""
+import random
+
+BLOCK_TEMPLATES = [
+    '<link rel="stylesheet" href="/css/site-{i}.css">',
+    '<link rel="preload" href="/fonts/font-{i}.woff2" as="font">',
+    '<link rel="icon" href="/icons/icon-{i}.png">',
+    '<meta property="og:image" content="https://cdn.example.com/og-{i}.jpg">',
+    '<style>.c{i}{{background:url("/img/bg-{i}.png")}}</style>',
+    '<script>var v{i} = {i};</script>',
+    '<script src="https://cdn.jsdelivr.net/npm/lib-{i}.js"></script>',
+    '<script src="/js/app-{i}.js"></script>',
+    '<img src="/img/photo-{i}.jpg" alt="Photo {i}">',
+    '<img data-src="/img/lazy-{i}.webp">',
+    '<picture><source srcset="/img/a-{i}.avif 1x, /img/a-{i}@2x.avif 2x"><img src="/img/a-{i}.jpg"></picture>',
+    '<div style="background-image: url(/img/hero-{i}.jpg)">Hero</div>',
+    '<video src="/media/clip-{i}.mp4"><source src="/media/clip-{i}.webm"></video>',
+    '<audio><source src="/media/track-{i}.mp3"></audio>',
+    '<embed src="/media/embed-{i}.swf"><object data="/media/object-{i}.svg"></object>',
+    '<a href="/docs/report-{i}.pdf">Report</a>',
+    '<a href="/page-{i}.html">Page</a>',
+    '<p class="text">Lorem ipsum dolor sit amet, consectetur adipiscing elit {i}.</p>',
+    '<div class="card"><span>Item {i}</span><ul><li>a</li><li>b</li></ul></div>',
+]
+
+
+def generate_page(target_bytes, seed=0):
+    """Build an HTML document of roughly target_bytes"""
+    rng = random.Random(seed)
+    parts = ['<!DOCTYPE html><html><head><title>Synthetic page</title></head><body>']
+    size = len(parts[0])
+    i = 0
+    while size < target_bytes:
+        block = rng.choice(BLOCK_TEMPLATES).format(i=i)
+        parts.append(block)
+        size += len(block)
+        i += 1
+    parts.append('</body></html>')
+    return '\n'.join(parts)
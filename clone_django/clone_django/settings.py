@@ -33,6 +33,103 @@ REST_FRAMEWORK = {
     ]
 }
 
+# Scraper settings
+SCRAPER_DOWNLOAD_WORKERS = int(os.environ.get('SCRAPER_DOWNLOAD_WORKERS', 10))
+# Background clone jobs ("background": true on /api/scrape/)
+SCRAPER_MAX_JOBS = int(os.environ.get('SCRAPER_MAX_JOBS', 4))
+SCRAPER_MAX_QUEUED_JOBS = 100
+SCRAPER_JOB_TTL = 60 * 60
+# Pooled sessions and keep-alive connections per host, shared by every clone
+# (defaults to enough for SCRAPER_MAX_JOBS clones downloading at once)
+SCRAPER_POOL_SIZE = (int(os.environ.get('SCRAPER_POOL_SIZE', 0))
+                     or SCRAPER_DOWNLOAD_WORKERS * SCRAPER_MAX_JOBS)
+SCRAPER_POOL_HOSTS = 100
+SCRAPER_RESOURCE_TIMEOUT = 30
+SCRAPER_CONNECT_TIMEOUT = 10
+# Failed downloads (429/5xx, resets, timeouts) are tried again with jittered
+# exponential backoff, waiting at least as long as a Retry-After says
+SCRAPER_RETRY_ATTEMPTS = 4
+SCRAPER_RETRY_BACKOFF = 0.5
+SCRAPER_RETRY_BACKOFF_MAX = 60
+# Adaptive (AIMD) downloads in flight per host: starts at SCRAPER_HOST_CONCURRENCY,
+# grows while responses are fast and clean, halves when they are slower than
+# SCRAPER_HOST_LATENCY_TARGET seconds or more than SCRAPER_HOST_ERROR_RATE of
+# recent tries fail. A 429 caps it under the refused concurrency for
+# SCRAPER_HOST_PROBE_INTERVAL seconds.
+SCRAPER_HOST_CONCURRENCY = 6
+SCRAPER_HOST_MAX_CONCURRENCY = 32
+SCRAPER_HOST_LATENCY_TARGET = 5.0
+SCRAPER_HOST_ERROR_RATE = 0.15
+SCRAPER_HOST_PROBE_INTERVAL = 30
+# 'threads' (ThreadPoolExecutor + requests), 'async' (asyncio + aiohttp) or
+# 'http2' (asyncio + httpx, one multiplexed connection per origin; needs
+# httpx from requirements-optional.txt and falls back to HTTP/1.1 without h2)
+SCRAPER_DOWNLOAD_ENGINE = os.environ.get('SCRAPER_DOWNLOAD_ENGINE', 'threads')
+SCRAPER_ASYNC_CONCURRENCY = 200
+SCRAPER_ASYNC_PER_HOST = 50
+SCRAPER_HTTP2_MAX_CONNECTIONS = 100
+# host:port origins spoken to with HTTP/2 over plain http:// (h2c, prior knowledge)
+SCRAPER_HTTP2_CLEARTEXT_HOSTS = ()
+# Download byte budgets: resources over either one are skipped, not failed.
+# Bodies are read in chunks and spill to disk past SCRAPER_SPOOL_MEMORY_BYTES.
+SCRAPER_MAX_RESOURCE_BYTES = int(os.environ.get('SCRAPER_MAX_RESOURCE_BYTES', 50 * 1024 ** 2))
+SCRAPER_MAX_JOB_BYTES = int(os.environ.get('SCRAPER_MAX_JOB_BYTES', 500 * 1024 ** 2))
+SCRAPER_SPOOL_MEMORY_BYTES = 1024 ** 2
+# Bodies of SCRAPER_RANGED_MIN_BYTES or more from servers that take byte ranges
+# are fetched as SCRAPER_RANGE_SEGMENTS parallel Range requests, checkpointed
+# under SCRAPER_RANGED_ROOT so a failed try carries on where it stopped. Part
+# files making no progress for SCRAPER_RANGED_MAX_AGE seconds are deleted.
+SCRAPER_RANGED_MIN_BYTES = int(os.environ.get('SCRAPER_RANGED_MIN_BYTES', 8 * 1024 ** 2))
+SCRAPER_RANGE_SEGMENTS = 4
+SCRAPER_RANGED_ROOT = BASE_DIR / 'ranged'
+SCRAPER_RANGED_MAX_AGE = 7 * 24 * 60 * 60
+# Clones running at the same time share one download of the same URL
+SCRAPER_COALESCE_DOWNLOADS = True
+# 'inline' (base64 in the JSON) or 'blob' (hash only, body from /api/blob/<hash>/)
+SCRAPER_BINARY_MODE = os.environ.get('SCRAPER_BINARY_MODE', 'inline')
+SCRAPER_BLOB_ROOT = BASE_DIR / 'blobs'
+# Least recently used blobs are deleted past this size, except the bodies of
+# saved snapshots (0: never)
+SCRAPER_BLOB_MAX_BYTES = int(os.environ.get('SCRAPER_BLOB_MAX_BYTES', 5 * 1024 ** 3))
+# Levels of @import / url() nesting followed inside downloaded stylesheets
+SCRAPER_CSS_MAX_DEPTH = 3
+# Multi-page crawl mode defaults (a request can lower or raise them)
+SCRAPER_CRAWL_MAX_DEPTH = 2
+SCRAPER_CRAWL_MAX_PAGES = 50
+SCRAPER_CRAWL_CONCURRENCY = 4
+# Crawled pages bigger than this are left out (listed in failed_pages)
+SCRAPER_CRAWL_MAX_PAGE_BYTES = 10 * 1024 ** 2
+# BeautifulSoup backend for the main page: 'html.parser' or 'lxml'. lxml parses
+# faster, but libxml2 doesn't treat <embed> or <source> inside <picture> as void
+# and nests the markup that follows them.
+SCRAPER_PARSER = os.environ.get('SCRAPER_PARSER', 'html.parser')
+# On-disk HTTP cache for downloaded resources
+SCRAPER_HTTP_CACHE = True
+SCRAPER_HTTP_CACHE_ROOT = BASE_DIR / 'http_cache'
+SCRAPER_HTTP_CACHE_MAX_BYTES = int(os.environ.get('SCRAPER_HTTP_CACHE_MAX_BYTES', 1024 ** 3))
+# Save clones as snapshots ("save": true on /api/scrape/ for one clone); bodies
+# go to the blob store once per distinct content. Needs `manage.py migrate`.
+SCRAPER_SAVE_SNAPSHOTS = os.environ.get('SCRAPER_SAVE_SNAPSHOTS', '') == '1'
+SCRAPER_SNAPSHOT_LIST_LIMIT = 100
+# Optimize clones ("optimize": true for one clone): minify CSS, JS (with rjsmin)
+# and HTML, recompress PNG/JPEG (with Pillow). rjsmin and Pillow are in
+# requirements-optional.txt; without them JS and images are left as they are.
+SCRAPER_OPTIMIZE = os.environ.get('SCRAPER_OPTIMIZE', '') == '1'
+SCRAPER_OPTIMIZE_IMAGE_QUALITY = 85
+# Batch clones (/api/batch/): most URLs per request, pages cloned at once
+SCRAPER_BATCH_MAX_URLS = 10000
+SCRAPER_BATCH_CONCURRENCY = 16
+# Worker processes for CPU-bound work (optimizing, batch page rendering);
+# None for one per CPU
+SCRAPER_PROCESS_WORKERS = None
+# Compression of API responses, in order of preference among the codings a
+# client accepts ('zstd' needs zstandard, 'br' needs brotli). Clone responses
+# are also offered as MessagePack (Accept: application/msgpack) with msgpack.
+# All three are in requirements-optional.txt.
+SCRAPER_RESPONSE_ENCODINGS = ('zstd', 'br', 'gzip')
+SCRAPER_COMPRESS_LEVELS = {'gzip': 6, 'br': 5, 'zstd': 3}
+SCRAPER_COMPRESS_MIN_BYTES = 1024
+
 
 # Application definition
 
@@ -51,6 +148,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'scraper_api.compression.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
@@ -150,6 +248,10 @@ LOGGING = {
         'handlers': ['console'],
         'level': 'INFO',
     },
+    'loggers': {
+        # The http2 engine's client logs every request at INFO
+        'httpx': {'level': 'WARNING'},
+    },
 }
 
 
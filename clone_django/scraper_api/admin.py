@@ -1,3 +1,30 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import Blob, Snapshot, SnapshotPage, SnapshotResource
+
+
+@admin.register(Snapshot)
+class SnapshotAdmin(admin.ModelAdmin):
+    list_display = ('id', 'url', 'title', 'crawl', 'created_at')
+    list_filter = ('crawl',)
+    search_fields = ('url', 'title')
+
+
+@admin.register(SnapshotPage)
+class SnapshotPageAdmin(admin.ModelAdmin):
+    list_display = ('id', 'snapshot', 'path', 'url', 'depth')
+    raw_id_fields = ('snapshot', 'html')
+
+
+@admin.register(SnapshotResource)
+class SnapshotResourceAdmin(admin.ModelAdmin):
+    list_display = ('id', 'snapshot', 'url', 'category', 'size', 'hash')
+    list_filter = ('category',)
+    search_fields = ('url', 'hash')
+    raw_id_fields = ('snapshot', 'blob')
+
+
+@admin.register(Blob)
+class BlobAdmin(admin.ModelAdmin):
+    list_display = ('digest', 'size', 'content_type', 'created_at')
+    search_fields = ('digest',)
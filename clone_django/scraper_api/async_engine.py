@@ -0,0 +1,282 @@
+import asyncio
+from functools import partial
+
+from django.conf import settings
+
+from .transport import get_connect_timeout, get_resource_timeout
+from .http_cache import store_cached
+from .spool import SPOOL_CHUNK_SIZE, BodySpooler
+from .coalesce import store_coalesced
+from .incremental import record_validators
+from .metrics import in_flight
+from .throttle import HostScheduler, RetryableError, check_status
+from .ranged import accepts_ranges, download_ranged, has_checkpoint
+from .http2 import TRANSPORT_ERRORS, Http2Session
+
+try:
+    import aiohttp
+except ImportError:  # pragma: no cover - optional dependency
+    aiohttp = None
+
+# Connection and body read failures worth another try, for either client
+RETRYABLE_ERRORS = TRANSPORT_ERRORS + (
+    (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError) if aiohttp else ())
+
+
+def get_async_concurrency():
+    """Maximum downloads in flight on the event loop"""
+    return getattr(settings, 'SCRAPER_ASYNC_CONCURRENCY', 200)
+
+
+def get_async_per_host():
+    """Maximum downloads in flight against a single host"""
+    return getattr(settings, 'SCRAPER_ASYNC_PER_HOST', 50)
+
+
+def download_all_resources_async(resources, headers, store_body, on_complete=None,
+                                 cache=None, spooler=None, flights=None, baseline=None,
+                                 http2=False):
+    """
+    Download resources concurrently on a single asyncio event loop.
+
+    ``store_body(resource, content, content_type, text=None)`` fills each
+    resource dict exactly like the threaded engine, and
+    ``on_complete(resource)`` is called as each download finishes; any
+    resources it returns are scheduled on the same loop. Downloads start as
+    each host's adaptive window allows, and failed tries are retried after
+    a backoff. ``cache`` is an optional HttpCache, ``spooler`` the clone's
+    BodySpooler, ``flights`` an optional SingleFlight shared with other
+    clones and ``baseline`` the previous snapshot of an incremental clone.
+
+    With ``http2`` the downloads go through an httpx client that multiplexes
+    them over one HTTP/2 connection per origin (see http2.Http2Session)
+    instead of aiohttp's HTTP/1.1 connection pool.
+    """
+    if aiohttp is None and not http2:
+        raise RuntimeError(
+            "The async download engine requires aiohttp (pip install -r requirements.txt)")
+
+    asyncio.run(_download_all(
+        resources, headers, store_body, on_complete, cache, spooler or BodySpooler(),
+        flights, baseline, http2))
+
+
+def open_session(headers, timeout, http2=False):
+    """The client session downloads of one clone go through"""
+    connect_timeout = min(get_connect_timeout(), timeout)
+    if http2:
+        return Http2Session(headers, timeout, connect_timeout)
+
+    # The connector enforces both the global and the per-host caps
+    connector = aiohttp.TCPConnector(
+        limit=get_async_concurrency(),
+        limit_per_host=get_async_per_host(),
+    )
+    return aiohttp.ClientSession(
+        headers=headers, connector=connector,
+        timeout=aiohttp.ClientTimeout(total=timeout, sock_connect=connect_timeout))
+
+
+async def _download_all(resources, headers, store_body, on_complete, cache, spooler,
+                        flights, baseline, http2=False):
+    timeout = get_resource_timeout()
+
+    async with open_session(headers, timeout, http2) as session:
+
+        scheduler = HostScheduler()
+        pending = {}
+        # Past the connector's cap a task would only wait for a connection
+        concurrency = get_async_concurrency()
+
+        async def download(resource):
+            with in_flight('http2' if http2 else 'async'):
+                return await _download_single_resource(
+                    session, resource, store_body, timeout, cache, spooler, flights,
+                    baseline, headers)
+
+        def start_ready():
+            for resource in scheduler.ready(concurrency - len(pending)):
+                task = asyncio.ensure_future(download(resource))
+                pending[task] = resource
+
+        for resource in resources:
+            scheduler.add(resource)
+        start_ready()
+
+        # New downloads can be scheduled until the last one finishes
+        while pending or scheduler:
+            if not pending:
+                # Only retries waiting out their backoff
+                await asyncio.sleep(scheduler.wait_time())
+                start_ready()
+                continue
+
+            done, _ = await asyncio.wait(
+                pending, timeout=scheduler.wait_time(),
+                return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                resource = pending.pop(task)
+                try:
+                    task.result()
+                except RetryableError as e:
+                    scheduler.finished(resource, e)
+                    if scheduler.retry(resource, e):
+                        print(f"🔁 Retrying {resource['filename']} ({e})")
+                        continue
+                    resource['error'] = str(e)
+                    resource['downloaded'] = False
+                else:
+                    scheduler.finished(resource)
+
+                for nested in (on_complete(resource) if on_complete else None) or ():
+                    scheduler.add(nested)
+            start_ready()
+
+
+def _store_download(resource, body, response_headers, store_body, cache=None,
+                    flights=None, flight=None):
+    """Share, cache and store a downloaded body, then close it"""
+    with body:
+        content_type = response_headers.get('content-type', '')
+        if flights:
+            flights.finish(resource['url'], flight, body, content_type)
+
+        if cache:
+            cache.store(resource['url'], body, response_headers)
+            resource['cache'] = 'miss'
+            body.seek(0)
+
+        store_body(resource, body, content_type)
+        record_validators(resource, response_headers)
+
+
+async def _download_single_resource(session, resource, store_body, timeout, cache=None,
+                                    spooler=None, flights=None, baseline=None, headers=None):
+    """
+    Download a single resource, bounded by the per-resource timeout. The
+    body is read in chunks into a spooled file within the spooler's budgets.
+    A URL another clone is already downloading is waited for instead, and
+    one in the baseline snapshot is revalidated. Raises RetryableError for
+    a try worth repeating.
+
+    A large body the server serves by ranges is downloaded in segments by
+    ranged.download_ranged (its requests sent with headers), which isn't
+    bound by the per-resource timeout.
+
+    Everything that reads or writes whole bodies (the cache, store_body,
+    sharing with waiting clones) runs in a worker thread, so one large
+    body doesn't hold up the other downloads on the loop.
+    """
+    spooler = spooler or BodySpooler()
+    flight, leader = None, False
+    try:
+        entry, fresh = (await asyncio.to_thread(cache.lookup, resource['url'])
+                        if cache else (None, False))
+
+        if fresh:
+            stored = await asyncio.to_thread(
+                store_cached, resource, cache, entry, store_body, spooler)
+            if stored is None:
+                entry = None  # Evicted since the lookup
+            elif not stored:
+                return False
+            else:
+                record_validators(resource, entry['headers'])
+                resource['cache'] = 'hit'
+                return True
+
+        if flights:
+            flight, leader = flights.join(resource['url'])
+            if not leader:
+                # The leader may be on another clone's loop or thread
+                shared = await asyncio.to_thread(flight.wait, timeout)
+                stored = await asyncio.to_thread(
+                    store_coalesced, resource, flight, shared, store_body, spooler)
+                if stored is not None:
+                    return stored
+
+        previous = not entry and baseline is not None and resource['url'] in baseline
+        if entry:
+            request_headers = cache.conditional_headers(entry)
+        elif previous:
+            request_headers = baseline.conditional_headers(resource['url'])
+        else:
+            request_headers = None
+
+        if not entry and not previous and has_checkpoint(resource):
+            # An earlier try stopped part way, carry on where it did
+            body, response_headers = await asyncio.to_thread(
+                download_ranged, resource, headers or {}, spooler)
+            if body is None:
+                return False
+        else:
+            async with session.get(resource['url'], headers=request_headers) as response:
+                if entry and response.status == 304:
+                    await asyncio.to_thread(cache.refresh, entry, response.headers)
+                    stored = await asyncio.to_thread(
+                        store_cached, resource, cache, entry, store_body, spooler,
+                        partial(flights.finish, resource['url'], flight) if leader else None)
+                    if stored is None:
+                        raise RetryableError('Cached body evicted while revalidating')
+                    if not stored:
+                        return False
+                    record_validators(resource, entry['headers'])
+                    resource['cache'] = 'revalidated'
+                    return True
+
+                if previous and response.status == 304:
+                    return await asyncio.to_thread(
+                        baseline.reuse, resource, store_body, spooler)
+
+                check_status(response.status, response.headers)
+                response.raise_for_status()
+
+                response_headers = response.headers
+                ranged = resource.get('ranged') is not False and accepts_ranges(response_headers)
+                if not ranged:
+                    content_length = response_headers.get('content-length')
+                    if not spooler.admit(resource, content_length):
+                        return False
+
+                    # Spills to disk past SCRAPER_SPOOL_MEMORY_BYTES; chunk writes
+                    # are small enough to do on the loop
+                    body = spooler.new_file()
+                    try:
+                        async for chunk in response.content.iter_chunked(SPOOL_CHUNK_SIZE):
+                            if not spooler.write(resource, body, chunk, content_length):
+                                body.close()
+                                return False
+                    except BaseException:
+                        spooler.discard(body)
+                        raise
+                    body.seek(0)
+
+            if ranged:
+                # Closed unread: the body is fetched again by Range requests,
+                # in a thread as they go through requests
+                body, response_headers = await asyncio.to_thread(
+                    download_ranged, resource, headers or {}, spooler, response_headers)
+                if body is None:
+                    return False
+
+        await asyncio.to_thread(
+            _store_download, resource, body, response_headers, store_body, cache,
+            flights if leader else None, flight)
+        return True
+
+    except RetryableError:
+        raise
+    except asyncio.TimeoutError as e:
+        raise RetryableError(f'Timed out after {timeout}s') from e
+    except RETRYABLE_ERRORS as e:
+        raise RetryableError(str(e) or type(e).__name__) from e
+    except Exception as e:
+        resource['error'] = str(e)
+        resource['downloaded'] = False
+        return False
+
+    finally:
+        # Waiters take the error, or download it themselves after a skip
+        # or a failed try
+        if leader:
+            flights.finish(resource['url'], flight, error=resource.get('error'))
@@ -0,0 +1,68 @@
+"""
+Batch clones (/api/batch/): many single-page clones from one request,
+streamed back as each finishes.
+
+A thread per clone in flight fetches its page and downloads its
+resources, which is waiting on I/O. Parsing the page, discovering what
+it references and rendering the rewritten HTML run in the shared process
+pool, so large batches use every core rather than one GIL.
+"""
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.conf import settings
+
+
+def get_batch_max_urls():
+    """Most URLs one batch request may submit"""
+    return getattr(settings, 'SCRAPER_BATCH_MAX_URLS', 10000)
+
+
+def get_batch_concurrency():
+    """Pages of a batch cloned at the same time"""
+    return getattr(settings, 'SCRAPER_BATCH_CONCURRENCY', 16)
+
+
+def read_batch_urls(data):
+    """
+    Validate the 'urls' of a batch request.
+    Returns (urls, error) where error is a message for a 400 response.
+    """
+    urls = data.get('urls')
+    if not isinstance(urls, list) or not urls:
+        return None, 'urls must be a non-empty list'
+    if not all(isinstance(url, str) and url.strip() for url in urls):
+        return None, 'urls must all be non-empty strings'
+    if len(urls) > get_batch_max_urls():
+        return None, f'A batch takes at most {get_batch_max_urls()} urls'
+    return [url.strip() for url in urls], None
+
+
+def run_batch(items, work, concurrency=None):
+    """
+    Call work(item) for every item, concurrency at a time, and yield
+    (index, result, error) as each call finishes. Only calls in flight are
+    held, however long the batch is; closing the generator (the client
+    went away) cancels those not started yet.
+    """
+    concurrency = concurrency or get_batch_concurrency()
+    pending = {}
+    queued = iter(enumerate(items))
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+
+    def submit_next():
+        for index, item in queued:
+            pending[executor.submit(work, item)] = index
+            return
+
+    try:
+        for _ in range(concurrency):
+            submit_next()
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = pending.pop(future)
+                submit_next()
+                error = future.exception()
+                yield index, None if error else future.result(), error
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,206 @@
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import DatabaseError
+
+from .spool import iter_body
+
+BLOB_HASH_RE = re.compile(r'^[0-9a-f]{64}$')
+
+
+# Digests looked up at once when checking which blobs are pinned
+PIN_BATCH_SIZE = 500
+
+
+class BlobStore:
+    """
+    Content-addressed store for resource bodies, keyed by SHA-256.
+
+    Identical bodies fetched under different URLs land on the same file, so
+    each distinct body is written (and served) once.
+
+    With max_bytes, the least recently used blobs are deleted once the store
+    grows past it, except pinned ones: keep(digests) returns those of the
+    digests that must stay. A blob's mtime is its last use, so LRU order
+    survives restarts.
+    """
+
+    def __init__(self, root, max_bytes=None, keep=None):
+        self.root = str(root)
+        self.max_bytes = max_bytes
+        self.keep = keep
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # digest -> size, least recently used first
+        self._total_bytes = 0
+        self._load_index()
+
+    def _load_index(self):
+        found = []
+        try:
+            subdirs = [entry.path for entry in os.scandir(self.root) if entry.is_dir()]
+        except OSError:
+            subdirs = []
+        for subdir in subdirs:
+            for entry in os.scandir(subdir):
+                if BLOB_HASH_RE.match(entry.name):
+                    stat = entry.stat()
+                    found.append((stat.st_mtime, entry.name, stat.st_size))
+        for _, digest, size in sorted(found):
+            self._entries[digest] = size
+            self._total_bytes += size
+
+    def path(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    def exists(self, digest):
+        return os.path.exists(self.path(digest))
+
+    def put(self, content, content_type=''):
+        """
+        Store a body (bytes or a readable file) and return its SHA-256 hex
+        digest. Files are hashed while they are copied, in chunks.
+        """
+        os.makedirs(self.root, exist_ok=True)
+        # Write to a temporary file first so readers never see partial blobs
+        fd, tmp_path = tempfile.mkstemp(dir=self.root)
+        hasher = hashlib.sha256()
+        size = 0
+        with os.fdopen(fd, 'wb') as tmp:
+            for chunk in iter_body(content):
+                hasher.update(chunk)
+                tmp.write(chunk)
+                size += len(chunk)
+
+        digest = hasher.hexdigest()
+        path = self.path(digest)
+        if os.path.exists(path):
+            os.remove(tmp_path)
+            self._touch(digest)
+            return digest
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp_path + '.json', 'w') as meta:
+            json.dump({'content_type': content_type, 'size': size}, meta)
+        os.replace(tmp_path + '.json', path + '.json')
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._total_bytes -= self._entries.pop(digest, 0)
+            self._entries[digest] = size
+            self._total_bytes += size
+        self._evict()
+        return digest
+
+    def open(self, digest):
+        """Open a blob for reading and mark it as recently used"""
+        body = open(self.path(digest), 'rb')
+        self._touch(digest)
+        return body
+
+    def _touch(self, digest):
+        try:
+            os.utime(self.path(digest))
+        except OSError:
+            pass
+        with self._lock:
+            if digest in self._entries:
+                self._entries.move_to_end(digest)
+
+    def _evict(self):
+        """
+        Delete least recently used blobs until under the byte budget.
+        Pinned blobs are moved to the most recently used end instead, so
+        they aren't looked up again on every put.
+        """
+        if not self.max_bytes:
+            return
+        pinned_count = 0
+        while True:
+            with self._lock:
+                excess = self._total_bytes - self.max_bytes
+                unpinned = len(self._entries) - pinned_count
+                batch = []
+                for digest, size in self._entries.items():
+                    if excess <= 0 or len(batch) >= min(unpinned, PIN_BATCH_SIZE):
+                        break
+                    batch.append(digest)
+                    excess -= size
+            if not batch:
+                return
+
+            pinned = self.keep(batch) if self.keep else set()
+            for digest in batch:
+                with self._lock:
+                    if digest in pinned:
+                        if digest in self._entries:
+                            self._entries.move_to_end(digest)
+                            pinned_count += 1
+                        continue
+                    size = self._entries.pop(digest, None)
+                    if size is None:
+                        continue
+                    self._total_bytes -= size
+                for path in (self.path(digest), self.path(digest) + '.json'):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+
+    @property
+    def total_bytes(self):
+        return self._total_bytes
+
+    def meta(self, digest):
+        try:
+            with open(self.path(digest) + '.json') as meta:
+                return json.load(meta)
+        except (OSError, ValueError):
+            return {'content_type': '', 'size': os.path.getsize(self.path(digest))}
+
+
+_blob_store = None
+_blob_store_lock = threading.Lock()
+
+
+def saved_digests(digests):
+    """
+    Those of digests that saved snapshots use (they have a Blob row), so the
+    store never prunes them. All of them while the database can't tell.
+    """
+    from .models import Blob
+
+    try:
+        return set(Blob.objects.filter(digest__in=digests).values_list('digest', flat=True))
+    except DatabaseError:
+        return set(digests)
+
+
+def get_blob_store():
+    """
+    Process-wide blob store rooted at SCRAPER_BLOB_ROOT, pruned to
+    SCRAPER_BLOB_MAX_BYTES
+    """
+    global _blob_store
+    if _blob_store is None:
+        with _blob_store_lock:
+            if _blob_store is None:
+                _blob_store = BlobStore(
+                    getattr(settings, 'SCRAPER_BLOB_ROOT',
+                            os.path.join(settings.BASE_DIR, 'blobs')),
+                    getattr(settings, 'SCRAPER_BLOB_MAX_BYTES', 5 * 1024 ** 3),
+                    keep=saved_digests)
+    return _blob_store
+
+
+BINARY_MODES = ('inline', 'blob')
+
+
+def get_binary_mode():
+    """Default transport for binary bodies ('inline' base64 or 'blob')"""
+    return getattr(settings, 'SCRAPER_BINARY_MODE', 'inline')
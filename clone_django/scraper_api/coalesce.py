@@ -0,0 +1,161 @@
+import io
+import os
+import tempfile
+import threading
+
+from django.conf import settings
+
+from .dedup import canonical_url
+from .spool import body_size, iter_body
+
+
+def get_coalesce_downloads():
+    """Whether concurrent clones share downloads of the same URL"""
+    return getattr(settings, 'SCRAPER_COALESCE_DOWNLOADS', True)
+
+
+class SharedBody(io.FileIO):
+    """
+    One waiter's handle on the body a leader shared; the file is removed
+    once the last waiter closes its handle
+    """
+
+    def __init__(self, flight):
+        super().__init__(flight.path, 'rb')
+        self._flight = flight
+
+    def close(self):
+        if not self.closed:
+            super().close()
+            self._flight._release()
+
+
+class Flight:
+    """One download in progress, which other clones can wait for"""
+
+    def __init__(self):
+        self.waiters = 0
+        self.path = None
+        self.content_type = None
+        self.error = None
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+
+    def wait(self, timeout=None):
+        """
+        Block until the leading download finishes. Returns (body, content
+        type), the body a file of its own to read and close, or None if
+        the leader failed, was skipped or timed out; error is set when the
+        failure should be shared.
+        """
+        if not self._done.wait(timeout):
+            with self._lock:
+                if not self._done.is_set():
+                    # Gone: the leader doesn't keep the body around for us
+                    self.waiters -= 1
+                    return None
+        if self.path is None:
+            return None
+        return SharedBody(self), self.content_type
+
+    def _release(self):
+        with self._lock:
+            self.waiters -= 1
+            if self.waiters:
+                return
+        os.remove(self.path)
+
+
+class SingleFlight:
+    """
+    Process-wide registry of resource downloads in flight, keyed by
+    canonical URL. The first clone to ask for a URL downloads it; clones
+    asking while that download runs wait for it and get a copy of the body
+    instead of fetching it again.
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def join(self, url):
+        """Returns (flight, leader): leader is True for the caller that downloads"""
+        key = canonical_url(url)
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                with flight._lock:
+                    flight.waiters += 1
+                return flight, False
+            flight = self._flights[key] = Flight()
+            return flight, True
+
+    def finish(self, url, flight, body=None, content_type=None, error=None):
+        """
+        Hand the leader's result to the waiting clones. body is bytes or a
+        file; if someone is waiting it is copied, in chunks, to a temporary
+        file each waiter opens on its own, and a file body is rewound
+        afterwards. With neither body nor error (a skipped resource)
+        waiters download the URL themselves.
+        """
+        if flight._done.is_set():
+            return
+        with self._lock:
+            # No one can join from here on
+            if self._flights.get(canonical_url(url)) is flight:
+                del self._flights[canonical_url(url)]
+        with flight._lock:
+            if flight.waiters and body is not None:
+                fd, path = tempfile.mkstemp(prefix='flight-')
+                try:
+                    with os.fdopen(fd, 'wb') as shared:
+                        for chunk in iter_body(body):
+                            shared.write(chunk)
+                except OSError:
+                    os.remove(path)  # Waiters download it themselves
+                else:
+                    flight.path = path
+                    flight.content_type = content_type
+                if not isinstance(body, (bytes, bytearray)):
+                    body.seek(0)
+            flight.error = error
+            flight._done.set()
+
+
+def store_coalesced(resource, flight, shared, store_body, spooler):
+    """
+    Fill a resource from another clone's download of the same URL, given
+    what flight.wait() returned. Returns True when stored, False when the
+    resource failed or is over budget, None when the caller should
+    download it itself.
+    """
+    if shared is None:
+        if flight.error is None:
+            return None
+        resource['error'] = flight.error
+        resource['downloaded'] = False
+        return False
+
+    body, content_type = shared
+    with body:
+        if not spooler.admit_body(resource, body_size(body)):
+            return False
+        store_body(resource, body, content_type)
+    resource['coalesced'] = True
+    return True
+
+
+_single_flight = None
+_single_flight_lock = threading.Lock()
+
+
+def get_single_flight():
+    """Process-wide download registry, or None when SCRAPER_COALESCE_DOWNLOADS is off"""
+    global _single_flight
+    if not get_coalesce_downloads():
+        return None
+    if _single_flight is None:
+        with _single_flight_lock:
+            if _single_flight is None:
+                _single_flight = SingleFlight()
+    return _single_flight
@@ -0,0 +1,199 @@
+"""
+Compressed API responses.
+
+Clone responses (JSON, NDJSON streams, MessagePack) are compressed with
+the coding the client prefers out of SCRAPER_RESPONSE_ENCODINGS: zstd and
+br when zstandard / brotli are installed, gzip always. Streamed responses
+are compressed as they go and flushed after every record, so a client
+still sees each resource as soon as its download finishes.
+"""
+import re
+import zlib
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    try:
+        import brotlicffi as brotli
+    except ImportError:
+        brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional dependency
+    zstandard = None
+
+# Codings this process can produce
+AVAILABLE_ENCODINGS = tuple(
+    coding for coding, available in (
+        ('zstd', zstandard is not None), ('br', brotli is not None), ('gzip', True))
+    if available)
+
+# What resource downloads may come back in; requests, aiohttp and httpx
+# only decode br with a brotli package installed
+UPSTREAM_ACCEPT_ENCODING = 'gzip, deflate, br' if brotli is not None else 'gzip, deflate'
+
+# Only API payloads: HTML pages carry CSRF tokens (BREACH), and images,
+# fonts and zip exports are compressed already
+COMPRESSIBLE_TYPES = frozenset((
+    'application/json', 'application/x-ndjson', 'application/msgpack'))
+
+DEFAULT_LEVELS = {'gzip': 6, 'br': 5, 'zstd': 3}
+
+ACCEPT_ENCODING_RE = re.compile(r'^\s*([\w*-]+)\s*(?:;\s*q\s*=\s*([\d.]+))?\s*$')
+
+
+def get_response_encodings():
+    """Codings offered to clients, most preferred first"""
+    return getattr(settings, 'SCRAPER_RESPONSE_ENCODINGS', ('zstd', 'br', 'gzip'))
+
+
+def get_compress_min_bytes():
+    """Smaller responses are sent as they are"""
+    return getattr(settings, 'SCRAPER_COMPRESS_MIN_BYTES', 1024)
+
+
+def get_compress_level(coding):
+    return getattr(settings, 'SCRAPER_COMPRESS_LEVELS', {}).get(coding, DEFAULT_LEVELS[coding])
+
+
+def parse_accept_encoding(header):
+    """{coding: q} of an Accept-Encoding header"""
+    accepted = {}
+    for part in (header or '').split(','):
+        match = ACCEPT_ENCODING_RE.match(part)
+        if not match:
+            continue
+        try:
+            q = float(match.group(2)) if match.group(2) else 1.0
+        except ValueError:
+            continue
+        accepted[match.group(1).lower()] = q
+    return accepted
+
+
+def negotiate_encoding(header):
+    """
+    The coding to compress a response with: the highest q the client
+    gives one we offer, ties going to our order. None for identity.
+    """
+    accepted = parse_accept_encoding(header)
+    best, best_q = None, 0.0
+    for coding in get_response_encodings():
+        if coding not in AVAILABLE_ENCODINGS:
+            continue
+        q = accepted.get(coding, accepted.get('*', 0.0))
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+class Compressor:
+    """Incremental compressor for one response body"""
+
+    def __init__(self, coding, level=None):
+        level = get_compress_level(coding) if level is None else level
+        self.coding = coding
+        if coding == 'gzip':
+            self._obj = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        elif coding == 'br':
+            self._obj = brotli.Compressor(quality=level)
+        elif coding == 'zstd':
+            self._obj = zstandard.ZstdCompressor(level=level).compressobj()
+        else:
+            raise ValueError(f'Unsupported coding: {coding}')
+
+    def compress(self, data, flush=False):
+        """
+        Compress a chunk. With flush, everything so far is emitted, so the
+        client can decode it without waiting for the next chunk.
+        """
+        if self.coding == 'br':
+            out = self._obj.process(data)
+            return out + self._obj.flush() if flush else out
+        out = self._obj.compress(data)
+        if not flush:
+            return out
+        if self.coding == 'gzip':
+            return out + self._obj.flush(zlib.Z_SYNC_FLUSH)
+        return out + self._obj.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self):
+        if self.coding == 'br':
+            return self._obj.finish()
+        return self._obj.flush()
+
+
+def compress_body(body, coding, level=None):
+    compressor = Compressor(coding, level)
+    return compressor.compress(body) + compressor.finish()
+
+
+def decompress_body(body, coding):
+    """Inverse of compress_body (for clients and benchmarks)"""
+    if coding == 'gzip':
+        return zlib.decompress(body, 16 + zlib.MAX_WBITS)
+    if coding == 'br':
+        return brotli.decompress(body)
+    if coding == 'zstd':
+        return zstandard.ZstdDecompressor().decompressobj().decompress(body)
+    raise ValueError(f'Unsupported coding: {coding}')
+
+
+def compress_stream(chunks, coding):
+    compressor = Compressor(coding)
+    for chunk in chunks:
+        out = compressor.compress(chunk, flush=True)
+        if out:
+            yield out
+    yield compressor.finish()
+
+
+def is_compressible(response):
+    if response.has_header('Content-Encoding') or getattr(response, 'is_async', False):
+        return False
+    content_type = response.get('Content-Type', '').split(';')[0].strip().lower()
+    return content_type in COMPRESSIBLE_TYPES
+
+
+class CompressionMiddleware:
+    """
+    Compress API payloads with the best coding the client accepts. Like
+    Django's GZipMiddleware, but with brotli and zstd, and streaming
+    responses flushed per chunk.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if not is_compressible(response):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        coding = negotiate_encoding(request.META.get('HTTP_ACCEPT_ENCODING'))
+        if coding is None:
+            return response
+
+        if response.streaming:
+            response.streaming_content = compress_stream(response.streaming_content, coding)
+            del response['Content-Length']
+        else:
+            if len(response.content) < get_compress_min_bytes():
+                return response
+            compressed = compress_body(response.content, coding)
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response['Content-Length'] = str(len(compressed))
+
+        # The compressed body is a different representation of the same ETag
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        response['Content-Encoding'] = coding
+        return response
@@ -0,0 +1,148 @@
+import hashlib
+import posixpath
+from collections import deque
+from urllib.parse import urlsplit, unquote
+
+import requests
+from django.conf import settings
+
+from .dedup import canonical_url
+
+CRAWL_SCOPES = ('origin', 'prefix')
+
+# Extensions of links that are pages worth crawling (no extension counts too)
+PAGE_EXTENSIONS = ('', '.html', '.htm', '.xhtml', '.php', '.asp', '.aspx', '.jsp')
+
+
+def get_crawl_max_depth():
+    """Default number of link hops followed from the seed page"""
+    return getattr(settings, 'SCRAPER_CRAWL_MAX_DEPTH', 2)
+
+
+def get_crawl_max_pages():
+    """Default cap on pages fetched by one crawl"""
+    return getattr(settings, 'SCRAPER_CRAWL_MAX_PAGES', 50)
+
+
+def get_crawl_concurrency():
+    """Pages fetched in parallel by one crawl"""
+    return getattr(settings, 'SCRAPER_CRAWL_CONCURRENCY', 4)
+
+
+def get_crawl_max_page_bytes():
+    """Largest page body a crawl reads; bigger pages are left out"""
+    return getattr(settings, 'SCRAPER_CRAWL_MAX_PAGE_BYTES', 10 * 1024 ** 2)
+
+
+class PageTooLarge(requests.exceptions.RequestException):
+    """A crawled page's body is over the page byte budget"""
+
+
+def normalize_url(url):
+    """Canonical form of a page URL used for deduplication"""
+    return canonical_url(url)
+
+
+def is_page_url(url):
+    """Whether a link looks like an HTML page rather than an asset"""
+    path = urlsplit(url).path
+    return posixpath.splitext(path)[1].lower() in PAGE_EXTENSIONS
+
+
+def page_local_path(url, seed_url, taken=None):
+    """
+    Where a crawled page is saved: the seed is index.html, every other page
+    mirrors its URL path (directories get index.html, extensionless paths
+    get .html, query strings become a short hash suffix).
+
+    taken is the set of paths given out so far in the crawl; a path some
+    other page has (/ and /index.html, /about and /about.html) gets a short
+    hash of the URL as well, and the result is added to it.
+    """
+    if url == seed_url:
+        path = 'index.html'
+    else:
+        parts = urlsplit(url)
+        path = unquote(parts.path).lstrip('/')
+        if not path or path.endswith('/'):
+            path += 'index.html'
+        elif not path.lower().endswith(('.html', '.htm')):
+            path += '.html'
+
+        if parts.query:
+            path = hash_suffixed(path, parts.query)
+
+    if taken is not None:
+        if path in taken:
+            path = hash_suffixed(path, url)
+        taken.add(path)
+    return path
+
+
+def hash_suffixed(path, key):
+    """path with a short hash of key before its extension"""
+    stem, ext = posixpath.splitext(path)
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:8]
+    return f'{stem}-{digest}{ext}'
+
+
+def relative_link(target_path, from_path):
+    """Link to target_path from a file saved at from_path"""
+    from_dir = posixpath.dirname(from_path)
+    if not from_dir:
+        return target_path
+    return posixpath.relpath(target_path, from_dir)
+
+
+class CrawlScope:
+    """
+    Which URLs a crawl may follow: the seed's origin, or with 'prefix' only
+    pages under the seed's directory
+    """
+
+    def __init__(self, seed_url, scope='origin'):
+        parts = urlsplit(seed_url)
+        self.origin = (parts.scheme, parts.netloc)
+        self.prefix = parts.path[:parts.path.rfind('/') + 1] if scope == 'prefix' else '/'
+
+    def __contains__(self, url):
+        parts = urlsplit(url)
+        return ((parts.scheme, parts.netloc) == self.origin
+                and parts.path.startswith(self.prefix))
+
+
+class Frontier:
+    """
+    Breadth-first queue of pages to crawl. URLs are normalized before the
+    duplicate check, and nothing past max_depth or max_pages is queued.
+    """
+
+    def __init__(self, seed_url, max_depth, max_pages, scope='origin'):
+        self.seed = normalize_url(seed_url)
+        self.scope = CrawlScope(self.seed, scope)
+        self.max_depth = max_depth
+        self.max_pages = max_pages
+        self.seen = {self.seed}
+        self._queue = deque([(self.seed, 0)])
+
+    def add(self, url, depth):
+        """Queue a discovered link, returns whether it was new"""
+        if depth > self.max_depth or len(self.seen) >= self.max_pages:
+            return False
+        if not url.startswith(('http://', 'https://')) or not is_page_url(url):
+            return False
+
+        url = normalize_url(url)
+        if url in self.seen or url not in self.scope:
+            return False
+
+        self.seen.add(url)
+        self._queue.append((url, depth))
+        return True
+
+    def pop(self):
+        """Next (url, depth) to fetch"""
+        return self._queue.popleft()
+
+    def __bool__(self):
+        return bool(self._queue)
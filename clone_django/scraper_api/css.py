@@ -0,0 +1,40 @@
+import re
+
+from django.conf import settings
+
+# url(...) with optional quotes, e.g. url(a.png), url("a.png"), url( 'a.png' )
+CSS_URL_RE = re.compile(r'url\(\s*(["\']?)([^"\')]+)\1\s*\)', re.I)
+# @import "a.css"; / @import url(a.css) screen;
+CSS_IMPORT_RE = re.compile(
+    r'@import\s+(?:url\(\s*)?(["\']?)([^"\')\s;]+)\1', re.I)
+# @import "a.css"; (the url() form is matched by CSS_URL_RE)
+CSS_IMPORT_STRING_RE = re.compile(r'@import\s+(["\'])([^"\']+)\1', re.I)
+
+
+def get_css_max_depth():
+    """How many levels of stylesheet nesting (@import chains) to follow"""
+    return getattr(settings, 'SCRAPER_CSS_MAX_DEPTH', 3)
+
+
+def is_stylesheet(resource):
+    """Whether a downloaded resource holds CSS text we can scan"""
+    if not resource.get('downloaded') or resource.get('is_binary'):
+        return False
+    return (resource.get('category') == 'css'
+            or 'text/css' in (resource.get('content_type') or '').lower())
+
+
+def find_css_references(css_text):
+    """
+    Every URL a stylesheet references, as (url, is_import) pairs with the
+    @imports first. Data URLs and fragment-only references are skipped.
+    """
+    imports = [m.group(2) for m in CSS_IMPORT_RE.finditer(css_text)]
+    references = [(ref, True) for ref in imports]
+    for match in CSS_URL_RE.finditer(css_text):
+        ref = match.group(2).strip()
+        if ref not in imports:
+            references.append((ref, False))
+
+    return [(ref, is_import) for ref, is_import in references
+            if ref and not ref.startswith(('data:', '#'))]
@@ -0,0 +1,152 @@
+import functools
+import posixpath
+import re
+from urllib.parse import urlsplit, urlunsplit
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+# Resource URLs that are not fetched, so never deduplicated
+UNFETCHED_URLS = ('inline', 'data:embedded')
+
+FONT_EXTENSIONS = ('.woff', '.woff2', '.ttf', '.eot', '.otf')
+
+PERCENT_ESCAPE_RE = re.compile(r'%([0-9A-Fa-f]{2})')
+UNRESERVED = frozenset(
+    'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-._~')
+
+# An http(s) URL canonical_url would return as it is: lowercase host
+# without userinfo, a path with no escapes, dot or empty segments, a
+# non-empty query (if any) with no escapes, and no fragment. Most
+# discovered URLs are, so they skip parsing altogether.
+CANONICAL_RE = re.compile(
+    r'(https?)://[a-z0-9.-]+(?::([1-9][0-9]*))?'
+    r'(?=/)(?:/[^/?%#\s.][^/?%#\s]*)*/?'
+    r'(?:\?[^%#\s]+)?')
+
+
+def _normalize_escapes(value):
+    """Decode escaped unreserved characters, uppercase the other escapes"""
+    def replace(match):
+        char = chr(int(match.group(1), 16))
+        return char if char in UNRESERVED else '%' + match.group(1).upper()
+    return PERCENT_ESCAPE_RE.sub(replace, value)
+
+
+def _remove_dot_segments(path):
+    if '.' not in path:
+        return path
+    normalized = posixpath.normpath(path)
+    # normpath keeps a leading '//' and drops a trailing slash
+    if normalized.startswith('//'):
+        normalized = '/' + normalized.lstrip('/')
+    if path.endswith(('/', '/.', '/..')) and normalized != '/':
+        normalized += '/'
+    return normalized
+
+
+def canonical_url(url):
+    """
+    Canonical form of an absolute URL used for deduplication: lowercase
+    scheme and host, no default port, no fragment, '/' for an empty path,
+    dot segments resolved and percent-escapes normalized. The query string
+    is kept as is, since its order can matter to the server.
+    """
+    match = CANONICAL_RE.fullmatch(url)
+    if match and (not match[2] or int(match[2]) != DEFAULT_PORTS[match[1]]):
+        return url
+    return _canonicalize(url)
+
+
+# Only URLs that need normalizing are cached, so a large page's plain
+# URLs don't push out the ones the link rewriter asks for again
+@functools.lru_cache(maxsize=64 * 1024)
+def _canonicalize(url):
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+        host = f'{host}:{parts.port}'
+    if parts.username:
+        userinfo = parts.username + (f':{parts.password}' if parts.password else '')
+        host = f'{userinfo}@{host}'
+    path = _remove_dot_segments(_normalize_escapes(parts.path)) or '/'
+    return urlunsplit((scheme, host, path, _normalize_escapes(parts.query), ''))
+
+
+def is_fetched(url):
+    return url not in UNFETCHED_URLS and not url.startswith('data:')
+
+
+def _prefer(candidate, kept):
+    """
+    Whether a duplicate should replace the resource already kept. A
+    stylesheet known only from <link rel="preload"> gives way to any
+    other kind of use of its URL (a script, an image, media), and a font
+    file first picked up as a stylesheet is re-categorized; otherwise the
+    first discovery wins.
+    """
+    if kept['category'] != 'css' or candidate['category'] == 'css':
+        return False
+    if kept.get('type') == 'preload':
+        return True
+    path = urlsplit(kept['url']).path.lower()
+    return candidate['category'] == 'font' and path.endswith(FONT_EXTENSIONS)
+
+
+class ResourceIndex:
+    """
+    Resources of a clone deduplicated by canonical URL, so each one is
+    downloaded once however many tags (or discover steps) reference it.
+    Inline and data: resources are always kept.
+
+    paths maps each canonical URL to the saved path of its resource.
+    """
+
+    def __init__(self, resources=()):
+        self.resources = []
+        self.paths = {}
+        self._by_url = {}
+        # Canonical URL of each URL as written, so a repeated one is looked up once
+        self._keys = {}
+        for resource in resources:
+            self.add(resource)
+
+    def __contains__(self, url):
+        return canonical_url(url) in self._by_url
+
+    def __len__(self):
+        return len(self.resources)
+
+    def add(self, resource):
+        """Add a resource, returns False when its URL was already known"""
+        if not is_fetched(resource['url']):
+            self.resources.append(resource)
+            return True
+
+        key = self._key(resource['url'])
+        kept = self._by_url.get(key)
+        if kept is None:
+            self._by_url[key] = resource
+            self.paths[key] = resource['original_path']
+            self.resources.append(resource)
+            return True
+
+        if _prefer(resource, kept):
+            # Update in place: the kept dict is already in self.resources
+            kept.clear()
+            kept.update(resource)
+            self.paths[key] = resource['original_path']
+        return False
+
+    def _key(self, url):
+        key = self._keys.get(url)
+        if key is None:
+            key = self._keys[url] = canonical_url(url)
+        return key
+
+    def extend(self, resources):
+        """Add resources, returns the ones that were new"""
+        return [resource for resource in resources if self.add(resource)]
+
+    def get(self, url):
+        return self._by_url.get(canonical_url(url))
@@ -0,0 +1,163 @@
+"""
+Clones written straight to a directory (``manage.py clone``), one
+subdirectory per cloned URL laid out by original_path, like the ZIP
+export.
+
+manifest.jsonl in the output directory records every file once it is
+completely written, and every URL once its clone is done, one JSON line
+each. An interrupted run started again skips the URLs that are done and
+doesn't download again the files of the others that are on disk already.
+"""
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+from urllib.parse import urlsplit
+
+from .css import is_stylesheet
+from .dedup import canonical_url
+from .exports import zip_entry_name
+from .spool import iter_body
+
+MANIFEST_NAME = 'manifest.jsonl'
+
+# Longest directory name made from a URL, before its hash suffix
+MAX_DIRNAME = 120
+UNSAFE_NAME_RE = re.compile(r'[^\w.-]+')
+
+
+def clone_dirname(url):
+    """Directory name of a cloned URL: its host and path, made filesystem-safe"""
+    parts = urlsplit(url)
+    name = UNSAFE_NAME_RE.sub('_', f'{parts.netloc}{parts.path}'.rstrip('/')).strip('_.')
+    if parts.query or len(name) > MAX_DIRNAME:
+        # Keep names short and tell apart URLs that differ only by query
+        digest = hashlib.sha256(url.encode('utf-8')).hexdigest()[:10]
+        name = f'{name[:MAX_DIRNAME]}_{digest}'
+    return name or 'website'
+
+
+def output_path(root, dirname, path):
+    """Where a file of a clone goes; original paths can't climb out of it"""
+    return os.path.join(root, dirname, zip_entry_name(path))
+
+
+def write_file(path, content):
+    """
+    Write a body (bytes or a spooled file) to path, through a temporary
+    file so a crash never leaves a partial file under the real name.
+    Returns (size, SHA-256 hex digest).
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.', suffix='.part')
+    hasher = hashlib.sha256()
+    size = 0
+    try:
+        with os.fdopen(fd, 'wb') as tmp:
+            for chunk in iter_body(content):
+                hasher.update(chunk)
+                tmp.write(chunk)
+                size += len(chunk)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return size, hasher.hexdigest()
+
+
+class Manifest:
+    """The append-only record of what an output directory holds"""
+
+    def __init__(self, root, restart=False):
+        self.root = root
+        self.path = os.path.join(root, MANIFEST_NAME)
+        self.pages = {}
+        self.files = {}
+        self._lock = threading.Lock()
+
+        os.makedirs(root, exist_ok=True)
+        if restart and os.path.exists(self.path):
+            os.remove(self.path)
+        if os.path.exists(self.path):
+            self._load()
+        self._file = open(self.path, 'a', encoding='utf-8')
+
+    def _load(self):
+        with open(self.path, encoding='utf-8') as manifest:
+            for line in manifest:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # A line cut short when the last run was killed
+                if record.get('type') == 'page':
+                    self.pages[record['url']] = record
+                elif record.get('type') == 'file':
+                    self.files[record['path']] = record
+
+    def _append(self, record):
+        with self._lock:
+            self._file.write(json.dumps(record, ensure_ascii=False) + '\n')
+            self._file.flush()
+
+    def page_done(self, url):
+        return url in self.pages
+
+    def add_page(self, url, dirname, **fields):
+        record = {'type': 'page', 'url': url, 'dir': dirname, **fields}
+        with self._lock:
+            self.pages[url] = record
+        self._append(record)
+
+    def add_file(self, dirname, resource):
+        path = zip_entry_name(resource['original_path'])
+        record = {
+            'type': 'file',
+            'path': f'{dirname}/{path}',
+            'url': resource['url'],
+            'size': resource.get('size', 0),
+            'hash': resource.get('hash'),
+            'content_type': resource.get('content_type', ''),
+            'is_binary': resource.get('is_binary', False),
+        }
+        with self._lock:
+            self.files[record['path']] = record
+        self._append(record)
+
+    def written(self, dirname, resource):
+        """
+        The record of a resource written by an earlier run, if its file is
+        still there at the recorded size; None when it must be downloaded.
+        Stylesheets always are: their files are rewritten, and what they
+        reference is found in the original text.
+        """
+        path = zip_entry_name(resource['original_path'])
+        record = self.files.get(f'{dirname}/{path}')
+        if record is None or canonical_url(record['url']) != canonical_url(resource['url']):
+            return None
+        if is_stylesheet({**resource, **record, 'downloaded': True}):
+            return None
+        try:
+            if os.path.getsize(output_path(self.root, dirname, path)) != record['size']:
+                return None
+        except OSError:
+            return None
+        return record
+
+    def resume(self, dirname, resource):
+        """
+        The resume hook of download_all_resources: fill in a resource an
+        earlier run wrote, so it isn't downloaded again
+        """
+        record = self.written(dirname, resource)
+        if record is None:
+            return False
+        resource.update(
+            content='', size=record['size'], hash=record['hash'],
+            content_type=record['content_type'], is_binary=record['is_binary'],
+            downloaded=True, resumed=True)
+        return True
+
+    def close(self):
+        self._file.close()
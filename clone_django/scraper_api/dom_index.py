@@ -0,0 +1,63 @@
+from collections import defaultdict
+
+from bs4 import Tag
+
+# Media elements whose nested <source> tags are discovered per element
+MEDIA_TAGS = ('video', 'audio')
+
+
+class DomIndex:
+    """
+    Index of a parsed page by tag name and attribute, built in one traversal.
+
+    Discovery asks the index for the elements it needs instead of walking the
+    whole tree with find_all once per rule. Lists keep document order, so
+    results match what find_all would return.
+    """
+
+    def __init__(self, soup):
+        self.by_name = defaultdict(list)
+        self.by_attribute = defaultdict(list)
+        self.media_sources = defaultdict(list)
+        self._position = {}
+
+        for position, element in enumerate(soup.descendants):
+            if not isinstance(element, Tag):
+                continue
+
+            self._position[id(element)] = position
+            self.by_name[element.name].append(element)
+            for attribute in element.attrs:
+                self.by_attribute[attribute].append(element)
+
+            if element.name == 'source':
+                # Record the source under every enclosing <video>/<audio>
+                for parent in element.parents:
+                    if parent.name in MEDIA_TAGS:
+                        self.media_sources[id(parent)].append(element)
+
+    def find_all(self, name=None, attrs=None, **kwargs):
+        """
+        The subset of BeautifulSoup's find_all used by discovery: a tag name
+        or list of names, and attributes that must be present (value True)
+        """
+        required = dict(attrs or {}, **kwargs)
+
+        if name is None:
+            attribute = next(iter(required))
+            elements = self.by_attribute.get(attribute, [])
+        elif isinstance(name, (list, tuple)):
+            elements = sorted(
+                (el for n in name for el in self.by_name.get(n, [])),
+                key=lambda el: self._position[id(el)])
+        else:
+            elements = self.by_name.get(name, [])
+
+        if required:
+            elements = [el for el in elements
+                        if all(attribute in el.attrs for attribute in required)]
+        return elements
+
+    def sources_in(self, media):
+        """<source> descendants of a <video> or <audio> element"""
+        return self.media_sources.get(id(media), [])
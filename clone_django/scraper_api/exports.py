@@ -0,0 +1,71 @@
+import base64
+import posixpath
+import zipfile
+
+from .blobs import get_blob_store
+
+# Formats that are already compressed and gain nothing from deflate
+STORED_EXTENSIONS = {
+    'png', 'jpg', 'jpeg', 'gif', 'webp', 'avif', 'ico',
+    'woff', 'woff2', 'mp4', 'webm', 'mp3', 'ogg', 'zip', 'rar', 'pdf',
+}
+
+
+class ZipStreamBuffer:
+    """
+    Write-only file object for zipfile that hands out what was written so far.
+
+    It has no seek(), so zipfile falls back to data descriptors and never
+    goes back to patch an entry, which lets the archive be streamed.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._offset = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._offset
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def resource_body_bytes(resource):
+    """Raw bytes of a downloaded resource, wherever its body is kept"""
+    content = resource.get('content') or ''
+
+    # Blob mode: a binary body kept only by its hash
+    if (resource.get('is_binary') and resource.get('hash')
+            and resource.get('size') and not content):
+        with get_blob_store().open(resource['hash']) as blob:
+            return blob.read()
+    if resource['url'] == 'data:embedded':
+        # Data URL: data:image/png;base64,....
+        header, _, data = content.partition(',')
+        if header.endswith(';base64'):
+            return base64.b64decode(data)
+        return data.encode('utf-8')
+    if resource.get('is_binary'):
+        return base64.b64decode(content)
+    return content.encode('utf-8')
+
+
+def zip_entry_name(path):
+    """Safe archive path for a resource's original_path"""
+    name = posixpath.normpath('/' + path.replace('\\', '/')).lstrip('/')
+    return name or 'index.html'
+
+
+def zip_compress_type(name):
+    ext = name.rsplit('.', 1)[-1].lower() if '.' in name else ''
+    return zipfile.ZIP_STORED if ext in STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
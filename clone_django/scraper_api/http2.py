@@ -0,0 +1,114 @@
+"""
+HTTP/2 client for the 'http2' download engine, built on httpx.
+
+Every download to an origin is multiplexed as a stream over one
+connection. Origins that don't negotiate h2 over TLS (ALPN) are spoken
+to over HTTP/1.1 by the same client, and without the h2 package the
+whole engine falls back to HTTP/1.1. Plain http:// origins only get
+HTTP/2 when listed in SCRAPER_HTTP2_CLEARTEXT_HOSTS, since h2c can't be
+negotiated and has to be assumed (prior knowledge).
+
+The session mimics the slice of aiohttp.ClientSession the async engine
+uses, so both share one download path.
+"""
+import importlib.util
+
+from django.conf import settings
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover - optional dependency
+    httpx = None
+
+HTTP2_AVAILABLE = httpx is not None and importlib.util.find_spec('h2') is not None
+
+# Failures worth another try
+TRANSPORT_ERRORS = (httpx.TransportError,) if httpx is not None else ()
+
+# HTTP/1.1 connection headers, which HTTP/2 forbids
+HOP_BY_HOP_HEADERS = frozenset(('connection', 'keep-alive', 'proxy-connection',
+                                'transfer-encoding', 'upgrade'))
+
+
+def get_http2_cleartext_hosts():
+    """host:port origins spoken to with HTTP/2 over plain http://"""
+    return getattr(settings, 'SCRAPER_HTTP2_CLEARTEXT_HOSTS', ())
+
+
+def get_http2_max_connections():
+    """Connections kept open across all origins"""
+    return getattr(settings, 'SCRAPER_HTTP2_MAX_CONNECTIONS', 100)
+
+
+class Http2Response:
+    """An httpx streamed response with the aiohttp response attributes the engine reads"""
+
+    def __init__(self, response):
+        self._response = response
+        self.status = response.status_code
+        self.headers = response.headers
+        self.http_version = response.http_version
+        self.content = self
+
+    def iter_chunked(self, chunk_size):
+        return self._response.aiter_bytes(chunk_size)
+
+    def raise_for_status(self):
+        self._response.raise_for_status()
+
+
+class Http2Request:
+    def __init__(self, client, url, headers):
+        self._stream = client.stream('GET', url, headers=headers)
+
+    async def __aenter__(self):
+        return Http2Response(await self._stream.__aenter__())
+
+    async def __aexit__(self, *exc_info):
+        return await self._stream.__aexit__(*exc_info)
+
+
+class Http2Session:
+    """
+    httpx.AsyncClient with HTTP/2 where the h2 package and the origin
+    allow it. Used as ``async with Http2Session(...) as session`` and
+    ``async with session.get(url, headers=...) as response``.
+    """
+
+    def __init__(self, headers, timeout, connect_timeout):
+        if httpx is None:
+            raise RuntimeError(
+                "The http2 download engine requires httpx "
+                "(pip install -r requirements-optional.txt)")
+        if not HTTP2_AVAILABLE:
+            print("⚠️ h2 is not installed, the http2 engine is using HTTP/1.1 "
+                  "(pip install -r requirements-optional.txt)")
+
+        limits = httpx.Limits(
+            max_connections=get_http2_max_connections(),
+            max_keepalive_connections=get_http2_max_connections())
+        mounts = {}
+        if HTTP2_AVAILABLE:
+            for host in get_http2_cleartext_hosts():
+                mounts[f'http://{host}'] = httpx.AsyncHTTPTransport(
+                    http1=False, http2=True, limits=limits)
+
+        self._client = httpx.AsyncClient(
+            headers={k: v for k, v in (headers or {}).items()
+                     if k.lower() not in HOP_BY_HOP_HEADERS},
+            http2=HTTP2_AVAILABLE,
+            limits=limits,
+            mounts=mounts,
+            timeout=httpx.Timeout(timeout, connect=connect_timeout),
+            follow_redirects=True,
+        )
+
+    async def __aenter__(self):
+        await self._client.__aenter__()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self._client.__aexit__(*exc_info)
+
+    def get(self, url, headers=None):
+        return Http2Request(self._client, url, headers)
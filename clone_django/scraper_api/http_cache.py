@@ -0,0 +1,296 @@
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+
+from django.conf import settings
+
+from .spool import body_size, iter_body
+
+# Response headers kept with a cached body
+CACHED_HEADERS = ('content-type', 'etag', 'last-modified', 'cache-control', 'expires', 'date')
+
+# Upper bound for heuristic freshness when only Last-Modified is known
+MAX_HEURISTIC_LIFETIME = 24 * 60 * 60
+
+
+def parse_cache_control(value):
+    """Parse a Cache-Control header into {directive: value or True}"""
+    directives = {}
+    for part in (value or '').split(','):
+        name, _, arg = part.strip().partition('=')
+        if name:
+            directives[name.lower()] = arg.strip('"') if arg else True
+    return directives
+
+
+def parse_http_date(value):
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+def freshness_lifetime(headers, now=None):
+    """
+    Seconds a response stays fresh, following Cache-Control, then Expires,
+    then the Last-Modified heuristic (10% of its age, capped at a day)
+    """
+    now = now or time.time()
+    directives = parse_cache_control(headers.get('cache-control'))
+
+    if 'no-cache' in directives or 'no-store' in directives:
+        return 0
+    if 'max-age' in directives:
+        try:
+            return max(0, int(directives['max-age']))
+        except ValueError:
+            return 0
+
+    date = parse_http_date(headers.get('date')) or now
+    if headers.get('expires'):
+        expires = parse_http_date(headers['expires'])
+        return max(0, expires - date) if expires else 0
+
+    last_modified = parse_http_date(headers.get('last-modified'))
+    if last_modified:
+        return min(max(0, (date - last_modified) * 0.1), MAX_HEURISTIC_LIFETIME)
+
+    return 0
+
+
+def is_cacheable(headers):
+    directives = parse_cache_control(headers.get('cache-control'))
+    if 'no-store' in directives or 'private' in directives:
+        return False
+    vary = headers.get('vary', '').lower()
+    if vary and vary.replace(' ', '') not in ('accept-encoding', ''):
+        return False
+    # Worth keeping if it is fresh for a while or can be revalidated
+    return bool(freshness_lifetime(headers) or headers.get('etag')
+                or headers.get('last-modified'))
+
+
+def decode_body(content, content_type):
+    """Decode a cached text body using the charset from its content type"""
+    match = re.search(r'charset=([\w-]+)', content_type or '', re.I)
+    try:
+        return content.decode(match.group(1) if match else 'utf-8', errors='replace')
+    except LookupError:
+        return content.decode('utf-8', errors='replace')
+
+
+class HttpCache:
+    """
+    Disk-backed HTTP cache for downloaded resources with LRU eviction.
+
+    Each entry is a body file plus a JSON sidecar. The body file's mtime is
+    its last access time, so LRU order survives restarts.
+    """
+
+    def __init__(self, root, max_bytes):
+        self.root = str(root)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> size, least recently used first
+        self._total_bytes = 0
+        os.makedirs(self.root, exist_ok=True)
+        self._load_index()
+
+    def _load_index(self):
+        found = []
+        for name in os.listdir(self.root):
+            if name.endswith('.body'):
+                stat = os.stat(os.path.join(self.root, name))
+                found.append((stat.st_mtime, name[:-5], stat.st_size))
+        for _, key, size in sorted(found):
+            self._entries[key] = size
+            self._total_bytes += size
+
+    def _key(self, url):
+        return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+    def _paths(self, key):
+        base = os.path.join(self.root, key)
+        return base + '.body', base + '.json'
+
+    def lookup(self, url):
+        """
+        Return (entry, fresh) for a URL, or (None, False) on a miss.
+        entry carries the cached 'headers' and 'expires_at'.
+        """
+        key = self._key(url)
+        body_path, meta_path = self._paths(key)
+        try:
+            with open(meta_path) as meta:
+                entry = json.load(meta)
+        except (OSError, ValueError):
+            return None, False
+
+        if entry.get('url') != url or not os.path.exists(body_path):
+            return None, False
+
+        entry['key'] = key
+        return entry, time.time() < entry.get('expires_at', 0)
+
+    def open(self, entry):
+        """Open a cached body for reading and mark it as recently used"""
+        body_path, _ = self._paths(entry['key'])
+        body = open(body_path, 'rb')
+        self._touch(entry['key'])
+        return body
+
+    def conditional_headers(self, entry):
+        """Validators for revalidating a stale entry"""
+        headers = {}
+        if entry['headers'].get('etag'):
+            headers['If-None-Match'] = entry['headers']['etag']
+        if entry['headers'].get('last-modified'):
+            headers['If-Modified-Since'] = entry['headers']['last-modified']
+        return headers
+
+    def store(self, url, content, headers):
+        """
+        Cache a 200 response body (bytes or a readable file) if its headers
+        allow it
+        """
+        headers = {k.lower(): v for k, v in headers.items()}
+        size = body_size(content)
+        if not is_cacheable(headers) or size > self.max_bytes:
+            return
+
+        key = self._key(url)
+        body_path, meta_path = self._paths(key)
+        entry = {
+            'url': url,
+            'headers': {k: headers[k] for k in CACHED_HEADERS if k in headers},
+            'stored_at': time.time(),
+            'expires_at': time.time() + freshness_lifetime(headers),
+        }
+
+        fd, tmp_body = tempfile.mkstemp(dir=self.root)
+        with os.fdopen(fd, 'wb') as body:
+            for chunk in iter_body(content):
+                body.write(chunk)
+        fd, tmp_meta = tempfile.mkstemp(dir=self.root)
+        with os.fdopen(fd, 'w') as meta:
+            json.dump(entry, meta)
+        os.replace(tmp_body, body_path)
+        os.replace(tmp_meta, meta_path)
+
+        with self._lock:
+            self._total_bytes -= self._entries.pop(key, 0)
+            self._entries[key] = size
+            self._total_bytes += size
+        self._evict()
+
+    def refresh(self, entry, headers):
+        """Update freshness after a 304 Not Modified"""
+        headers = {k.lower(): v for k, v in headers.items()}
+        merged = dict(entry['headers'])
+        merged.update({k: headers[k] for k in CACHED_HEADERS if k in headers})
+        entry['headers'] = merged
+        entry['expires_at'] = time.time() + freshness_lifetime(merged)
+
+        _, meta_path = self._paths(entry['key'])
+        fd, tmp_meta = tempfile.mkstemp(dir=self.root)
+        with os.fdopen(fd, 'w') as meta:
+            json.dump({k: v for k, v in entry.items() if k != 'key'}, meta)
+        os.replace(tmp_meta, meta_path)
+
+    def _touch(self, key):
+        body_path, _ = self._paths(key)
+        try:
+            os.utime(body_path)
+        except OSError:
+            pass
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+
+    def _evict(self):
+        """Drop least recently used entries until under the byte budget"""
+        while True:
+            with self._lock:
+                if self._total_bytes <= self.max_bytes or not self._entries:
+                    return
+                key, size = self._entries.popitem(last=False)
+                self._total_bytes -= size
+            for path in self._paths(key):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    @property
+    def total_bytes(self):
+        return self._total_bytes
+
+
+_http_cache = None
+_http_cache_lock = threading.Lock()
+
+
+def get_http_cache():
+    """Process-wide resource cache, or None when SCRAPER_HTTP_CACHE is off"""
+    global _http_cache
+    if not getattr(settings, 'SCRAPER_HTTP_CACHE', True):
+        return None
+    if _http_cache is None:
+        with _http_cache_lock:
+            if _http_cache is None:
+                _http_cache = HttpCache(
+                    getattr(settings, 'SCRAPER_HTTP_CACHE_ROOT',
+                            os.path.join(settings.BASE_DIR, 'http_cache')),
+                    getattr(settings, 'SCRAPER_HTTP_CACHE_MAX_BYTES', 1024 ** 3),
+                )
+    return _http_cache
+
+
+def cache_stats(resources):
+    """Hit / miss / revalidation counts for a clone's stats"""
+    outcomes = [r.get('cache') for r in resources]
+    return {
+        'hits': outcomes.count('hit'),
+        'misses': outcomes.count('miss'),
+        'revalidated': outcomes.count('revalidated'),
+    }
+
+
+def cached_body(cache, entry):
+    """
+    (body, content_type) for a cache entry, the body an open file like a
+    spooled download so it is only read (and text decoded) as it's stored,
+    or None if it was evicted in the meantime. Open it only once the entry
+    is used: a fresh hit, or a 304.
+    """
+    try:
+        body = cache.open(entry)
+    except OSError:
+        return None
+    return body, entry['headers'].get('content-type', '')
+
+
+def store_cached(resource, cache, entry, store_body, spooler, share=None):
+    """
+    Fill a resource from its cache entry, on a fresh hit or a 304. share,
+    if given, is called with (body, content_type) first, to hand the body
+    to clones waiting for it. Returns True when stored, False when over a
+    byte budget, None when the body was evicted in the meantime.
+    """
+    cached = cached_body(cache, entry)
+    if cached is None:
+        return None
+    body, content_type = cached
+    with body:
+        if share:
+            share(body, content_type)
+        if not spooler.admit_body(resource, body_size(body)):
+            return False
+        store_body(resource, body, content_type)
+    return True
@@ -0,0 +1,177 @@
+"""
+Incremental re-clones: revalidate each resource of a previous snapshot
+with a conditional request and reuse its body when the server answers
+304, then report what changed since.
+
+A snapshot is a previous clone response (or a trimmed copy of one): its
+'resources' carry url, hash, size and the etag / last_modified validators
+each download recorded, and 'html_hash' (or the 'pages' of a crawl) the
+hash of the page HTML.
+"""
+import hashlib
+
+from .blobs import get_blob_store
+from .dedup import canonical_url, is_fetched
+from .exports import resource_body_bytes
+from .models import Snapshot
+from .snapshots import snapshot_result
+from .spool import iter_body
+
+# Resource fields carried over from the snapshot when its body is reused
+REUSED_FIELDS = ('hash', 'size', 'content_type', 'is_binary', 'etag', 'last_modified')
+
+
+def body_hash(content):
+    """SHA-256 hex digest of a body (bytes or a file), the blob store's key"""
+    hasher = hashlib.sha256()
+    for chunk in iter_body(content):
+        hasher.update(chunk)
+    if not isinstance(content, (bytes, bytearray)):
+        content.seek(0)
+    return hasher.hexdigest()
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def record_validators(resource, headers):
+    """Keep a response's validators, for the next incremental clone"""
+    if headers.get('etag'):
+        resource['etag'] = headers['etag']
+    if headers.get('last-modified'):
+        resource['last_modified'] = headers['last-modified']
+
+
+def read_snapshot(data):
+    """
+    Validate the 'previous' option of a request: a previous clone, or the
+    id of a saved snapshot.
+    Returns (snapshot, error) where error is a message for a 400 response.
+    """
+    if data is None:
+        return None, None
+    if (isinstance(data, int) and not isinstance(data, bool)) or (
+            isinstance(data, str) and data.isdigit()):
+        snapshot = Snapshot.objects.filter(pk=int(data)).first()
+        if snapshot is None:
+            return None, f'Snapshot {data} not found'
+        # Binary bodies are read back from the blob store only on a 304
+        return snapshot_result(snapshot, binary_mode='blob'), None
+    if not isinstance(data, dict) or not isinstance(data.get('resources'), list):
+        return None, 'previous must be a previous clone with a resources list'
+    if not all(isinstance(r, dict) and isinstance(r.get('url'), str)
+               for r in data['resources']):
+        return None, 'previous resources must each have a url'
+    return data, None
+
+
+class Baseline:
+    """
+    The resources of a previous snapshot by canonical URL, used to send
+    conditional requests and to reuse bodies the server reports unchanged.
+
+    Stylesheets are left out: the snapshot holds them with their links
+    already rewritten, and the clone needs the original text to find what
+    they reference, so they are always downloaded.
+    """
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        self.resources = {
+            canonical_url(resource['url']): resource
+            for resource in snapshot['resources']
+            if is_fetched(resource['url']) and resource.get('downloaded', True)
+        }
+        self._by_url = {key: resource for key, resource in self.resources.items()
+                        if resource.get('category') != 'css'}
+
+    def __contains__(self, url):
+        return canonical_url(url) in self._by_url
+
+    def get(self, url):
+        return self._by_url.get(canonical_url(url))
+
+    def conditional_headers(self, url):
+        """If-None-Match / If-Modified-Since for a resource of the snapshot"""
+        previous = self.get(url)
+        headers = {}
+        if previous and previous.get('etag'):
+            headers['If-None-Match'] = previous['etag']
+        if previous and previous.get('last_modified'):
+            headers['If-Modified-Since'] = previous['last_modified']
+        return headers
+
+    def reuse(self, resource, store_body, spooler):
+        """
+        Fill a resource the server answered 304 for from the snapshot: from
+        the blob store or the body the snapshot carries, else (a trimmed
+        snapshot) just its hash and size, flagged 'unchanged' so the client
+        keeps its own copy. Returns False when over the byte budget.
+        """
+        previous = self.get(resource['url'])
+        body = None
+        if previous.get('content') or (
+                previous.get('hash') and get_blob_store().exists(previous['hash'])):
+            try:
+                body = resource_body_bytes(previous)
+            except (OSError, ValueError):
+                body = None
+
+        if body is not None:
+            if not spooler.admit_body(resource, len(body)):
+                return False
+            store_body(resource, body, previous.get('content_type', ''))
+        else:
+            resource['content'] = ''
+            resource['downloaded'] = True
+
+        for field in REUSED_FIELDS:
+            if field in previous:
+                resource[field] = previous[field]
+        resource['unchanged'] = True
+        return True
+
+
+def page_hashes(result):
+    """{page path: HTML hash} of a clone, or a snapshot of one"""
+    if result.get('pages'):
+        return {page['path']: page.get('html_hash') for page in result['pages']}
+    return {'index.html': result.get('html_hash')}
+
+
+def build_delta(result, snapshot):
+    """
+    What changed between a snapshot and the clone that revalidated it:
+    resource URLs added, changed and removed, the count left unchanged,
+    and whether any page's HTML changed
+    """
+    previous = Baseline(snapshot).resources
+    current = {}
+    for resource in result['resources']:
+        if is_fetched(resource['url']) and resource.get('downloaded'):
+            current.setdefault(canonical_url(resource['url']), resource)
+
+    added, changed, unchanged = [], [], 0
+    for key, resource in current.items():
+        before = previous.get(key)
+        if before is None:
+            added.append(resource['url'])
+        elif resource.get('unchanged') or resource.get('hash') == before.get('hash'):
+            unchanged += 1
+        else:
+            changed.append(resource['url'])
+    removed = [resource['url'] for key, resource in previous.items() if key not in current]
+
+    pages_before, pages_now = page_hashes(snapshot), page_hashes(result)
+    changed_pages = sorted(path for path, digest in pages_now.items()
+                           if pages_before.get(path) != digest)
+
+    return {
+        'added': added,
+        'changed': changed,
+        'removed': removed,
+        'unchanged': unchanged,
+        'html_changed': bool(changed_pages),
+        'changed_pages': changed_pages,
+    }
@@ -0,0 +1,166 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+
+def get_max_jobs():
+    """Clones run in the background at the same time"""
+    return getattr(settings, 'SCRAPER_MAX_JOBS', 4)
+
+
+def get_max_queued_jobs():
+    """Jobs allowed to wait for a free worker before new ones are refused"""
+    return getattr(settings, 'SCRAPER_MAX_QUEUED_JOBS', 100)
+
+
+def get_job_ttl():
+    """Seconds a finished job (and its result) is kept"""
+    return getattr(settings, 'SCRAPER_JOB_TTL', 60 * 60)
+
+
+class Progress:
+    """Download counters for one clone"""
+
+    def __init__(self):
+        self.current = 0
+        self.total = 0
+        self._lock = threading.Lock()
+
+    def reset(self, total):
+        with self._lock:
+            self.current = 0
+            self.total = total
+
+    def add_total(self, count):
+        """More downloads were scheduled while the clone was running"""
+        with self._lock:
+            self.total += count
+
+    def advance(self):
+        """Count one finished download, returns the percentage done"""
+        with self._lock:
+            self.current += 1
+            return (self.current / self.total) * 100 if self.total else 100.0
+
+    def as_dict(self):
+        with self._lock:
+            percent = (self.current / self.total) * 100 if self.total else 0.0
+            return {'current': self.current, 'total': self.total,
+                    'percent': round(percent, 1)}
+
+
+class Job:
+    """A clone running (or waiting to run) in the background"""
+
+    def __init__(self):
+        self.id = uuid.uuid4().hex
+        self.status = JOB_QUEUED
+        self.progress = Progress()
+        self.result = None
+        self.error = None
+        self.error_status = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    def as_dict(self):
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'progress': self.progress.as_dict(),
+            'error': self.error,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class JobQueue:
+    """
+    Bounded pool of background clones. At most max_jobs run at once; up to
+    max_queued more wait for a worker. Finished jobs are dropped after ttl.
+    """
+
+    def __init__(self, max_jobs=None, max_queued=None, ttl=None):
+        self.max_jobs = max_jobs or get_max_jobs()
+        self.max_queued = max_queued if max_queued is not None else get_max_queued_jobs()
+        self.ttl = ttl if ttl is not None else get_job_ttl()
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_jobs, thread_name_prefix='scrape-job')
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, func, *args, error_handler=None):
+        """
+        Run func(*args, progress=job.progress) in the background and return
+        the Job. error_handler(exc) maps a failure to (message, http_status).
+        """
+        self._prune()
+        job = Job()
+        with self._lock:
+            waiting = sum(1 for j in self._jobs.values() if j.status == JOB_QUEUED)
+            if waiting >= self.max_queued:
+                raise JobQueueFull(f'{waiting} jobs are already waiting')
+            self._jobs[job.id] = job
+
+        self._executor.submit(self._run, job, func, args, error_handler)
+        return job
+
+    def _run(self, job, func, args, error_handler):
+        job.status = JOB_RUNNING
+        job.started_at = time.time()
+        try:
+            job.result = func(*args, progress=job.progress)
+            job.status = JOB_DONE
+        except Exception as e:
+            job.error, job.error_status = (
+                error_handler(e) if error_handler else (str(e), 500))
+            job.status = JOB_FAILED
+        finally:
+            job.finished_at = time.time()
+
+    def get(self, job_id):
+        self._prune()
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def counts(self):
+        """Number of known jobs in each state"""
+        counts = dict.fromkeys((JOB_QUEUED, JOB_RUNNING, JOB_DONE, JOB_FAILED), 0)
+        with self._lock:
+            for job in self._jobs.values():
+                counts[job.status] += 1
+        return counts
+
+    def _prune(self):
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            for job_id in [job_id for job_id, job in self._jobs.items()
+                           if job.finished_at and job.finished_at < cutoff]:
+                del self._jobs[job_id]
+
+
+_job_queue = None
+_job_queue_lock = threading.Lock()
+
+
+def get_job_queue():
+    """Process-wide background job queue"""
+    global _job_queue
+    if _job_queue is None:
+        with _job_queue_lock:
+            if _job_queue is None:
+                _job_queue = JobQueue()
+    return _job_queue
@@ -0,0 +1,174 @@
+"""
+Clone URLs straight to disk, without going through the HTTP API:
+
+    python manage.py clone https://example.com/ --output archive/
+    python manage.py clone --input urls.txt --output archive/ --jobs 8
+
+Each URL is cloned by the same pipeline as /api/scrape/ into its own
+subdirectory of the output directory, every resource written to its
+original_path as its download finishes; binary bodies go from the
+download spool to the file without being held in memory. Run it again
+with the same output directory after an interruption and it carries on
+from the manifest (see scraper_api.disk).
+"""
+import threading
+from functools import partial
+
+from django.core.management.base import BaseCommand, CommandError
+
+from scraper_api import views
+from scraper_api.batch import get_batch_concurrency, run_batch
+from scraper_api.disk import Manifest, clone_dirname, output_path, write_file
+from scraper_api.exports import resource_body_bytes, zip_entry_name
+from scraper_api.rewrite import build_link_table
+
+
+def store_resource_file(resource, content, content_type, text=None, claim=None,
+                        root=None, dirname=None):
+    """
+    The store_body of a clone to disk. Binary bodies are written to their
+    file right away; text stays in the resource until it is complete, as
+    stylesheets are rewritten when their download finishes.
+    """
+    if (views.is_binary_content(content_type)
+            and claim(zip_entry_name(resource['original_path']), resource['url'])):
+        size, digest = write_file(
+            output_path(root, dirname, resource['original_path']), content)
+        resource.update(
+            content='', hash=digest, size=size, is_binary=True, downloaded=True,
+            content_type=content_type, on_disk=True)
+    else:
+        views.store_resource_body(resource, content, content_type, text)
+
+
+def clone_to_disk(url, headers, options, manifest):
+    """Clone one URL into its directory of the manifest's root, returns its page record"""
+    root = manifest.root
+    dirname = clone_dirname(url)
+
+    if options['crawl']:
+        pages, all_resources, failed_pages = views.crawl_site(url, headers, options)
+    else:
+        pages = [views.make_page(views.fetch_page(url, headers, options['parser']), url)]
+        all_resources = views.discover_all_resources(pages[0]['soup'], url)
+        failed_pages = []
+    page_paths = {page['url']: page['path'] for page in pages}
+
+    # Each name goes to the first URL that takes it, pages first, like the ZIP export
+    claims = {zip_entry_name(path): page_url for page_url, path in page_paths.items()}
+    claims_lock = threading.Lock()
+
+    def claim(name, resource_url):
+        with claims_lock:
+            return claims.setdefault(name, resource_url) == resource_url
+
+    store_body = partial(store_resource_file, claim=claim, root=root, dirname=dirname)
+    files = 0
+    for resource in views.iter_completed_resources(
+            all_resources, headers, options, store_body=store_body,
+            resume=partial(manifest.resume, dirname)):
+        if 'error' in resource and 'url' not in resource:
+            raise CommandError(resource['error'])
+        if not resource.get('downloaded'):
+            continue
+        if not resource.get('on_disk'):
+            if not claim(zip_entry_name(resource['original_path']), resource['url']):
+                continue
+            size, digest = write_file(
+                output_path(root, dirname, resource['original_path']),
+                resource_body_bytes(resource))
+            resource.update(size=size, hash=digest)
+        manifest.add_file(dirname, resource)
+        # The file is written, don't keep the body around
+        resource['content'] = ''
+        files += 1
+
+    table = build_link_table(all_resources)
+    for page in pages:
+        html = views.render_page(page, all_resources, page_paths, table)
+        write_file(output_path(root, dirname, page['path']), html.encode('utf-8'))
+
+    stats = views.build_stats(all_resources)
+    resumed = [r for r in all_resources if r.get('resumed')]
+    if resumed:
+        stats['resumed'] = len(resumed)
+    record = {
+        'files': files,
+        'pages': [page['path'] for page in pages],
+        'failed': len([r for r in all_resources if r.get('error')]),
+        'failed_pages': failed_pages,
+        'stats': stats,
+    }
+    manifest.add_page(url, dirname, **record)
+    return record
+
+
+class Command(BaseCommand):
+    help = 'Clone websites straight to a directory, resuming an interrupted run'
+
+    def add_arguments(self, parser):
+        parser.add_argument('urls', nargs='*', help='URLs to clone')
+        parser.add_argument('--input', help='File with one URL per line')
+        parser.add_argument('--output', required=True, help='Output directory')
+        parser.add_argument('--jobs', type=int, default=get_batch_concurrency(),
+                            help='URLs cloned at the same time')
+        parser.add_argument('--restart', action='store_true',
+                            help='Ignore the manifest of an earlier run and clone everything again')
+        parser.add_argument('--engine', choices=views.DOWNLOAD_ENGINES)
+        parser.add_argument('--parser')
+        parser.add_argument('--no-cache', action='store_true')
+        parser.add_argument('--crawl', action='store_true')
+        parser.add_argument('--depth', type=int)
+        parser.add_argument('--max-pages', type=int)
+        parser.add_argument('--scope')
+
+    def handle(self, *args, **opts):
+        urls = list(opts['urls'])
+        if opts['input']:
+            with open(opts['input'], encoding='utf-8') as f:
+                urls += [line.strip() for line in f
+                         if line.strip() and not line.lstrip().startswith('#')]
+        if not urls:
+            raise CommandError('Give URLs to clone, or --input')
+
+        options, error = views.read_scrape_options({
+            'url': urls[0],
+            'engine': opts['engine'],
+            'parser': opts['parser'],
+            'cache': not opts['no_cache'],
+            'crawl': opts['crawl'],
+            'depth': opts['depth'],
+            'max_pages': opts['max_pages'],
+            'scope': opts['scope'],
+            'save': False,
+            'optimize': False,
+        })
+        if error:
+            raise CommandError(error)
+        urls = [url if url.startswith(('http://', 'https://')) else 'https://' + url
+                for url in dict.fromkeys(urls)]
+
+        manifest = Manifest(opts['output'], restart=opts['restart'])
+        todo = [url for url in urls if not manifest.page_done(url)]
+        if len(todo) < len(urls):
+            self.stdout.write(f'{len(urls) - len(todo)} of {len(urls)} URLs done already')
+
+        failed = 0
+        try:
+            for index, record, error in run_batch(
+                    todo, partial(clone_to_disk, headers=views.BROWSER_HEADERS,
+                                  options=options, manifest=manifest),
+                    max(opts['jobs'], 1)):
+                if error:
+                    failed += 1
+                    self.stderr.write(f'Failed {todo[index]}: {error}')
+                else:
+                    self.stdout.write(self.style.SUCCESS(
+                        f"Cloned {todo[index]}: {record['files']} files, "
+                        f"{record['stats'].get('resumed', 0)} resumed, "
+                        f"{record['failed']} failed"))
+        finally:
+            manifest.close()
+
+        if failed:
+            raise CommandError(f'{failed} of {len(todo)} URLs failed')
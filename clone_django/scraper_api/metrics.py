@@ -0,0 +1,270 @@
+"""
+Process-wide pipeline metrics in the Prometheus text exposition format.
+
+Kept dependency-free: counters, gauges and histograms with labels, plus
+collectors that sample gauges (scheduler and job saturation) at scrape
+time.
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds; covers sub-millisecond discover steps up to multi-minute crawls
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1, 2.5, 5, 10, 30, 60, 120, 300)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', r'\\')
+                         .replace('"', r'\"').replace('\n', r'\n'))
+        for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.label_names)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}',
+                 f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._samples(key, value))
+        return lines
+
+    def _samples(self, key, value):
+        labels = _format_labels(self.label_names, key)
+        return [f'{self.name}{labels} {_format_value(value)}']
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            # Per-bucket counts, then the +Inf overflow, sum and count
+            state = self._values.setdefault(key, [0] * (len(self.buckets) + 1) + [0.0, 0])
+            state[bisect.bisect_left(self.buckets, value)] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def totals(self):
+        """{label values: (sum, count)} for every series"""
+        with self._lock:
+            return {key: (state[-2], state[-1]) for key, state in self._values.items()}
+
+    def _samples(self, key, state):
+        samples = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), state):
+            cumulative += count
+            labels = _format_labels(self.label_names, key, [('le', _format_value(bound))])
+            samples.append(f'{self.name}_bucket{labels} {cumulative}')
+        labels = _format_labels(self.label_names, key)
+        samples.append(f'{self.name}_sum{labels} {_format_value(state[-2])}')
+        samples.append(f'{self.name}_count{labels} {state[-1]}')
+        return samples
+
+
+class Registry:
+    """Metrics plus collectors run just before each render"""
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):
+        self._collectors.append(collector)
+
+    def render(self):
+        for collector in self._collectors:
+            collector()
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+PHASE_SECONDS = REGISTRY.register(Histogram(
+    'scraper_phase_seconds', 'Time spent in each phase of the clone pipeline',
+    labels=('phase',)))
+CLONES = REGISTRY.register(Counter(
+    'scraper_clones_total', 'Clones run, by mode and outcome',
+    labels=('mode', 'outcome')))
+RESOURCES = REGISTRY.register(Counter(
+    'scraper_resources_total', 'Resources downloaded, unchanged, skipped or failed, by category',
+    labels=('category', 'outcome')))
+RESOURCE_BYTES = REGISTRY.register(Counter(
+    'scraper_resource_bytes_total', 'Bytes of downloaded resource bodies, by category',
+    labels=('category',)))
+CACHE_LOOKUPS = REGISTRY.register(Counter(
+    'scraper_http_cache_total', 'HTTP cache outcomes for downloaded resources',
+    labels=('outcome',)))
+COALESCED = REGISTRY.register(Counter(
+    'scraper_coalesced_downloads_total',
+    'Resources taken from another clone\'s download of the same URL'))
+FAILED_TRIES = REGISTRY.register(Counter(
+    'scraper_failed_tries_total',
+    'Download tries that failed with a retryable error, by reason',
+    labels=('reason',)))
+DOWNLOADS_IN_FLIGHT = REGISTRY.register(Gauge(
+    'scraper_downloads_in_flight',
+    'Resource downloads running now: busy worker threads, or requests of the '
+    'async and http2 engines', labels=('engine',)))
+SCHEDULED = REGISTRY.register(Gauge(
+    'scraper_scheduled_resources',
+    'Resources waiting in the host schedulers of running clones: queued for a '
+    'host window, or delayed for a retry backoff', labels=('state',)))
+JOBS = REGISTRY.register(Gauge(
+    'scraper_jobs', 'Background clone jobs, by state',
+    labels=('state',)))
+JOB_SLOTS = REGISTRY.register(Gauge(
+    'scraper_job_slots', 'Background clones allowed to run at once'))
+
+
+# Phases timed by this thread while captured_phases() collects them
+_captured = threading.local()
+
+
+@contextmanager
+def timed_phase(phase):
+    """Record how long the enclosed block takes as one pipeline phase"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        PHASE_SECONDS.observe(seconds, phase=phase)
+        phases = getattr(_captured, 'phases', None)
+        if phases is not None:
+            phases.append((phase, seconds))
+
+
+@contextmanager
+def captured_phases():
+    """
+    Collect the phases timed in the enclosed block, as [(phase, seconds)],
+    for a worker process to send back to the process serving /metrics
+    (which passes them to record_phases)
+    """
+    phases = []
+    _captured.phases = phases
+    try:
+        yield phases
+    finally:
+        _captured.phases = None
+
+
+def record_phases(phases):
+    """Record phases timed in a worker process"""
+    for phase, seconds in phases:
+        PHASE_SECONDS.observe(seconds, phase=phase)
+
+
+@contextmanager
+def in_flight(engine):
+    """Count the enclosed download as in flight on engine"""
+    DOWNLOADS_IN_FLIGHT.inc(engine=engine)
+    try:
+        yield
+    finally:
+        DOWNLOADS_IN_FLIGHT.dec(engine=engine)
+
+
+def record_resource(resource):
+    """Count a finished download by category, outcome, size and cache result"""
+    category = resource.get('category', 'other')
+    if resource.get('unchanged'):
+        # Revalidated against a previous snapshot, no body transferred
+        RESOURCES.inc(category=category, outcome='unchanged')
+    elif resource.get('downloaded'):
+        RESOURCES.inc(category=category, outcome='downloaded')
+        RESOURCE_BYTES.inc(resource.get('size', 0), category=category)
+    elif resource.get('skipped'):
+        RESOURCES.inc(category=category, outcome='skipped')
+    else:
+        RESOURCES.inc(category=category, outcome='failed')
+    if resource.get('cache'):
+        CACHE_LOOKUPS.inc(outcome=resource['cache'])
+    if resource.get('coalesced'):
+        COALESCED.inc()
+
+
+def collect_saturation():
+    """Sample the host schedulers and the background job queue"""
+    from .jobs import get_job_queue
+    from .throttle import scheduled_resources
+
+    for state, count in scheduled_resources().items():
+        SCHEDULED.set(count, state=state)
+
+    job_queue = get_job_queue()
+    for state, count in job_queue.counts().items():
+        JOBS.set(count, state=state)
+    JOB_SLOTS.set(job_queue.max_jobs)
+
+
+REGISTRY.add_collector(collect_saturation)
+
+
+def render_metrics():
+    return REGISTRY.render()
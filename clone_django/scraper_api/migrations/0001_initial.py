@@ -0,0 +1,79 @@
+# Generated by Django 5.2.3 on 2026-10-18 08:09
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Blob',
+            fields=[
+                ('digest', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('size', models.BigIntegerField()),
+                ('content_type', models.CharField(blank=True, max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Snapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url', models.URLField(max_length=2048)),
+                ('title', models.CharField(blank=True, max_length=500)),
+                ('crawl', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('stats', models.JSONField(default=dict)),
+                ('failed_pages', models.JSONField(default=list)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['url', '-created_at'], name='scraper_api_url_446a4b_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='SnapshotPage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url', models.URLField(max_length=2048)),
+                ('path', models.CharField(max_length=1024)),
+                ('title', models.CharField(blank=True, max_length=500)),
+                ('depth', models.PositiveIntegerField(default=0)),
+                ('html', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='pages', to='scraper_api.blob')),
+                ('snapshot', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pages', to='scraper_api.snapshot')),
+            ],
+            options={
+                'ordering': ['depth', 'id'],
+            },
+        ),
+        migrations.CreateModel(
+            name='SnapshotResource',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url', models.TextField()),
+                ('original_path', models.CharField(blank=True, max_length=1024)),
+                ('filename', models.CharField(blank=True, max_length=500)),
+                ('category', models.CharField(max_length=20)),
+                ('type', models.CharField(blank=True, max_length=50)),
+                ('content_type', models.CharField(blank=True, max_length=255)),
+                ('is_binary', models.BooleanField(default=False)),
+                ('size', models.BigIntegerField(default=0)),
+                ('hash', models.CharField(blank=True, db_index=True, max_length=64)),
+                ('etag', models.CharField(blank=True, max_length=255)),
+                ('last_modified', models.CharField(blank=True, max_length=64)),
+                ('downloaded', models.BooleanField(default=False)),
+                ('extra', models.JSONField(default=dict)),
+                ('blob', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='resources', to='scraper_api.blob')),
+                ('snapshot', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='resources', to='scraper_api.snapshot')),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+    ]
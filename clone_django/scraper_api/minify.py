@@ -0,0 +1,152 @@
+"""
+Minifiers and image recompression for the optimize stage.
+
+These run in the optimize process pool, so this module only imports what
+the workers need (no Django settings or models). Every function returns
+the optimized body, or None to keep the original.
+
+Scripts are minified with rjsmin and images recompressed with Pillow, when
+they are installed. Stylesheets and HTML have conservative built-in
+minifiers (rcssmin also strips whitespace inside quoted url()s).
+"""
+import io
+import re
+
+from bs4 import BeautifulSoup, Comment, NavigableString
+
+try:
+    import rjsmin
+except ImportError:  # pragma: no cover - optional dependency
+    rjsmin = None
+
+try:
+    from PIL import Image
+except ImportError:  # pragma: no cover - optional dependency
+    Image = None
+
+# Strings, comments, whitespace, and runs of anything else (a stray quote included)
+CSS_TOKEN_RE = re.compile(
+    r'("(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\')'
+    r'|(/\*.*?(?:\*/|$))'
+    r'|(\s+)'
+    r'|([^"\'/\s]+|[/"\'])',
+    re.S)
+# Whitespace next to these can go without changing what the CSS means.
+# Not before ':' (`a :hover` is not `a:hover`) nor around '+' (calc()).
+CSS_TIGHT_BEFORE = frozenset('{};,>!')
+CSS_TIGHT_AFTER = frozenset('{};,>:')
+CSS_EMPTY_DECLARATIONS_RE = re.compile(r';+(?=})')
+
+# Elements whose text is rendered (or run) with its whitespace as it is
+HTML_PRESERVE_WHITESPACE = frozenset(('pre', 'textarea', 'script', 'style'))
+# Elements whose whitespace-only text is never rendered
+HTML_INSIGNIFICANT_WHITESPACE = frozenset((
+    '[document]', 'html', 'head', 'table', 'thead', 'tbody', 'tfoot', 'tr', 'colgroup'))
+WHITESPACE_RE = re.compile(r'\s+')
+
+# Pillow formats recompressed, keeping their format so links stay valid
+IMAGE_FORMATS = ('JPEG', 'PNG')
+
+
+def minify_css(text):
+    """Drop comments (but /*! notices) and whitespace that carries no meaning"""
+    out = []
+    space = False
+    for string, comment, whitespace, other in CSS_TOKEN_RE.findall(text):
+        if whitespace or (comment and not comment.startswith('/*!')):
+            # A comment separates tokens like whitespace does
+            space = True
+            continue
+        token = string or comment or CSS_EMPTY_DECLARATIONS_RE.sub('', other)
+        if token.startswith('}'):
+            while out and out[-1].endswith(';'):
+                out[-1] = out[-1].rstrip(';')
+                if not out[-1]:
+                    out.pop()
+        elif (space and out and out[-1][-1] not in CSS_TIGHT_AFTER
+                and token[0] not in CSS_TIGHT_BEFORE):
+            out.append(' ')
+        out.append(token)
+        space = False
+    return ''.join(out)
+
+
+def minify_js(text):
+    if rjsmin is None:
+        return None
+    return rjsmin.jsmin(text, keep_bang_comments=True)
+
+
+def _preserves_whitespace(string):
+    return any(parent.name in HTML_PRESERVE_WHITESPACE for parent in string.parents)
+
+
+def minify_html(html):
+    """
+    Collapse whitespace runs in text to one space (which is how the browser
+    renders them) and drop comments, except in <pre>, <textarea>, scripts
+    and styles. Conditional comments are kept.
+    """
+    soup = BeautifulSoup(html, 'html.parser')
+    for string in list(soup.find_all(string=True)):
+        if isinstance(string, Comment):
+            if not string.strip().startswith(('[if', '<![endif')):
+                string.extract()
+            continue
+        # Doctypes, CDATA, and script / style text are NavigableString subclasses
+        if type(string) is not NavigableString or _preserves_whitespace(string):
+            continue
+        collapsed = WHITESPACE_RE.sub(' ', string)
+        if collapsed == ' ' and string.parent.name in HTML_INSIGNIFICANT_WHITESPACE:
+            string.extract()
+        elif collapsed != string:
+            string.replace_with(NavigableString(collapsed))
+    return str(soup)
+
+
+def recompress_image(body, quality):
+    """A JPEG re-encoded at quality, or a PNG re-encoded with optimize"""
+    if Image is None:
+        return None
+    with Image.open(io.BytesIO(body)) as image:
+        if image.format not in IMAGE_FORMATS or getattr(image, 'is_animated', False):
+            return None
+        out = io.BytesIO()
+        if image.format == 'JPEG':
+            image.save(out, 'JPEG', quality=quality, optimize=True, progressive=True,
+                       icc_profile=image.info.get('icc_profile'))
+        else:
+            kept = {key: image.info[key] for key in ('transparency', 'gamma', 'dpi', 'icc_profile')
+                    if key in image.info}
+            image.save(out, 'PNG', optimize=True, **kept)
+        return out.getvalue()
+
+
+def can_optimize(kind):
+    """Whether the package optimize_body needs for kind is installed"""
+    if kind == 'js':
+        return rjsmin is not None
+    if kind == 'image':
+        return Image is not None
+    return True
+
+
+OPTIMIZERS = {
+    'css': minify_css,
+    'js': minify_js,
+    'html': minify_html,
+}
+
+
+def optimize_body(kind, body, quality):
+    """
+    Optimize one body (text for 'css', 'js' and 'html', bytes for 'image').
+    None when it can't be optimized or fails to, as a body the minifier or
+    Pillow chokes on is kept as downloaded rather than failing the clone.
+    """
+    try:
+        if kind == 'image':
+            return recompress_image(body, quality)
+        return OPTIMIZERS[kind](body)
+    except Exception:
+        return None
@@ -1,3 +1,78 @@
 from django.db import models
 
-# Create your models here.
+
+class Blob(models.Model):
+    """
+    A stored body, keyed by the SHA-256 of its bytes. The bytes live in
+    the blob store (SCRAPER_BLOB_ROOT); every snapshot resource or page
+    with the same content points at the same row.
+    """
+    digest = models.CharField(max_length=64, primary_key=True)
+    size = models.BigIntegerField()
+    content_type = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.digest
+
+
+class Snapshot(models.Model):
+    """A saved clone of a page, or of a site in crawl mode"""
+    url = models.URLField(max_length=2048)
+    title = models.CharField(max_length=500, blank=True)
+    crawl = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    stats = models.JSONField(default=dict)
+    failed_pages = models.JSONField(default=list)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            # Latest snapshots of a site
+            models.Index(fields=['url', '-created_at']),
+        ]
+
+    def __str__(self):
+        return f'{self.url} @ {self.created_at:%Y-%m-%d %H:%M:%S}'
+
+
+class SnapshotPage(models.Model):
+    """A page of a snapshot with its rewritten HTML"""
+    snapshot = models.ForeignKey(Snapshot, on_delete=models.CASCADE, related_name='pages')
+    url = models.URLField(max_length=2048)
+    path = models.CharField(max_length=1024)
+    title = models.CharField(max_length=500, blank=True)
+    depth = models.PositiveIntegerField(default=0)
+    html = models.ForeignKey(Blob, on_delete=models.PROTECT, related_name='pages')
+
+    class Meta:
+        ordering = ['depth', 'id']
+
+
+class SnapshotResource(models.Model):
+    """
+    A resource of a snapshot. hash is the SHA-256 of the body as it was
+    downloaded; blob holds the body as it is served, which differs for
+    stylesheets, saved with their links rewritten, and for anything the
+    optimize stage shrank (in blob mode hash names the optimized body).
+    """
+    snapshot = models.ForeignKey(Snapshot, on_delete=models.CASCADE, related_name='resources')
+    url = models.TextField()
+    original_path = models.CharField(max_length=1024, blank=True)
+    filename = models.CharField(max_length=500, blank=True)
+    category = models.CharField(max_length=20)
+    type = models.CharField(max_length=50, blank=True)
+    content_type = models.CharField(max_length=255, blank=True)
+    is_binary = models.BooleanField(default=False)
+    size = models.BigIntegerField(default=0)
+    hash = models.CharField(max_length=64, blank=True, db_index=True)
+    etag = models.CharField(max_length=255, blank=True)
+    last_modified = models.CharField(max_length=64, blank=True)
+    downloaded = models.BooleanField(default=False)
+    blob = models.ForeignKey(
+        Blob, on_delete=models.PROTECT, null=True, blank=True, related_name='resources')
+    # Any other fields of the resource dict (alt, error, skipped, depth, ...)
+    extra = models.JSONField(default=dict)
+
+    class Meta:
+        ordering = ['id']
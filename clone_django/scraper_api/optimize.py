@@ -0,0 +1,161 @@
+"""
+Optional optimize stage of a clone ("optimize": true on /api/scrape/ and
+/api/export/zip/): once the downloads are done, stylesheets and scripts
+are minified, pages stripped of whitespace and comments, and PNG and JPEG
+images recompressed at SCRAPER_OPTIMIZE_IMAGE_QUALITY.
+
+The work is CPU-bound, so it runs in the shared process pool, leaving
+the GIL to the download threads. A body is only replaced
+when the optimized one is smaller. Resources reused from a previous
+snapshot are left alone: they were optimized already if that clone was,
+and recompressing a JPEG again loses quality every time.
+"""
+import base64
+
+from django.conf import settings
+
+from . import processes
+from .blobs import get_blob_store
+from .dedup import is_fetched
+from .minify import can_optimize, optimize_body
+
+OPTIMIZED_IMAGE_TYPES = ('image/png', 'image/jpeg', 'image/jpg', 'image/pjpeg')
+
+
+def get_optimize():
+    """Whether clones are optimized when a request doesn't say"""
+    return getattr(settings, 'SCRAPER_OPTIMIZE', False)
+
+
+def get_image_quality():
+    """JPEG quality (1-95) images are recompressed at"""
+    return getattr(settings, 'SCRAPER_OPTIMIZE_IMAGE_QUALITY', 85)
+
+
+def resource_kind(resource):
+    """What optimize_body would do with a resource: 'css', 'js', 'image' or None"""
+    if resource['category'] == 'css':
+        return 'css'
+    if resource['category'] in ('javascript', 'library'):
+        return 'js'
+    content_type = (resource.get('content_type') or '').split(';')[0].strip().lower()
+    if resource.get('is_binary') and content_type in OPTIMIZED_IMAGE_TYPES:
+        return 'image'
+    return None
+
+
+def optimize_kind(resource):
+    """The kind of a resource to optimize, None when it is left as it is"""
+    if not resource.get('downloaded') or resource.get('unchanged'):
+        return None
+    if not is_fetched(resource['url']):
+        return None  # Inline code is optimized with its page
+    kind = resource_kind(resource)
+    return kind if kind and can_optimize(kind) else None
+
+
+def resource_body(resource):
+    """A resource's body as optimize_body takes it, or None when it has none"""
+    content = resource.get('content')
+    if not resource.get('is_binary'):
+        return content or None
+    if content:
+        return base64.b64decode(content)
+    if resource.get('hash') and get_blob_store().exists(resource['hash']):
+        with get_blob_store().open(resource['hash']) as body:
+            return body.read()
+    return None
+
+
+def body_length(body):
+    return len(body.encode('utf-8')) if isinstance(body, str) else len(body)
+
+
+class Optimizer:
+    """
+    Runs a clone's bodies through the process pool and tallies the bytes
+    before and after per category, for stats['optimization']
+    """
+
+    def __init__(self, quality=None):
+        self.quality = quality or get_image_quality()
+        self.sizes = {}
+        self._before = {}
+
+    def submit(self, resource):
+        """Start optimizing a resource; a future for apply(), or None"""
+        kind = optimize_kind(resource)
+        body = resource_body(resource) if kind else None
+        if body is None:
+            return None
+        return self._submit(kind, body)
+
+    def submit_page(self, html):
+        return self._submit('html', html)
+
+    def _submit(self, kind, body):
+        future = processes.submit(optimize_body, kind, body, self.quality)
+        self._before[future] = body_length(body)
+        return future
+
+    def _smaller(self, category, future):
+        """The optimized body when it is smaller, else None; counted either way"""
+        before_size = self._before.pop(future)
+        optimized = future.result()
+        if optimized is not None and body_length(optimized) >= before_size:
+            optimized = None
+        sizes = self.sizes.setdefault(category, {'files': 0, 'before': 0, 'after': 0})
+        sizes['files'] += 1
+        sizes['before'] += before_size
+        sizes['after'] += before_size if optimized is None else body_length(optimized)
+        return optimized
+
+    def apply(self, resource, future):
+        """Put the optimized body of a submitted resource in place"""
+        optimized = self._smaller(resource['category'], future)
+        if optimized is None:
+            return
+
+        if not resource.get('is_binary'):
+            resource['content'] = optimized
+        elif resource.get('content'):
+            resource['content'] = base64.b64encode(optimized).decode('utf-8')
+        else:
+            # Blob mode: the resource points at the optimized body instead
+            resource['hash'] = get_blob_store().put(optimized, resource.get('content_type', ''))
+        resource['size'] = body_length(optimized)
+
+    def page(self, html, future):
+        """The optimized HTML of a submitted page (or the page as it was)"""
+        optimized = self._smaller('html', future)
+        return html if optimized is None else optimized
+
+    def stats(self):
+        return {category: dict(sizes, saved=sizes['before'] - sizes['after'])
+                for category, sizes in self.sizes.items()}
+
+
+def optimize_clone(result):
+    """
+    Optimize a clone response in place: its resources, its page (or every
+    page of a crawl), and stats['optimization']. Page HTML hashes are left
+    for the caller to recompute.
+    """
+    optimizer = Optimizer()
+    pages = result.get('pages') or [result]
+
+    resources = [(resource, optimizer.submit(resource)) for resource in result['resources']]
+    page_futures = [(page, optimizer.submit_page(page['html'])) for page in pages]
+
+    for resource, future in resources:
+        if future is not None:
+            optimizer.apply(resource, future)
+    for page, future in page_futures:
+        page['html'] = optimizer.page(page['html'], future)
+    if result.get('pages'):
+        result['html'] = result['pages'][0]['html']
+
+    result['stats']['optimization'] = optimizer.stats()
+    sizes = result['stats']['optimization'].values()
+    saved = sum(s['saved'] for s in sizes)
+    print(f"🗜️ Optimized {sum(s['files'] for s in sizes)} files, saved {saved / 1024:.1f} KB")
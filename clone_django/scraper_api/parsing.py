@@ -0,0 +1,15 @@
+from bs4 import BeautifulSoup
+from django.conf import settings
+
+# BeautifulSoup tree builders the scraper accepts
+PARSER_BACKENDS = ('html.parser', 'lxml')
+
+
+def get_parser_backend():
+    """Default HTML parser backend ('html.parser' or 'lxml')"""
+    return getattr(settings, 'SCRAPER_PARSER', 'html.parser')
+
+
+def parse_html(content, backend=None):
+    """Parse an HTML document with the selected backend"""
+    return BeautifulSoup(content, backend or get_parser_backend())
@@ -0,0 +1,85 @@
+"""
+Process pool shared by the CPU-bound stages (page parsing and rendering
+of batch clones, the optimize stage), so they scale across cores instead
+of contending for the GIL with the download threads.
+
+Phases the workers time come back with each result and are recorded in
+this process's metrics, which are the ones /metrics serves.
+"""
+import multiprocessing
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+
+from .metrics import captured_phases, record_phases
+
+
+def get_process_workers():
+    """Processes in the pool (None: one per CPU)"""
+    return getattr(settings, 'SCRAPER_PROCESS_WORKERS', None)
+
+
+def init_worker():
+    """Set Django up in a new worker, so it can run scraper_api code"""
+    import django
+    django.setup()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_process_pool():
+    """Process-wide worker pool"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                # Spawned, not forked: a fork of the threaded server copies
+                # locks other threads hold at that moment
+                _pool = ProcessPoolExecutor(
+                    max_workers=get_process_workers(),
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=init_worker)
+    return _pool
+
+
+def run_timed(fn, *args):
+    """The worker side of submit: fn's result and the phases it timed"""
+    with captured_phases() as phases:
+        result = fn(*args)
+    return result, phases
+
+
+def submit(fn, *args):
+    """
+    Run fn(*args) in the pool; a future for its result. A worker that died
+    (killed, or crashed in a C extension) breaks the pool for good, so a
+    new one is started then.
+    """
+    global _pool
+    pool = get_process_pool()
+    try:
+        timed = pool.submit(run_timed, fn, *args)
+    except BrokenProcessPool:
+        with _pool_lock:
+            if _pool is pool:
+                _pool = None
+        timed = get_process_pool().submit(run_timed, fn, *args)
+
+    future = Future()
+    future.set_running_or_notify_cancel()
+
+    def done(timed):
+        try:
+            result, phases = timed.result()
+        except BaseException as e:
+            future.set_exception(e)
+            return
+        record_phases(phases)
+        future.set_result(result)
+
+    timed.add_done_callback(done)
+    return future
@@ -0,0 +1,406 @@
+"""
+Ranged downloads of large resources (videos, audio, archives, PDFs...).
+
+A response that advertises Accept-Ranges: bytes with a Content-Length of
+at least SCRAPER_RANGED_MIN_BYTES isn't read in one go. The file is
+fetched instead as SCRAPER_RANGE_SEGMENTS Range requests in parallel,
+each writing its own part of a part file under SCRAPER_RANGED_ROOT. A
+checkpoint next to it records how far every segment got, so the next try
+of a failed download (the engine's retry, or the next run of
+manage.py clone) requests only the bytes still missing. If-Range makes
+a file that changed in between start over.
+
+A download holds its checkpoint's lock file (flock) until it's done. A
+clone of the same URL running at the same time (in another thread or
+process) gets a checkpoint of its own rather than writing into the same
+part file.
+"""
+import hashlib
+import io
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.conf import settings
+
+from .http_cache import CACHED_HEADERS
+from .spool import SPOOL_CHUNK_SIZE, parse_content_length
+from .throttle import RetryableError, check_status
+from .transport import fetch, get_request_timeout
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+    import msvcrt
+
+# Bytes a segment writes between two saves of its checkpoint
+CHECKPOINT_BYTES = 1024 ** 2
+
+# Smallest segment a file is split into
+MIN_SEGMENT_BYTES = 1024 ** 2
+
+CONTENT_RANGE_RE = re.compile(r'bytes (\d+)-(\d+)/(\d+|\*)')
+
+
+def get_ranged_min_bytes():
+    """Resources at least this large are downloaded by ranges"""
+    return getattr(settings, 'SCRAPER_RANGED_MIN_BYTES', 8 * 1024 ** 2)
+
+
+def get_range_segments():
+    """Range requests in flight for one resource"""
+    return getattr(settings, 'SCRAPER_RANGE_SEGMENTS', 4)
+
+
+def get_ranged_root():
+    """Where part files and their checkpoints are kept until they are complete"""
+    return getattr(settings, 'SCRAPER_RANGED_ROOT',
+                   os.path.join(settings.BASE_DIR, 'ranged'))
+
+
+def get_ranged_max_age():
+    """Seconds without progress after which a part file is given up and deleted"""
+    return getattr(settings, 'SCRAPER_RANGED_MAX_AGE', 7 * 24 * 60 * 60)
+
+
+_last_prune = 0
+_prune_lock = threading.Lock()
+
+# Seconds between two looks for abandoned part files
+PRUNE_INTERVAL = 60 * 60
+
+
+def prune_part_files(root=None, max_age=None, now=None):
+    """
+    Delete the part files and checkpoints under root that made no progress
+    for max_age seconds: downloads no try or run came back to
+    """
+    root = root or get_ranged_root()
+    max_age = get_ranged_max_age() if max_age is None else max_age
+    now = now or time.time()
+    try:
+        names = os.listdir(root)
+    except FileNotFoundError:
+        return
+    for name in names:
+        path = os.path.join(root, name)
+        try:
+            if now - os.path.getmtime(path) > max_age:
+                os.remove(path)
+        except OSError:
+            pass  # Finished or removed by another download meanwhile
+
+
+def maybe_prune_part_files():
+    """prune_part_files, at most once every PRUNE_INTERVAL"""
+    global _last_prune
+    with _prune_lock:
+        if time.time() - _last_prune < PRUNE_INTERVAL:
+            return
+        _last_prune = time.time()
+    prune_part_files()
+
+
+def accepts_ranges(headers):
+    """Whether the body of a 200 response is worth downloading by ranges"""
+    size = parse_content_length(headers.get('content-length'))
+    return (size is not None and size >= get_ranged_min_bytes()
+            and 'bytes' in (headers.get('accept-ranges') or '').lower()
+            and (headers.get('content-encoding') or 'identity').lower() == 'identity')
+
+
+def try_lock(fd):
+    """Lock an open file exclusively, without waiting: OSError while it's held"""
+    if fcntl:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    else:  # pragma: no cover - Windows
+        msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+
+
+def has_checkpoint(resource):
+    """
+    Whether an earlier try left a ranged download of a resource to carry
+    on, that no other download is carrying on right now
+    """
+    checkpoint = Checkpoint(resource['url'], key=resource.get('checkpoint'))
+    if not checkpoint.lock():
+        return False
+    try:
+        return checkpoint.load()
+    finally:
+        checkpoint.unlock()
+
+
+def claim_checkpoint(resource):
+    """
+    The checkpoint of a resource's ranged download, locked. While another
+    download holds the one of the same URL, a new checkpoint of the
+    resource's own, which its next tries carry on (resource['checkpoint']).
+    """
+    checkpoint = Checkpoint(resource['url'], key=resource.get('checkpoint'))
+    if not checkpoint.lock():
+        checkpoint = Checkpoint(resource['url'], key=f'{checkpoint.key}-{uuid.uuid4().hex}')
+        checkpoint.lock()
+        resource['checkpoint'] = checkpoint.key
+    return checkpoint
+
+
+class RangeChanged(Exception):
+    """The server stopped serving the same file by ranges"""
+
+
+# Failures of a ranged download that another try of it won't get past;
+# statuses worth a retry raise RetryableError before raise_for_status
+PERMANENT_ERRORS = (RangeChanged, requests.exceptions.HTTPError)
+
+
+class PartFile(io.FileIO):
+    """A completed part file, removed from disk once closed"""
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            try:
+                os.remove(self.name)
+            except FileNotFoundError:
+                pass
+
+
+class Checkpoint:
+    """
+    A ranged download in progress: its part file and, saved as JSON next
+    to it, the file's size and validators and how far each segment got.
+    Named after the URL's hash, or key.
+    """
+
+    def __init__(self, url, root=None, key=None):
+        self.key = key or hashlib.sha256(url.encode('utf-8')).hexdigest()
+        root = root or get_ranged_root()
+        self.url = url
+        self.part_path = os.path.join(root, self.key + '.part')
+        self.path = os.path.join(root, self.key + '.json')
+        self.lock_path = os.path.join(root, self.key + '.lock')
+        self.size = None
+        self.headers = {}
+        # [first byte, last byte, next byte to write] of each segment
+        self.segments = []
+        self._lock = threading.Lock()
+        self._lock_fd = None
+
+    def lock(self):
+        """Take the checkpoint for this download; False while another one holds it"""
+        os.makedirs(os.path.dirname(self.lock_path), exist_ok=True)
+        fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT)
+        try:
+            try_lock(fd)
+        except OSError:
+            os.close(fd)
+            return False
+        # Fresh, so prune_part_files leaves it be
+        os.utime(self.lock_path)
+        self._lock_fd = fd
+        return True
+
+    def unlock(self):
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+    def load(self):
+        """Read the saved state; False when there is nothing to carry on from"""
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                state = json.load(f)
+            if (state['url'] != self.url
+                    or os.path.getsize(self.part_path) != state['size']
+                    or time.time() - os.path.getmtime(self.path) > get_ranged_max_age()):
+                return False
+        except (OSError, ValueError, KeyError):
+            return False
+        self.size = state['size']
+        self.headers = state['headers']
+        self.segments = state['segments']
+        # Without a validator a changed file can't be told apart
+        return self.validator() is not None
+
+    def matches(self, headers):
+        """Whether a new response is for the file this checkpoint holds part of"""
+        return (parse_content_length(headers.get('content-length')) == self.size
+                and all(headers.get(name) == self.headers.get(name)
+                        for name in ('etag', 'last-modified')))
+
+    def start(self, size, headers):
+        """Split a new download into segments and allocate its part file"""
+        self.size = size
+        self.headers = {name: headers[name] for name in CACHED_HEADERS if headers.get(name)}
+        count = max(1, min(get_range_segments(), size // MIN_SEGMENT_BYTES))
+        bounds = [size * i // count for i in range(count + 1)]
+        self.segments = [[bounds[i], bounds[i + 1] - 1, bounds[i]] for i in range(count)]
+
+        os.makedirs(os.path.dirname(self.part_path), exist_ok=True)
+        maybe_prune_part_files()
+        with open(self.part_path, 'wb') as part:
+            part.truncate(size)
+        self.save()
+
+    def validator(self):
+        """The If-Range value: a strong ETag, else Last-Modified"""
+        etag = self.headers.get('etag')
+        if etag and not etag.startswith('W/'):
+            return etag
+        return self.headers.get('last-modified')
+
+    def remaining(self):
+        return sum(end + 1 - position for _, end, position in self.segments)
+
+    def advance(self, index, position):
+        """Record a segment's progress, once its bytes are written"""
+        with self._lock:
+            self.segments[index][2] = position
+        self.save()
+
+    def save(self):
+        with self._lock:
+            state = {'url': self.url, 'size': self.size, 'headers': self.headers,
+                     'segments': self.segments}
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(state, f)
+            os.replace(tmp_path, self.path)
+
+    def remove(self):
+        for path in (self.path, self.part_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def finish(self):
+        """
+        Drop the checkpoint of a completed download and return its part
+        file, renamed so the next download of the URL can't write into it
+        """
+        done_path = os.path.join(os.path.dirname(self.part_path),
+                                 f'{self.key}-{uuid.uuid4().hex}.done')
+        os.replace(self.part_path, done_path)
+        self.remove()
+        return done_path
+
+
+def download_segment(checkpoint, index, headers):
+    """Fetch what's missing of one segment into its place in the part file"""
+    _, end, position = checkpoint.segments[index]
+    if position > end:
+        return
+
+    request_headers = {**headers, 'Range': f'bytes={position}-{end}',
+                       # Ranges of an encoded body can't be decoded on their own
+                       'Accept-Encoding': 'identity',
+                       'If-Range': checkpoint.validator()}
+    response = fetch(checkpoint.url, headers=request_headers,
+                     timeout=get_request_timeout(), stream=True)
+    with response:
+        check_status(response.status_code, response.headers)
+        response.raise_for_status()
+        match = CONTENT_RANGE_RE.fullmatch(response.headers.get('content-range', ''))
+        if (response.status_code != 206 or not match or int(match[1]) != position
+                or match[3] not in ('*', str(checkpoint.size))
+                or (response.headers.get('content-encoding') or 'identity') != 'identity'):
+            # A 200 is the whole (changed) file, as If-Range asks
+            raise RangeChanged(f'{checkpoint.url} changed or no longer takes ranges')
+
+        unsaved = 0
+        try:
+            with open(checkpoint.part_path, 'r+b') as part:
+                part.seek(position)
+                for chunk in response.iter_content(SPOOL_CHUNK_SIZE):
+                    chunk = chunk[:end + 1 - position]
+                    part.write(chunk)
+                    position += len(chunk)
+                    unsaved += len(chunk)
+                    if position > end:
+                        break
+                    if unsaved >= CHECKPOINT_BYTES:
+                        part.flush()
+                        checkpoint.advance(index, position)
+                        unsaved = 0
+        finally:
+            if unsaved:
+                checkpoint.advance(index, position)
+
+    if position <= end:
+        raise RetryableError(f'Range of {checkpoint.url} ended at byte {position}')
+
+
+def download_ranged(resource, headers, spooler, response_headers=None):
+    """
+    Download a resource by ranges. With response_headers (from a plain GET
+    showing the server takes ranges) a new download starts, unless a
+    checkpoint for the same file is there already; without, the checkpoint
+    an earlier try left is carried on.
+
+    Returns (body, headers): the completed file, removed once closed, and
+    the headers to cache it under; (None, None) when the resource is over
+    a byte budget. Raises RetryableError, with the progress saved, for a
+    try that didn't get every segment.
+    """
+    checkpoint = claim_checkpoint(resource)
+    try:
+        return _download_ranged(resource, headers, spooler, response_headers, checkpoint)
+    finally:
+        checkpoint.unlock()
+
+
+def _download_ranged(resource, headers, spooler, response_headers, checkpoint):
+    """download_ranged, once it holds the checkpoint"""
+    resumed = checkpoint.load()
+    if response_headers is not None:
+        if resumed and not checkpoint.matches(response_headers):
+            checkpoint.remove()
+            resumed = False
+        size = checkpoint.size if resumed else parse_content_length(
+            response_headers.get('content-length'))
+    elif resumed:
+        size = checkpoint.size
+    else:
+        raise RetryableError(f'No checkpoint left to carry on {resource["url"]}')
+
+    if not spooler.admit_body(resource, size):
+        checkpoint.remove()
+        return None, None
+    if not resumed:
+        checkpoint.start(size, response_headers)
+
+    print(f"🧩 Ranged download of {resource['filename']}: {len(checkpoint.segments)} segments, "
+          f"{checkpoint.remaining()} of {size} bytes to go")
+    try:
+        with ThreadPoolExecutor(max_workers=len(checkpoint.segments)) as executor:
+            futures = [executor.submit(download_segment, checkpoint, index, headers)
+                       for index in range(len(checkpoint.segments))]
+        errors = [future.exception() for future in futures if future.exception()]
+        if errors:
+            raise next((e for e in errors if isinstance(e, PERMANENT_ERRORS)), errors[0])
+    except PERMANENT_ERRORS as e:
+        # Carrying on would fail the same way on every try (and run): drop
+        # the checkpoint, the next try gets the whole file in one go
+        spooler.release(size)
+        checkpoint.remove()
+        resource['ranged'] = False
+        raise RetryableError(str(e)) from e
+    except (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+            requests.exceptions.ChunkedEncodingError) as e:
+        spooler.release(size)
+        raise RetryableError(str(e)) from e
+    except BaseException:
+        spooler.release(size)
+        raise
+
+    resource['ranged'] = True
+    return PartFile(checkpoint.finish()), checkpoint.headers
@@ -0,0 +1,66 @@
+"""
+MessagePack encoding of clone responses, negotiated with
+``Accept: application/msgpack`` (or ``?format=msgpack``). Binary resource
+bodies are sent as raw bytes rather than base64, a third smaller and
+without the encode/decode on either side. Needs the msgpack package; the
+scrape endpoints only offer it when it is installed.
+"""
+import base64
+
+from rest_framework.renderers import BaseRenderer
+from rest_framework.settings import api_settings
+
+from .dedup import is_fetched
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - optional dependency
+    msgpack = None
+
+MSGPACK_CONTENT_TYPE = 'application/msgpack'
+
+
+def raw_resource(resource):
+    """A resource with its base64 body as bytes (a copy, when it has one)"""
+    content = resource.get('content')
+    if not (resource.get('is_binary') and content and isinstance(content, str)
+            and is_fetched(resource.get('url', ''))):
+        return resource
+    return {**resource, 'content': base64.b64decode(content)}
+
+
+def raw_bodies(data):
+    """A clone response with binary bodies as bytes, leaving data itself as it is"""
+    if not isinstance(data, dict):
+        return data
+    if isinstance(data.get('resources'), list):
+        data = {**data, 'resources': [raw_resource(r) for r in data['resources']]}
+    if isinstance(data.get('resource'), dict):
+        data = {**data, 'resource': raw_resource(data['resource'])}
+    return data
+
+
+def pack(data):
+    return msgpack.packb(raw_bodies(data), use_bin_type=True)
+
+
+def msgpack_record(record_type, **fields):
+    """Encode one record of a streamed clone, the MessagePack counterpart of an NDJSON line"""
+    return pack({'type': record_type, **fields})
+
+
+class MessagePackRenderer(BaseRenderer):
+    media_type = MSGPACK_CONTENT_TYPE
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return pack(data)
+
+
+# Renderers of the endpoints returning clones
+CLONE_RENDERERS = list(api_settings.DEFAULT_RENDERER_CLASSES) + (
+    [MessagePackRenderer] if msgpack is not None else [])
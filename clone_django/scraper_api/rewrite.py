@@ -0,0 +1,163 @@
+"""
+Single-pass rewriting of a clone's links to its local files.
+
+Every URL-bearing attribute (including srcset, poster and inline style
+url()s), <style> blocks and downloaded stylesheets are rewritten from one
+table of canonical absolute URL -> saved path, built once per clone.
+"""
+from urllib.parse import urljoin, urlsplit
+
+from .crawler import relative_link
+from .css import CSS_IMPORT_STRING_RE, CSS_URL_RE
+from .dedup import canonical_url, is_fetched
+
+# Attributes holding a single URL
+URL_ATTRIBUTES = frozenset((
+    'href', 'src', 'data-src', 'data-lazy-src', 'data-original', 'poster', 'data'))
+# Attributes holding a srcset candidate list
+SRCSET_ATTRIBUTES = frozenset(('srcset', 'data-srcset'))
+
+# References that never point at a clone's files
+SKIPPED_PREFIXES = ('#', 'data:', 'javascript:', 'mailto:', 'tel:', 'about:', 'blob:')
+
+
+def build_link_table(resources):
+    """
+    {canonical URL: saved path} for every downloaded resource of a clone.
+    Resources that failed, or were skipped, map to their absolute URL
+    instead, so the clone keeps loading them from the origin.
+    """
+    table = {}
+    for resource in resources:
+        if is_fetched(resource['url']) and resource.get('downloaded'):
+            table.setdefault(canonical_url(resource['url']), resource['original_path'])
+    for resource in resources:
+        if is_fetched(resource['url']):
+            table.setdefault(canonical_url(resource['url']), resource['url'])
+    return table
+
+
+def is_remote(path):
+    """Whether a link table entry is an origin URL rather than a saved path"""
+    return path.startswith(('http://', 'https://'))
+
+
+class LinkRewriter:
+    """
+    Maps references found in one document (a page or a stylesheet) to
+    local paths relative to where that document is saved.
+
+    references are resolved against base_url and looked up in table, then
+    in page_paths (crawled pages, keyed by canonical URL). Table entries
+    holding an origin URL (resources that weren't downloaded) are made
+    absolute. Unknown references are left alone, or made absolute with
+    absolutize so they still load from the origin once the document has
+    moved. Results are memoized per
+    document, since pages repeat the same URLs.
+    """
+
+    def __init__(self, table, base_url, document_path, page_paths=None, absolutize=False):
+        self.table = table
+        self.base_url = base_url
+        self.document_path = document_path
+        self.page_paths = page_paths or {}
+        self.absolutize = absolutize
+        self._memo = {}
+        parts = urlsplit(base_url)
+        self._scheme = parts.scheme
+        self._origin = f'{parts.scheme}://{parts.netloc}'
+
+    def _absolute(self, value):
+        """urljoin with shortcuts for the common absolute and root-relative forms"""
+        if value.startswith(('http://', 'https://')):
+            return value
+        if value.startswith('//'):
+            return f'{self._scheme}:{value}'
+        if value.startswith('/'):
+            return self._origin + value
+        return urljoin(self.base_url, value)
+
+    def __call__(self, reference):
+        """The rewritten reference, or reference itself when unchanged"""
+        try:
+            return self._memo[reference]
+        except KeyError:
+            pass
+
+        result = reference
+        value = reference.strip()
+        if value and not value.lower().startswith(SKIPPED_PREFIXES):
+            absolute = self._absolute(value)
+            url, _, fragment = absolute.partition('#')
+            key = canonical_url(url)
+            path = self.table.get(key) or self.page_paths.get(key)
+            if path and is_remote(path):
+                result = absolute
+            elif path:
+                result = relative_link(path, self.document_path) + (
+                    f'#{fragment}' if fragment else '')
+            elif self.absolutize:
+                result = absolute
+
+        self._memo[reference] = result
+        return result
+
+    def srcset(self, value):
+        """Rewrite each candidate URL of a srcset, keeping its descriptor"""
+        candidates = []
+        for candidate in value.split(','):
+            parts = candidate.strip().split(None, 1)
+            if not parts:
+                continue
+            parts[0] = self(parts[0])
+            candidates.append(' '.join(parts))
+        return ', '.join(candidates)
+
+    def css(self, text):
+        """Rewrite url() and @import "..." references in CSS text"""
+        def replace_url(match):
+            quote, reference = match.group(1), match.group(2)
+            return f'url({quote}{self(reference.strip())}{quote})'
+
+        def replace_import(match):
+            quote, reference = match.group(1), match.group(2)
+            return f'@import {quote}{self(reference)}{quote}'
+
+        if 'url(' not in text.lower() and '@import' not in text.lower():
+            return text
+        text = CSS_URL_RE.sub(replace_url, text)
+        return CSS_IMPORT_STRING_RE.sub(replace_import, text)
+
+
+def _is_meta_image(tag):
+    """<meta property="og:image"> and friends, as found by image discovery"""
+    name = tag.get('property', '') or tag.get('name', '')
+    return isinstance(name, str) and 'image' in name
+
+
+def rewrite_document(soup, rewrite):
+    """
+    Rewrite every URL in a parsed page with a LinkRewriter, in one walk
+    over the tree
+    """
+    for tag in soup.find_all(True):
+        attrs = tag.attrs
+        for name, value in attrs.items():
+            if not isinstance(value, str):
+                continue  # multi-valued attributes (class, rel) hold no URLs
+            if name in URL_ATTRIBUTES:
+                attrs[name] = rewrite(value)
+            elif name in SRCSET_ATTRIBUTES:
+                attrs[name] = rewrite.srcset(value)
+            elif name == 'style':
+                attrs[name] = rewrite.css(value)
+            elif name == 'content' and tag.name == 'meta' and _is_meta_image(tag):
+                attrs[name] = rewrite(value)
+
+        if tag.name == 'style' and tag.string:
+            css = rewrite.css(str(tag.string))
+            if css != tag.string:
+                # Keep the string class (Stylesheet) so it isn't escaped
+                tag.string.replace_with(type(tag.string)(css))
+
+    return soup
@@ -0,0 +1,182 @@
+"""
+Saved clones. A snapshot keeps a clone's pages and resources in the
+database and their bodies in the blob store, one copy per distinct
+content however many snapshots (or URLs) share it, so a site re-cloned
+every day only grows the store by what changed.
+"""
+import base64
+
+from django.conf import settings
+from django.db import transaction
+
+from .blobs import get_blob_store
+from .dedup import is_fetched
+from .exports import resource_body_bytes
+from .models import Blob, Snapshot, SnapshotPage, SnapshotResource
+
+# Resource dict keys stored in SnapshotResource columns; the rest go to extra
+RESOURCE_COLUMNS = (
+    'url', 'original_path', 'filename', 'category', 'type', 'content_type',
+    'is_binary', 'size', 'hash', 'etag', 'last_modified', 'downloaded')
+# Per-clone bookkeeping that means nothing once the clone is saved
+TRANSIENT_KEYS = ('content', 'cache', 'coalesced', 'unchanged', 'checkpoint')
+
+
+def get_save_snapshots():
+    """Whether clones are saved as snapshots when a request doesn't say"""
+    return getattr(settings, 'SCRAPER_SAVE_SNAPSHOTS', False)
+
+
+def get_snapshot_list_limit():
+    """Most snapshots returned by one list request"""
+    return getattr(settings, 'SCRAPER_SNAPSHOT_LIST_LIMIT', 100)
+
+
+def blob_row(digest, size, content_type=''):
+    blob, _ = Blob.objects.get_or_create(
+        digest=digest, defaults={'size': size, 'content_type': content_type})
+    return blob
+
+
+def store_blob(content, content_type=''):
+    """Put a body in the blob store and return its (shared) Blob row"""
+    digest = get_blob_store().put(content, content_type)
+    return blob_row(digest, len(content), content_type)
+
+
+def resource_blob(resource):
+    """
+    The Blob holding a resource's body: the raw body of a downloaded
+    binary file, the content of anything else (text, inline code, data:
+    URLs) as UTF-8. None when there is no body to keep.
+    """
+    content = resource.get('content') or ''
+    content_type = resource.get('content_type', '')
+    if not resource.get('downloaded'):
+        return None
+
+    if resource.get('is_binary') and is_fetched(resource['url']):
+        if not content and resource.get('hash') and get_blob_store().exists(resource['hash']):
+            # Blob mode: the body is in the store already
+            return blob_row(resource['hash'], resource.get('size', 0), content_type)
+        if content:
+            return store_blob(resource_body_bytes(resource), content_type)
+    elif content:
+        return store_blob(content.encode('utf-8'), content_type)
+
+    if resource.get('unchanged') and resource.get('hash'):
+        # Revalidated against a trimmed snapshot: the body is the one an
+        # earlier snapshot saved under the same download hash
+        earlier = (SnapshotResource.objects
+                   .filter(hash=resource['hash'], blob__isnull=False)
+                   .exclude(category='css').select_related('blob').first())
+        return earlier.blob if earlier else None
+    return None
+
+
+def save_snapshot(result):
+    """Save a clone response (single page or crawl), returns the Snapshot"""
+    pages = result.get('pages') or [{
+        'url': result['url'], 'path': 'index.html', 'depth': 0,
+        'title': result.get('title'), 'html': result['html'],
+    }]
+
+    with transaction.atomic():
+        snapshot = Snapshot.objects.create(
+            url=result['url'],
+            title=(result.get('title') or '')[:500],
+            crawl=bool(result.get('pages')),
+            stats=result.get('stats', {}),
+            failed_pages=result.get('failed_pages', []),
+        )
+
+        SnapshotPage.objects.bulk_create(SnapshotPage(
+            snapshot=snapshot,
+            url=page['url'],
+            path=page['path'],
+            title=(page.get('title') or '')[:500],
+            depth=page.get('depth', 0),
+            html=store_blob(page['html'].encode('utf-8'), 'text/html; charset=utf-8'),
+        ) for page in pages)
+
+        rows = []
+        for resource in result['resources']:
+            rows.append(SnapshotResource(
+                snapshot=snapshot,
+                blob=resource_blob(resource),
+                extra={k: v for k, v in resource.items()
+                       if k not in RESOURCE_COLUMNS and k not in TRANSIENT_KEYS},
+                **{k: resource[k] for k in RESOURCE_COLUMNS
+                   if resource.get(k) is not None},
+            ))
+        SnapshotResource.objects.bulk_create(rows)
+
+    return snapshot
+
+
+def read_blob(blob):
+    with get_blob_store().open(blob.digest) as body:
+        return body.read()
+
+
+def snapshot_summary(snapshot):
+    """What the snapshot list shows for one snapshot"""
+    return {
+        'id': snapshot.id,
+        'url': snapshot.url,
+        'title': snapshot.title,
+        'crawl': snapshot.crawl,
+        'created_at': snapshot.created_at.isoformat(),
+        'stats': snapshot.stats,
+    }
+
+
+def resource_data(row, binary_mode='inline'):
+    """A SnapshotResource as the resource dict of a clone response"""
+    resource = {k: getattr(row, k) for k in RESOURCE_COLUMNS}
+    resource.update(row.extra)
+    resource['content'] = ''
+
+    if row.blob_id is None:
+        return resource
+    if row.is_binary and is_fetched(row.url):
+        if binary_mode == 'blob':
+            # Served by /api/blob/<hash>/, which is the stored body's digest
+            resource['hash'] = row.blob_id
+        else:
+            resource['content'] = base64.b64encode(read_blob(row.blob)).decode('utf-8')
+    else:
+        resource['content'] = read_blob(row.blob).decode('utf-8')
+    return resource
+
+
+def snapshot_result(snapshot, binary_mode='inline'):
+    """
+    A saved snapshot in the shape of the clone response it was saved
+    from, so it can be shown (or passed as 'previous') without scraping
+    """
+    pages = [{
+        'url': page.url,
+        'path': page.path,
+        'depth': page.depth,
+        'title': page.title,
+        'html': read_blob(page.html).decode('utf-8'),
+        'html_hash': page.html_id,
+    } for page in snapshot.pages.select_related('html')]
+    resources = [resource_data(row, binary_mode)
+                 for row in snapshot.resources.select_related('blob')]
+
+    result = {
+        'snapshot_id': snapshot.id,
+        'html': pages[0]['html'],
+        'html_hash': pages[0]['html_hash'],
+        'resources': resources,
+        'url': snapshot.url,
+        'title': snapshot.title,
+        'scraped_at': snapshot.created_at.strftime('%Y-%m-%d %H:%M:%S'),
+        'stats': snapshot.stats,
+    }
+    if snapshot.crawl:
+        result['pages'] = pages
+        result['failed_pages'] = snapshot.failed_pages
+    return result
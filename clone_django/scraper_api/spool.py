@@ -0,0 +1,160 @@
+import os
+import tempfile
+import threading
+
+from django.conf import settings
+
+# Read size for response bodies
+SPOOL_CHUNK_SIZE = 64 * 1024
+
+SKIP_TOO_LARGE = 'too_large'
+SKIP_JOB_BUDGET = 'job_budget'
+
+
+def get_max_resource_bytes():
+    """Largest single resource a clone downloads"""
+    return getattr(settings, 'SCRAPER_MAX_RESOURCE_BYTES', 50 * 1024 ** 2)
+
+
+def get_max_job_bytes():
+    """Total resource bytes one clone may download"""
+    return getattr(settings, 'SCRAPER_MAX_JOB_BYTES', 500 * 1024 ** 2)
+
+
+def get_spool_memory_bytes():
+    """Bodies up to this size stay in memory, bigger ones spill to disk"""
+    return getattr(settings, 'SCRAPER_SPOOL_MEMORY_BYTES', 1024 ** 2)
+
+
+def parse_content_length(value):
+    try:
+        return int(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def body_size(body):
+    """Size of a body given as bytes or as a seekable file"""
+    if isinstance(body, (bytes, bytearray)):
+        return len(body)
+    position = body.tell()
+    size = body.seek(0, os.SEEK_END)
+    body.seek(position)
+    return size - position
+
+
+def read_body(body):
+    """A body given as bytes or as a file, read into bytes"""
+    return body if isinstance(body, (bytes, bytearray)) else body.read()
+
+
+def iter_body(body, chunk_size=SPOOL_CHUNK_SIZE):
+    """Chunks of a body given as bytes or as a file"""
+    if isinstance(body, (bytes, bytearray)):
+        yield body
+        return
+    for chunk in iter(lambda: body.read(chunk_size), b''):
+        yield chunk
+
+
+class BodySpooler:
+    """
+    Reads response bodies chunk by chunk into spooled temporary files and
+    enforces the byte budgets of one clone: a per-resource limit and a
+    total shared by all of its downloads.
+
+    A resource over either budget is marked skipped (with its advertised
+    size when the server sent one) instead of failing the download.
+    """
+
+    def __init__(self, max_resource_bytes=None, max_job_bytes=None, memory_bytes=None):
+        self.max_resource_bytes = max_resource_bytes or get_max_resource_bytes()
+        self.max_job_bytes = max_job_bytes or get_max_job_bytes()
+        self.memory_bytes = memory_bytes or get_spool_memory_bytes()
+        self.used = 0
+        self._lock = threading.Lock()
+
+    def _reserve(self, size):
+        with self._lock:
+            if self.used + size > self.max_job_bytes:
+                return False
+            self.used += size
+            return True
+
+    def _release(self, size):
+        with self._lock:
+            self.used -= size
+
+    def skip(self, resource, reason, advertised=None):
+        resource['skipped'] = reason
+        resource['advertised_size'] = advertised
+        resource['downloaded'] = False
+        resource['content'] = ''
+        return False
+
+    def admit(self, resource, content_length):
+        """
+        Check a response's Content-Length before reading it. Returns False
+        (and marks the resource skipped) if it can't fit.
+        """
+        advertised = parse_content_length(content_length)
+        if advertised is None:
+            return True
+        if advertised > self.max_resource_bytes:
+            return self.skip(resource, SKIP_TOO_LARGE, advertised)
+        if self.used + advertised > self.max_job_bytes:
+            return self.skip(resource, SKIP_JOB_BUDGET, advertised)
+        return True
+
+    def admit_body(self, resource, size):
+        """Count an already-read body (e.g. from the HTTP cache)"""
+        if size > self.max_resource_bytes:
+            return self.skip(resource, SKIP_TOO_LARGE, size)
+        if not self._reserve(size):
+            return self.skip(resource, SKIP_JOB_BUDGET, size)
+        return True
+
+    def release(self, size):
+        """Give back bytes counted by admit_body for a body that wasn't kept"""
+        self._release(size)
+
+    def new_file(self):
+        return tempfile.SpooledTemporaryFile(max_size=self.memory_bytes)
+
+    def write(self, resource, body, chunk, content_length=None):
+        """
+        Append a chunk to a spooled body. Returns False once the body goes
+        over a budget; its bytes are given back and the resource skipped.
+        """
+        if body.tell() + len(chunk) > self.max_resource_bytes:
+            self._release(body.tell())
+            return self.skip(resource, SKIP_TOO_LARGE, parse_content_length(content_length))
+        if not self._reserve(len(chunk)):
+            self._release(body.tell())
+            return self.skip(resource, SKIP_JOB_BUDGET, parse_content_length(content_length))
+        body.write(chunk)
+        return True
+
+    def discard(self, body):
+        """Drop a partly written body (a failed read), giving its bytes back"""
+        self._release(body.tell())
+        body.close()
+
+    def spool(self, resource, content_length, chunks):
+        """
+        Spool an iterable of chunks. Returns the body rewound to the start,
+        or None when the resource was skipped.
+        """
+        if not self.admit(resource, content_length):
+            return None
+        body = self.new_file()
+        try:
+            for chunk in chunks:
+                if not self.write(resource, body, chunk, content_length):
+                    body.close()
+                    return None
+        except BaseException:
+            self.discard(body)
+            raise
+        body.seek(0)
+        return body
@@ -1,3 +1,1160 @@
-from django.test import TestCase
+import contextlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import zipfile
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from bs4 import BeautifulSoup
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from benchmarks.fixture_server import (
+    FixtureServer, H2FixtureServer, RangeFixtureServer, RateLimitedFixtureServer)
+
+from . import blobs, jobs, renderers, views
+from .compression import AVAILABLE_ENCODINGS, decompress_body, negotiate_encoding
+from .crawler import Frontier, page_local_path
+from .dedup import ResourceIndex, canonical_url
+from .disk import Manifest, output_path, write_file
+from .blobs import BlobStore
+from .http2 import HTTP2_AVAILABLE
+from .http_cache import HttpCache, store_cached
+from .jobs import JOB_DONE, JOB_FAILED, JOB_QUEUED, JOB_RUNNING, JobQueue
+from .models import Blob
+from .ranged import Checkpoint, MIN_SEGMENT_BYTES, claim_checkpoint, has_checkpoint
+from .rewrite import LinkRewriter, build_link_table, rewrite_document
+from .spool import SKIP_JOB_BUDGET, SKIP_TOO_LARGE, BodySpooler, read_body
+from .minify import can_optimize, minify_css, minify_html
+from .metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, PHASE_SECONDS, in_flight
+from .throttle import HostLimit, HostLimits, HostScheduler, RetryableError, backoff_delay
+from .transport import SessionPool
+
+
+def make_resource(url, path, category='image'):
+    return {'url': url, 'original_path': path, 'filename': os.path.basename(path),
+            'category': category, 'downloaded': False, 'content': ''}
+
+
+def collect_body(resource, content, content_type, text=None):
+    """A store_body keeping the body as bytes"""
+    resource.update(body=read_body(content), content_type=content_type, downloaded=True)
+
+
+class CookieFixtureServer(FixtureServer):
+    """Sets a cookie on every response, and echoes the cookies it was sent"""
+
+    async def respond(self, method, path, headers):
+        status, response_headers, _ = await super().respond(method, path, headers)
+        response_headers['Set-Cookie'] = 'session=secret; Path=/'
+        return status, response_headers, headers.get('cookie', '').encode()
+
+
+class TempDirMixin:
+    def setUp(self):
+        super().setUp()
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp, ignore_errors=True)
+
+
+class CanonicalUrlTests(SimpleTestCase):
+    def test_normalizes_case_port_dots_and_fragment(self):
+        self.assertEqual(canonical_url('HTTPS://Example.COM:443/a/./b/../c?x=1#top'),
+                         'https://example.com/a/c?x=1')
+
+    def test_empty_path_and_explicit_port(self):
+        self.assertEqual(canonical_url('http://a.com'), 'http://a.com/')
+        self.assertEqual(canonical_url('http://a.com:8080/'), 'http://a.com:8080/')
+
+    def test_percent_escapes(self):
+        # Unreserved characters are decoded, other escapes uppercased
+        self.assertEqual(canonical_url('http://a.com/%7euser/%2f'), 'http://a.com/~user/%2F')
+
+    def test_urls_already_canonical_are_returned_as_they_are(self):
+        for url in ('https://a.com/', 'https://a.com:8443/x/y.png?w=1', 'http://a.com/v1.2/'):
+            self.assertIs(canonical_url(url), url)
+        # Close calls that still need normalizing
+        self.assertEqual(canonical_url('http://a.com:80/x'), 'http://a.com/x')
+        self.assertEqual(canonical_url('https://a.com/x?'), 'https://a.com/x')
+        self.assertEqual(canonical_url('https://a.com/a/../b.png'), 'https://a.com/b.png')
+        self.assertEqual(canonical_url('https://a.com/a//b.png'), 'https://a.com/a/b.png')
+        self.assertEqual(canonical_url('https://a.com'), 'https://a.com/')
+
+    def test_query_order_is_kept(self):
+        self.assertNotEqual(canonical_url('http://a.com/?a=1&b=2'),
+                            canonical_url('http://a.com/?b=2&a=1'))
+
+
+class ResourceIndexTests(SimpleTestCase):
+    def test_duplicates_by_canonical_url(self):
+        index = ResourceIndex()
+        self.assertTrue(index.add(make_resource('https://a.com/img/x.png', 'img/x.png')))
+        self.assertFalse(index.add(make_resource('https://A.com/img/./x.png#f', 'img/x-2.png')))
+        self.assertEqual(len(index), 1)
+        self.assertIn('https://a.com:443/img/x.png', index)
+        self.assertEqual(index.paths, {'https://a.com/img/x.png': 'img/x.png'})
+
+    def test_inline_resources_are_always_kept(self):
+        index = ResourceIndex([make_resource('inline', 'inline.css', 'css'),
+                               make_resource('inline', 'inline.css', 'css')])
+        self.assertEqual(len(index), 2)
+
+    def test_font_preloaded_as_stylesheet_is_recategorized(self):
+        preload = make_resource('https://a.com/f.woff2', 'css/f.woff2', 'css')
+        index = ResourceIndex([preload])
+        index.add(make_resource('https://a.com/f.woff2', 'fonts/f.woff2', 'font'))
+        self.assertEqual(preload['category'], 'font')
+        self.assertEqual(index.paths['https://a.com/f.woff2'], 'fonts/f.woff2')
+
+
+class PreloadDiscoveryTests(SimpleTestCase):
+    """A <link rel="preload"> doesn't make what it preloads a stylesheet"""
+
+    html = ('<html><head>'
+            '<link rel="preload" as="script" href="/static/app.js">'
+            '<link rel="preload" as="image" href="/hero.png">'
+            '<link rel="preload" as="style" href="/late.css">'
+            '</head><body><script src="/static/app.js"></script>'
+            '<img src="/hero.png"></body></html>')
+
+    def discover(self, html):
+        with contextlib.redirect_stdout(io.StringIO()):
+            resources = views.discover_all_resources(
+                BeautifulSoup(html, 'html.parser'), 'https://a.com/')
+        return {r['url']: r for r in resources}
+
+    def test_categories_and_paths(self):
+        resources = self.discover(self.html)
+        self.assertEqual(
+            {url: (r['category'], r['original_path']) for url, r in resources.items()},
+            {'https://a.com/static/app.js': ('javascript', 'static/app.js'),
+             'https://a.com/hero.png': ('image', 'images/hero.png'),
+             'https://a.com/late.css': ('css', 'css/late.css')})
+
+    def test_preload_before_its_tag_gives_way(self):
+        index = ResourceIndex()
+        preload = {**make_resource('https://a.com/app.js', 'app.js.css', 'css'),
+                   'type': 'preload'}
+        index.add(preload)
+        index.add(make_resource('https://a.com/app.js', 'app.js', 'javascript'))
+        self.assertEqual((preload['category'], index.paths['https://a.com/app.js']),
+                         ('javascript', 'app.js'))
+        # A real stylesheet link isn't replaced
+        index.add(make_resource('https://a.com/site.css', 'site.css', 'css'))
+        self.assertFalse(index.add(make_resource('https://a.com/site.css', 'site.png')))
+        self.assertEqual(index.paths['https://a.com/site.css'], 'site.css')
+
+
+def downloaded(resource):
+    resource['downloaded'] = True
+    return resource
+
+
+class LinkRewriterTests(SimpleTestCase):
+    def setUp(self):
+        self.table = build_link_table([
+            downloaded(make_resource('https://a.com/img/logo.png', 'img/logo.png')),
+            downloaded(make_resource('https://a.com/css/site.css', 'css/site.css', 'css')),
+            downloaded(make_resource('https://a.com/img/bg.png', 'img/bg.png')),
+        ])
+
+    def test_relative_to_the_document(self):
+        rewrite = LinkRewriter(self.table, 'https://a.com/blog/post', 'blog/post.html')
+        self.assertEqual(rewrite('/img/logo.png'), '../img/logo.png')
+        self.assertEqual(rewrite('../img/logo.png#x'), '../img/logo.png#x')
+        self.assertEqual(rewrite('HTTPS://A.COM/img/logo.png'), '../img/logo.png')
+
+    def test_unknown_and_skipped_references(self):
+        rewrite = LinkRewriter(self.table, 'https://a.com/', 'index.html')
+        self.assertEqual(rewrite('/missing.png'), '/missing.png')
+        self.assertEqual(rewrite('#top'), '#top')
+        self.assertEqual(rewrite('data:image/png;base64,AA'), 'data:image/png;base64,AA')
+        absolutize = LinkRewriter(self.table, 'https://a.com/', 'index.html', absolutize=True)
+        self.assertEqual(absolutize('/missing.png'), 'https://a.com/missing.png')
+
+    def test_resources_not_downloaded_load_from_the_origin(self):
+        failed = make_resource('https://a.com/img/gone.png', 'img/gone.png')
+        failed['error'] = '404 Client Error'
+        skipped = make_resource('https://cdn.a.com/big.mp4', 'big.mp4', 'media')
+        skipped['skipped'] = SKIP_TOO_LARGE
+        table = build_link_table([
+            failed, skipped, downloaded(make_resource('https://a.com/img/logo.png', 'img/logo.png')),
+            make_resource('https://a.com/img/logo.png', 'img/logo-2.png')])
+
+        rewrite = LinkRewriter(table, 'https://a.com/blog/', 'blog/index.html')
+        self.assertEqual(rewrite('../img/gone.png#x'), 'https://a.com/img/gone.png#x')
+        self.assertEqual(rewrite('//cdn.a.com/big.mp4'), 'https://cdn.a.com/big.mp4')
+        self.assertEqual(rewrite('/img/logo.png'), '../img/logo.png')
+
+    def test_crawled_pages(self):
+        rewrite = LinkRewriter(self.table, 'https://a.com/', 'index.html',
+                               page_paths={'https://a.com/about': 'about.html'})
+        self.assertEqual(rewrite('/about'), 'about.html')
+
+    def test_srcset_and_css(self):
+        rewrite = LinkRewriter(self.table, 'https://a.com/', 'css/site.css')
+        self.assertEqual(rewrite.srcset('/img/logo.png 1x, /img/bg.png 2x'),
+                         '../img/logo.png 1x, ../img/bg.png 2x')
+        self.assertEqual(
+            rewrite.css('a{background:url( "/img/bg.png" )} @import "/css/site.css";'),
+            'a{background:url("../img/bg.png")} @import "site.css";')
+
+    def test_rewrite_document(self):
+        soup = BeautifulSoup(
+            '<html><head><link rel="stylesheet" href="/css/site.css">'
+            '<meta property="og:image" content="/img/logo.png">'
+            '<style>body{background:url(/img/bg.png)}</style></head>'
+            '<body><img src="/img/logo.png" srcset="/img/bg.png 2x">'
+            '<div style="background:url(img/bg.png)"></div>'
+            '<a href="/elsewhere">x</a></body></html>', 'html.parser')
+        rewrite_document(soup, LinkRewriter(self.table, 'https://a.com/', 'index.html'))
+
+        self.assertEqual(soup.link['href'], 'css/site.css')
+        self.assertEqual(soup.meta['content'], 'img/logo.png')
+        self.assertEqual(soup.style.string, 'body{background:url(img/bg.png)}')
+        self.assertEqual(soup.img['src'], 'img/logo.png')
+        self.assertEqual(soup.img['srcset'], 'img/bg.png 2x')
+        self.assertEqual(soup.div['style'], 'background:url(img/bg.png)')
+        self.assertEqual(soup.a['href'], '/elsewhere')
+
+
+class FrontierTests(SimpleTestCase):
+    def test_dedupes_normalized_urls(self):
+        frontier = Frontier('https://a.com/', max_depth=2, max_pages=10)
+        self.assertTrue(frontier.add('https://a.com/about', 1))
+        self.assertFalse(frontier.add('https://A.com/about#team', 1))
+        self.assertFalse(frontier.add('https://a.com/', 1))
+        self.assertEqual(frontier.pop(), ('https://a.com/', 0))
+        self.assertEqual(frontier.pop(), ('https://a.com/about', 1))
+        self.assertFalse(frontier)
+
+    def test_limits_and_scope(self):
+        frontier = Frontier('https://a.com/docs/intro', max_depth=1, max_pages=3, scope='prefix')
+        self.assertFalse(frontier.add('https://a.com/docs/deep', 2))
+        self.assertFalse(frontier.add('https://a.com/blog/post', 1))
+        self.assertFalse(frontier.add('https://b.com/docs/page', 1))
+        self.assertFalse(frontier.add('https://a.com/docs/logo.png', 1))
+        self.assertTrue(frontier.add('https://a.com/docs/one', 1))
+        self.assertTrue(frontier.add('https://a.com/docs/two', 1))
+        self.assertFalse(frontier.add('https://a.com/docs/three', 1))
+
+
+class PageLocalPathTests(SimpleTestCase):
+    def test_paths(self):
+        seed = 'https://a.com/'
+        self.assertEqual(page_local_path(seed, seed), 'index.html')
+        self.assertEqual(page_local_path('https://a.com/docs/', seed), 'docs/index.html')
+        self.assertEqual(page_local_path('https://a.com/about', seed), 'about.html')
+        self.assertRegex(page_local_path('https://a.com/list?page=2', seed),
+                         r'^list-[0-9a-f]{8}\.html$')
+
+    def test_collisions_get_distinct_paths(self):
+        seed = 'https://a.com/'
+        taken = set()
+        urls = [seed, 'https://a.com/index.html', 'https://a.com/about',
+                'https://a.com/about.html']
+        paths = [page_local_path(url, seed, taken) for url in urls]
+        self.assertEqual(len(set(paths)), len(urls))
+        self.assertEqual(paths[0], 'index.html')
+        self.assertEqual(paths[2], 'about.html')
+        self.assertEqual(taken, set(paths))
+
+
+class BodySpoolerTests(SimpleTestCase):
+    def test_advertised_size_over_budgets(self):
+        spooler = BodySpooler(max_resource_bytes=10, max_job_bytes=15)
+        resource = make_resource('https://a.com/x.png', 'x.png')
+        self.assertFalse(spooler.admit(resource, '11'))
+        self.assertEqual((resource['skipped'], resource['advertised_size']), (SKIP_TOO_LARGE, 11))
+        self.assertTrue(spooler.admit(make_resource('https://a.com/y.png', 'y.png'), None))
+
+    def test_job_budget_is_shared(self):
+        spooler = BodySpooler(max_resource_bytes=10, max_job_bytes=15)
+        first = make_resource('https://a.com/a.png', 'a.png')
+        second = make_resource('https://a.com/b.png', 'b.png')
+        self.assertEqual(read_body(spooler.spool(first, None, [b'12345', b'67890'])),
+                         b'1234567890')
+        self.assertIsNone(spooler.spool(second, None, [b'12345', b'6']))
+        self.assertEqual(second['skipped'], SKIP_JOB_BUDGET)
+        # The skipped body's bytes were given back
+        self.assertEqual(spooler.used, 10)
+
+    def test_body_over_resource_budget_without_content_length(self):
+        spooler = BodySpooler(max_resource_bytes=4, max_job_bytes=100)
+        resource = make_resource('https://a.com/x.png', 'x.png')
+        self.assertIsNone(spooler.spool(resource, None, [b'123', b'45']))
+        self.assertEqual(resource['skipped'], SKIP_TOO_LARGE)
+        self.assertEqual(spooler.used, 0)
+
+    def test_admit_body_and_release(self):
+        spooler = BodySpooler(max_resource_bytes=10, max_job_bytes=10)
+        self.assertTrue(spooler.admit_body(make_resource('https://a.com/a', 'a'), 8))
+        self.assertFalse(spooler.admit_body(make_resource('https://a.com/b', 'b'), 8))
+        spooler.release(8)
+        self.assertTrue(spooler.admit_body(make_resource('https://a.com/b', 'b'), 8))
+
+
+class SessionPoolTests(SimpleTestCase):
+    def test_sessions_keep_no_cookies(self):
+        server = CookieFixtureServer({'/': ('text/plain', b'')}).start()
+        self.addCleanup(server.stop)
+        pool = SessionPool(size=1)
+        self.addCleanup(pool.close)
+
+        first = pool.get(server.base_url + '/', timeout=5)
+        self.assertEqual(first.cookies['session'], 'secret')
+        # The same (only) session, on behalf of the next clone
+        self.assertEqual(pool.get(server.base_url + '/', timeout=5).content, b'')
+
+
+class HttpCacheTests(TempDirMixin, SimpleTestCase):
+    url = 'https://a.com/site.css'
+
+    def test_fresh_for_max_age(self):
+        cache = HttpCache(self.tmp, 1024)
+        cache.store(self.url, b'body{}', {'Cache-Control': 'max-age=60',
+                                          'Content-Type': 'text/css'})
+        entry, fresh = cache.lookup(self.url)
+        self.assertTrue(fresh)
+        with cache.open(entry) as body:
+            self.assertEqual(body.read(), b'body{}')
+
+    def test_uncacheable_responses(self):
+        cache = HttpCache(self.tmp, 1024)
+        cache.store(self.url, b'a', {'Cache-Control': 'no-store', 'ETag': '"1"'})
+        cache.store('https://a.com/b', b'b', {'Vary': 'Cookie', 'ETag': '"1"'})
+        cache.store('https://a.com/c', b'c', {})
+        for url in (self.url, 'https://a.com/b', 'https://a.com/c'):
+            self.assertEqual(cache.lookup(url), (None, False))
+
+    def test_stale_entry_is_revalidated(self):
+        cache = HttpCache(self.tmp, 1024)
+        cache.store(self.url, b'body{}', {'Cache-Control': 'no-cache', 'ETag': '"v1"',
+                                          'Content-Type': 'text/css'})
+        entry, fresh = cache.lookup(self.url)
+        self.assertFalse(fresh)
+        self.assertEqual(cache.conditional_headers(entry), {'If-None-Match': '"v1"'})
+
+        # A 304 makes it fresh again and the cached body is used
+        cache.refresh(entry, {'Cache-Control': 'max-age=60'})
+        resource = make_resource(self.url, 'site.css', 'css')
+        self.assertTrue(store_cached(resource, cache, entry, collect_body, BodySpooler()))
+        self.assertEqual((resource['body'], resource['content_type']), (b'body{}', 'text/css'))
+        self.assertTrue(cache.lookup(self.url)[1])
+
+    def test_evicts_least_recently_used(self):
+        cache = HttpCache(self.tmp, 10)
+        headers = {'Cache-Control': 'max-age=60'}
+        cache.store('https://a.com/1', b'12345', headers)
+        cache.store('https://a.com/2', b'12345', headers)
+        cache.open(cache.lookup('https://a.com/1')[0]).close()
+        cache.store('https://a.com/3', b'12345', headers)
+        self.assertIsNotNone(cache.lookup('https://a.com/1')[0])
+        self.assertIsNone(cache.lookup('https://a.com/2')[0])
+        self.assertLessEqual(cache.total_bytes, 10)
+
+
+class BlobStoreTests(TempDirMixin, SimpleTestCase):
+    def test_prunes_least_recently_used(self):
+        store = BlobStore(self.tmp, max_bytes=25)
+        first = store.put(b'a' * 10)
+        second = store.put(b'b' * 10)
+        store.open(first).close()
+        third = store.put(b'c' * 10)
+
+        self.assertEqual([store.exists(d) for d in (first, second, third)], [True, False, True])
+        self.assertEqual(store.total_bytes, 20)
+        self.assertFalse(os.path.exists(store.path(second) + '.json'))
+        # The order outlives the process
+        self.assertEqual(list(BlobStore(self.tmp)._entries), [first, third])
+
+    def test_keeps_pinned_blobs(self):
+        pinned = BlobStore(self.tmp).put(b'saved' * 4)
+        store = BlobStore(self.tmp, max_bytes=35, keep=lambda digests: {pinned} & set(digests))
+        other = store.put(b'b' * 10)
+        newest = store.put(b'c' * 10)
+
+        self.assertEqual([store.exists(d) for d in (pinned, other, newest)],
+                         [True, False, True])
+
+
+class CacheRevalidationTests(TempDirMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.server = FixtureServer(
+            {'/site.css': ('text/css', b'body{color:red}')}, cache_control='no-cache').start()
+        self.addCleanup(self.server.stop)
+
+    def test_second_download_is_a_304(self):
+        cache = HttpCache(os.path.join(self.tmp, 'cache'), 1024 ** 2)
+        url = self.server.base_url + '/site.css'
+        outcomes = []
+        with override_settings(SCRAPER_RANGED_ROOT=os.path.join(self.tmp, 'ranged')), \
+                contextlib.redirect_stdout(io.StringIO()):
+            for _ in range(2):
+                resource = make_resource(url, 'site.css', 'css')
+                self.assertTrue(views.download_single_resource(
+                    resource, views.BROWSER_HEADERS, collect_body, cache))
+                outcomes.append((resource['cache'], resource['body']))
+        self.assertEqual(outcomes, [('miss', b'body{color:red}'),
+                                    ('revalidated', b'body{color:red}')])
+
+
+class MetricsTests(SimpleTestCase):
+    def metrics(self):
+        response = self.client.get('/api/metrics/')
+        self.assertEqual(response['Content-Type'], METRICS_CONTENT_TYPE)
+        return response.content.decode()
+
+    def test_saturation(self):
+        scheduler = HostScheduler()
+        for name in ('a', 'b', 'c'):
+            scheduler.add(make_resource(f'https://a.com/{name}.png', f'{name}.png'))
+        scheduler.ready(free=1)
+
+        with in_flight('threads'), in_flight('async'), in_flight('async'):
+            metrics = self.metrics()
+        self.assertIn('scraper_downloads_in_flight{engine="threads"} 1\n', metrics)
+        self.assertIn('scraper_downloads_in_flight{engine="async"} 2\n', metrics)
+        self.assertIn('scraper_scheduled_resources{state="queued"} 2\n', metrics)
+        self.assertIn('scraper_scheduled_resources{state="delayed"} 0\n', metrics)
+
+        # Once the clone is over
+        del scheduler
+        metrics = self.metrics()
+        self.assertIn('scraper_downloads_in_flight{engine="async"} 0\n', metrics)
+        self.assertIn('scraper_scheduled_resources{state="queued"} 0\n', metrics)
+
+
+class HostLimitTests(SimpleTestCase):
+    def make_limit(self, **kwargs):
+        return HostLimit(**{'initial': 2, 'maximum': 16, 'latency_target': 1.0,
+                            'error_rate': 0.5, **kwargs})
+
+    def test_slow_start_then_additive_increase(self):
+        limit = self.make_limit()
+        level = limit.try_acquire()
+        limit.release(0.1, True, level=level)
+        self.assertEqual(limit.limit, 3.0)
+
+        limit.slow_start = False
+        limit.release(0.1, True, level=limit.try_acquire())
+        self.assertAlmostEqual(limit.limit, 3 + 1 / 3)
+
+    def test_slow_response_halves(self):
+        limit = self.make_limit(initial=8)
+        limit.release(2.0, True, level=limit.try_acquire())
+        self.assertEqual(limit.limit, 4.0)
+        self.assertFalse(limit.slow_start)
+        # A burst from the same window only counts once
+        limit.release(2.0, True, level=limit.try_acquire())
+        self.assertEqual(limit.limit, 4.0)
+
+    def test_rate_limited_caps_under_the_refused_level(self):
+        limit = self.make_limit(initial=8)
+        levels = [limit.try_acquire() for _ in range(6)]
+        limit.release(0.1, False, rate_limited=True, level=levels[-1])
+        self.assertEqual(limit.limit, 5.0)
+        # Fast successes don't grow it past the ceiling until the probe interval
+        for _ in range(5):
+            limit.release(0.1, True, level=1)
+        self.assertEqual(limit.limit, 5.0)
+
+    def test_window_bounds_acquire(self):
+        limit = self.make_limit(initial=2)
+        self.assertEqual([limit.try_acquire() for _ in range(3)], [1, 2, 0])
+        limit.pause(60)
+        limit.release(0.1, True, level=2)
+        self.assertEqual(limit.try_acquire(), 0)
+        self.assertGreater(limit.wait_time(), 0)
+
+
+@override_settings(SCRAPER_RETRY_ATTEMPTS=3, SCRAPER_RETRY_BACKOFF=0.5,
+                   SCRAPER_RETRY_BACKOFF_MAX=60)
+class HostSchedulerTests(SimpleTestCase):
+    def test_backoff_delay(self):
+        for retry in (1, 2, 3):
+            self.assertLessEqual(backoff_delay(retry), 0.5 * 2 ** (retry - 1))
+        # Retry-After wins when it is longer, up to the cap
+        self.assertGreaterEqual(backoff_delay(1, RetryableError('HTTP 429', 429, delay=10)), 10)
+        self.assertEqual(backoff_delay(1, RetryableError('HTTP 429', 429, delay=600)), 60)
+
+    @override_settings(SCRAPER_RETRY_BACKOFF=0.01)
+    def test_retry_waits_out_the_backoff(self):
+        scheduler = HostScheduler(HostLimits())
+        resource = make_resource('https://a.com/x.png', 'x.png')
+        scheduler.add(resource)
+        self.assertEqual(scheduler.ready(), [resource])
+
+        error = RetryableError('HTTP 503', 503, delay=0.05)
+        scheduler.finished(resource, error)
+        self.assertTrue(scheduler.retry(resource, error))
+        self.assertEqual((resource['retries'], resource['throttled']), (1, 1))
+        # Delayed, and the host paused for the Retry-After
+        self.assertEqual(scheduler.ready(), [])
+        self.assertTrue(scheduler)
+        wait = scheduler.wait_time()
+        self.assertTrue(0 < wait <= 0.05)
+
+        time.sleep(wait + 0.01)
+        self.assertEqual(scheduler.ready(), [resource])
+
+    def test_out_of_tries(self):
+        scheduler = HostScheduler(HostLimits())
+        resource = make_resource('https://a.com/x.png', 'x.png')
+        error = RetryableError('connection reset')
+        with override_settings(SCRAPER_RETRY_BACKOFF=0):
+            self.assertTrue(scheduler.retry(resource, error))
+            self.assertTrue(scheduler.retry(resource, error))
+            self.assertFalse(scheduler.retry(resource, error))
+        self.assertEqual(resource['retries'], 2)
+        self.assertNotIn('throttled', resource)
+
+
+class NegotiateEncodingTests(SimpleTestCase):
+    @override_settings(SCRAPER_RESPONSE_ENCODINGS=('gzip',))
+    def test_gzip(self):
+        self.assertEqual(negotiate_encoding('gzip, deflate'), 'gzip')
+        self.assertEqual(negotiate_encoding('*'), 'gzip')
+        self.assertIsNone(negotiate_encoding('gzip;q=0'))
+        self.assertIsNone(negotiate_encoding('deflate'))
+        self.assertIsNone(negotiate_encoding(''))
+        self.assertIsNone(negotiate_encoding(None))
+
+    @override_settings(SCRAPER_RESPONSE_ENCODINGS=('zstd', 'br', 'gzip'))
+    def test_highest_q_then_our_order(self):
+        self.assertEqual(negotiate_encoding('br;q=0.5, gzip;q=0.8'), 'gzip')
+        if 'br' in AVAILABLE_ENCODINGS:
+            self.assertEqual(negotiate_encoding('gzip, br'), 'br')
+        if 'zstd' in AVAILABLE_ENCODINGS:
+            self.assertEqual(negotiate_encoding('gzip, zstd, br'), 'zstd')
+
+
+class MinifyTests(SimpleTestCase):
+    def test_css(self):
+        self.assertEqual(
+            minify_css('/*! MIT */\na :hover { color: red ; ; }\n/* drop */ '
+                       '.b{width:calc(1px + 2%);}\n.c{content:"a  b"}'),
+            '/*! MIT */ a :hover{color:red}.b{width:calc(1px + 2%)}.c{content:"a  b"}')
+
+    def test_html(self):
+        self.assertEqual(
+            minify_html('<div>\n  a   b <!-- x --><!--[if IE]>ie<![endif]-->'
+                        '<pre>  p\n q</pre></div>'),
+            '<div> a b <!--[if IE]>ie<![endif]--><pre>  p\n q</pre></div>')
+
+
+def png_bytes():
+    """A PNG saved without compression, so recompressing it shrinks it"""
+    from PIL import Image
+    out = io.BytesIO()
+    Image.new('RGB', (64, 64), 'red').save(out, 'PNG', compress_level=0)
+    return out.getvalue()
+
+
+class ManifestTests(TempDirMixin, SimpleTestCase):
+    def write(self, manifest, resource, content, content_type='image/png'):
+        size, digest = write_file(
+            output_path(self.tmp, 'site', resource['original_path']), content)
+        resource.update(size=size, hash=digest, content_type=content_type,
+                        is_binary=content_type.startswith('image/'))
+        manifest.add_file('site', resource)
+
+    def test_resume_files_written_by_an_earlier_run(self):
+        manifest = Manifest(self.tmp)
+        self.write(manifest, make_resource('https://a.com/img/x.png', 'img/x.png'), b'png')
+        manifest.add_page('https://a.com/', 'site', files=1)
+        manifest.close()
+
+        manifest = Manifest(self.tmp)
+        self.addCleanup(manifest.close)
+        self.assertTrue(manifest.page_done('https://a.com/'))
+        resource = make_resource('https://a.com/img/x.png', 'img/x.png')
+        self.assertTrue(manifest.resume('site', resource))
+        self.assertEqual((resource['downloaded'], resource['resumed'], resource['size']),
+                         (True, True, 3))
+        # Another URL at the same path isn't this file
+        self.assertFalse(manifest.resume('site', make_resource('https://b.com/img/x.png',
+                                                               'img/x.png')))
+
+    def test_changed_files_and_stylesheets_are_downloaded_again(self):
+        manifest = Manifest(self.tmp)
+        self.addCleanup(manifest.close)
+        self.write(manifest, make_resource('https://a.com/x.png', 'x.png'), b'png')
+        css = make_resource('https://a.com/site.css', 'site.css', 'css')
+        self.write(manifest, css, b'body{}', 'text/css')
+
+        with open(output_path(self.tmp, 'site', 'x.png'), 'wb') as f:
+            f.write(b'pn')
+        self.assertFalse(manifest.resume('site', make_resource('https://a.com/x.png', 'x.png')))
+        self.assertFalse(manifest.resume('site', make_resource('https://a.com/site.css',
+                                                               'site.css', 'css')))
+
+    def test_restart_forgets_the_earlier_run(self):
+        Manifest(self.tmp).add_page('https://a.com/', 'site')
+        manifest = Manifest(self.tmp, restart=True)
+        self.addCleanup(manifest.close)
+        self.assertFalse(manifest.page_done('https://a.com/'))
+
+
+class CheckpointTests(TempDirMixin, SimpleTestCase):
+    url = 'https://a.com/video.mp4'
+    headers = {'content-length': str(4 * MIN_SEGMENT_BYTES), 'etag': '"v1"'}
+
+    def test_start_splits_into_segments(self):
+        with override_settings(SCRAPER_RANGE_SEGMENTS=4):
+            checkpoint = Checkpoint(self.url, self.tmp)
+            checkpoint.start(4 * MIN_SEGMENT_BYTES, self.headers)
+        self.assertEqual(len(checkpoint.segments), 4)
+        self.assertEqual(checkpoint.segments[0], [0, MIN_SEGMENT_BYTES - 1, 0])
+        self.assertEqual(checkpoint.segments[-1][1], 4 * MIN_SEGMENT_BYTES - 1)
+        self.assertEqual(checkpoint.remaining(), 4 * MIN_SEGMENT_BYTES)
+        self.assertEqual(os.path.getsize(checkpoint.part_path), 4 * MIN_SEGMENT_BYTES)
+
+    def test_advance_is_saved_and_loaded(self):
+        with override_settings(SCRAPER_RANGE_SEGMENTS=2):
+            Checkpoint(self.url, self.tmp).start(4 * MIN_SEGMENT_BYTES, self.headers)
+            checkpoint = Checkpoint(self.url, self.tmp)
+            self.assertTrue(checkpoint.load())
+            checkpoint.advance(1, 3 * MIN_SEGMENT_BYTES)
+
+        loaded = Checkpoint(self.url, self.tmp)
+        self.assertTrue(loaded.load())
+        self.assertEqual(loaded.segments[1][2], 3 * MIN_SEGMENT_BYTES)
+        self.assertEqual(loaded.remaining(), 3 * MIN_SEGMENT_BYTES)
+        self.assertEqual(loaded.validator(), '"v1"')
+        self.assertTrue(loaded.matches(self.headers))
+        self.assertFalse(loaded.matches({**self.headers, 'etag': '"v2"'}))
+
+    def test_nothing_to_carry_on_from(self):
+        self.assertFalse(Checkpoint(self.url, self.tmp).load())
+
+        # Without a validator a changed file couldn't be told apart
+        Checkpoint(self.url, self.tmp).start(MIN_SEGMENT_BYTES, {'content-length': '1'})
+        self.assertFalse(Checkpoint(self.url, self.tmp).load())
+
+        # Nor after the max age
+        checkpoint = Checkpoint(self.url, self.tmp)
+        checkpoint.start(MIN_SEGMENT_BYTES, self.headers)
+        old = time.time() - 3600
+        os.utime(checkpoint.path, (old, old))
+        with override_settings(SCRAPER_RANGED_MAX_AGE=60):
+            self.assertFalse(Checkpoint(self.url, self.tmp).load())
+
+    def test_finish_moves_the_part_file_out_of_the_way(self):
+        checkpoint = Checkpoint(self.url, self.tmp)
+        checkpoint.start(MIN_SEGMENT_BYTES, self.headers)
+        done_path = checkpoint.finish()
+        self.assertFalse(os.path.exists(checkpoint.path))
+        self.assertFalse(os.path.exists(checkpoint.part_path))
+        self.assertEqual(os.path.getsize(done_path), MIN_SEGMENT_BYTES)
+
+    def test_one_download_per_checkpoint(self):
+        with override_settings(SCRAPER_RANGED_ROOT=self.tmp):
+            first = claim_checkpoint({'url': self.url})
+            first.start(MIN_SEGMENT_BYTES, self.headers)
+            self.assertFalse(Checkpoint(self.url).lock())
+            self.assertFalse(has_checkpoint({'url': self.url}))
+
+            # A clone of the same URL at the same time gets its own
+            resource = {'url': self.url}
+            second = claim_checkpoint(resource)
+            self.assertNotEqual(second.part_path, first.part_path)
+            second.unlock()
+            # and carries it on in its next tries
+            third = claim_checkpoint(resource)
+            third.unlock()
+            self.assertEqual(third.key, second.key)
+
+            first.unlock()
+            self.assertTrue(has_checkpoint({'url': self.url}))
+
+
+SITE = {
+    '/': ('text/html', b'<html><head><title>Fixture</title>'
+                       b'<link rel="stylesheet" href="/css/site.css"></head>'
+                       b'<body><img src="img/logo.png"><script src="/js/app.js"></script>'
+                       b'</body></html>'),
+    '/css/site.css': ('text/css', b'body{background:url(../img/bg.png)}'),
+    '/img/logo.png': ('image/png', b'\x89PNG logo'),
+    '/img/bg.png': ('image/png', b'\x89PNG bg'),
+    '/js/app.js': ('application/javascript', b'var a=1;'),
+}
+
+
+class BlobApiTests(TempDirMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.store = BlobStore(self.tmp, max_bytes=25, keep=blobs.saved_digests)
+        patcher = mock.patch.object(blobs, '_blob_store', self.store)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_serves_blobs_with_an_etag(self):
+        digest = self.store.put(b'\x89PNG body', 'image/png')
+        response = self.client.get(f'/api/blob/{digest}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertEqual(response['ETag'], f'"{digest}"')
+        self.assertEqual(b''.join(response.streaming_content), b'\x89PNG body')
+
+        response = self.client.get(f'/api/blob/{digest}/', HTTP_IF_NONE_MATCH=f'"{digest}"')
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+        self.assertEqual(self.client.get(f'/api/blob/{"0" * 64}/').status_code, 404)
+        self.assertEqual(self.client.get('/api/blob/nothex/').status_code, 404)
+
+    def test_snapshot_bodies_are_never_pruned(self):
+        saved = self.store.put(b'a' * 10)
+        Blob.objects.create(digest=saved, size=10)
+        dropped = self.store.put(b'b' * 10)
+        self.store.put(b'c' * 10)
+
+        self.assertTrue(self.store.exists(saved))
+        self.assertFalse(self.store.exists(dropped))
+
+
+class RangeBody(bytes):
+    pass
+
+
+class RangeLogFixtureServer(RangeFixtureServer):
+    """
+    Keeps the Range header of every request, and drops only range
+    responses (not a plain GET the client closes unread)
+    """
+
+    async def respond(self, method, path, headers):
+        self.ranges.append(headers.get('range'))
+        status, response_headers, body = await super().respond(method, path, headers)
+        return status, response_headers, RangeBody(body) if status == 206 else body
+
+    async def write_body(self, writer, body):
+        if isinstance(body, RangeBody):
+            await super().write_body(writer, body)
+        else:
+            writer.write(body)
+            await writer.drain()
+
+
+class RangedResumeTests(TempDirMixin, TestCase):
+    def test_dropped_download_carries_on(self):
+        video = bytes(range(256)) * (3 * MIN_SEGMENT_BYTES // 256)
+        server = RangeLogFixtureServer({
+            '/': ('text/html', b'<html><body><video src="/media/clip.mp4"></video></body></html>'),
+            '/media/clip.mp4': ('video/mp4', video),
+        }, drop_after=MIN_SEGMENT_BYTES + 5, drops=1)
+        server.ranges = []
+        server.start()
+        self.addCleanup(server.stop)
+
+        with override_settings(SCRAPER_HTTP_CACHE=False, SCRAPER_BINARY_MODE='blob',
+                               SCRAPER_RANGED_MIN_BYTES=MIN_SEGMENT_BYTES,
+                               SCRAPER_RANGE_SEGMENTS=1, SCRAPER_RETRY_BACKOFF=0.01,
+                               SCRAPER_RANGED_ROOT=os.path.join(self.tmp, 'ranged')), \
+                mock.patch.object(blobs, '_blob_store', BlobStore(self.tmp)), \
+                contextlib.redirect_stdout(io.StringIO()):
+            response = self.client.post('/api/scrape/', {'url': server.base_url + '/'},
+                                        content_type='application/json')
+            resource = response.json()['resources'][0]
+            with blobs.get_blob_store().open(resource['hash']) as body:
+                self.assertEqual(body.read(), video)
+
+        self.assertEqual((resource['downloaded'], resource['ranged']), (True, True))
+        # Dropped part way through the first range, only the rest is asked for again
+        first, resumed = [r for r in server.ranges if r]
+        self.assertEqual(first, f'bytes=0-{len(video) - 1}')
+        start = int(resumed.split('=')[1].split('-')[0])
+        self.assertTrue(0 < start <= MIN_SEGMENT_BYTES + 5, resumed)
+        self.assertEqual(os.listdir(os.path.join(self.tmp, 'ranged')),
+                         [os.path.basename(Checkpoint(resource['url'], self.tmp).lock_path)])
+
+
+@skipUnless(HTTP2_AVAILABLE, 'needs httpx and h2')
+class Http2EngineTests(SimpleTestCase):
+    def test_downloads_share_one_connection(self):
+        server = H2FixtureServer(dict(SITE)).start()
+        self.addCleanup(server.stop)
+        base = server.base_url
+        resources = [make_resource(base + '/css/site.css', 'css/site.css', 'css'),
+                     make_resource(base + '/js/app.js', 'js/app.js', 'javascript'),
+                     make_resource(base + '/img/logo.png', 'img/logo.png')]
+
+        # h2c can't be negotiated, the client has to know the origin speaks it
+        with override_settings(SCRAPER_HTTP2_CLEARTEXT_HOSTS=(base.split('//')[1],)), \
+                contextlib.redirect_stdout(io.StringIO()):
+            views.download_all_resources(resources, {}, {'engine': 'http2', 'cache': False})
+
+        # The background image was found in the stylesheet and fetched on the same connection
+        self.assertEqual([r['original_path'] for r in resources],
+                         ['css/site.css', 'js/app.js', 'img/logo.png', 'img/bg.png'])
+        self.assertTrue(all(r['downloaded'] for r in resources))
+        self.assertEqual(resources[1]['content'], 'var a=1;')
+        self.assertEqual((server.connections, server.requests), (1, 4))
+
+
+@override_settings(SCRAPER_HTTP_CACHE=False)
+class JobApiTests(TestCase):
+    def setUp(self):
+        self.server = FixtureServer(dict(SITE)).start()
+        self.addCleanup(self.server.stop)
+        patcher = mock.patch.object(jobs, '_job_queue', JobQueue(max_jobs=1, max_queued=1))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def start(self, path):
+        with contextlib.redirect_stdout(io.StringIO()):
+            response = self.client.post(
+                '/api/scrape/', {'url': self.server.base_url + path, 'background': True},
+                content_type='application/json')
+        self.assertEqual(response.status_code, 202)
+        return response.json()
+
+    def wait(self, job):
+        with contextlib.redirect_stdout(io.StringIO()):
+            for _ in range(200):
+                status = self.client.get(job['status_url']).json()
+                if status['status'] in (JOB_DONE, JOB_FAILED):
+                    return status
+                time.sleep(0.02)
+        self.fail(f'Job still {status["status"]}')
+
+    def test_job_result(self):
+        job = self.start('/')
+        status = self.wait(job)
+        self.assertEqual(status['status'], JOB_DONE)
+        self.assertEqual(status['progress']['current'], status['progress']['total'])
+
+        result = self.client.get(job['result_url'])
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(result.json()['title'], 'Fixture')
+        self.assertEqual(result.json()['stats']['total_files'], 4)
+
+    def test_failed_job_result(self):
+        job = self.start('/gone')
+        self.assertEqual(self.wait(job)['status'], JOB_FAILED)
+
+        result = self.client.get(job['result_url'])
+        self.assertEqual(result.status_code, 400)
+        self.assertTrue(result.json()['error'].startswith('Failed to fetch website'))
+
+    def test_unfinished_and_unknown_jobs(self):
+        release = threading.Event()
+        job = jobs.get_job_queue().submit(lambda progress: release.wait(5))
+        self.addCleanup(release.set)
+
+        response = self.client.get(f'/api/jobs/{job.id}/result/')
+        self.assertEqual(response.status_code, 409)
+        self.assertIn(response.json()['status'], (JOB_QUEUED, JOB_RUNNING))
+        # One running, one waiting: the queue is full
+        jobs.get_job_queue().submit(lambda progress: None)
+        with contextlib.redirect_stdout(io.StringIO()):
+            response = self.client.post(
+                '/api/scrape/', {'url': self.server.base_url + '/', 'background': True},
+                content_type='application/json')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(self.client.get('/api/jobs/nope/').status_code, 404)
+
+
+class BatchApiTests(TestCase):
+    def test_batch(self):
+        server = FixtureServer(dict(SITE)).start()
+        self.addCleanup(server.stop)
+        before = PHASE_SECONDS.render()
+
+        with override_settings(SCRAPER_HTTP_CACHE=False), \
+                contextlib.redirect_stdout(io.StringIO()):
+            response = self.client.post(
+                '/api/batch/', {'urls': [server.base_url + '/', server.base_url + '/gone']},
+                content_type='application/json')
+            records = [json.loads(line)
+                       for line in b''.join(response.streaming_content).splitlines()]
+
+        by_type = {record['type']: record for record in records}
+        self.assertEqual(len(records), 3)
+        self.assertEqual((by_type['done']['total'], by_type['done']['failed']), (2, 1))
+        self.assertEqual(by_type['error']['index'], 1)
+        result = by_type['result']['result']
+        self.assertEqual(result['title'], 'Fixture')
+        self.assertIn('href="css/site.css"', result['html'])
+        self.assertEqual(result['stats']['total_files'], 4)
+
+        # Timed in the worker processes, recorded here
+        after = PHASE_SECONDS.render()
+        for phase in ('discover_css', 'rewrite'):
+            count = f'scraper_phase_seconds_count{{phase="{phase}"}}'
+            self.assertGreater(phase_count(after, count), phase_count(before, count))
+
+
+def phase_count(lines, name):
+    return next((int(line.split()[-1]) for line in lines if line.startswith(name + ' ')), 0)
+
+
+class ReadScrapeOptionsTests(SimpleTestCase):
+    def read(self, **data):
+        options, error = views.read_scrape_options({'url': 'https://a.com/', **data})
+        self.assertIsNone(error)
+        return options
+
+    def test_flags_sent_as_strings(self):
+        for name in ('stream', 'crawl', 'background', 'cache', 'save', 'optimize'):
+            for value in (False, 0, '0', 'false', 'False', 'off', ''):
+                with self.subTest(name=name, value=value):
+                    self.assertIs(self.read(**{name: value})[name], False)
+        for name in ('stream', 'crawl', 'background'):
+            for value in (True, 1, '1', 'true', 'on'):
+                with self.subTest(name=name, value=value):
+                    self.assertIs(self.read(**{name: value})[name], True)
+
+    def test_defaults(self):
+        options = self.read()
+        self.assertEqual((options['stream'], options['crawl'], options['background'],
+                          options['cache']), (False, False, False, True))
+
+
+class ScrapeApiTests(TempDirMixin, TestCase):
+    """/api/scrape/ end to end, against a fixture site served locally"""
+
+    def setUp(self):
+        super().setUp()
+        self.server = FixtureServer(dict(SITE)).start()
+        self.addCleanup(self.server.stop)
+
+    def scrape(self, headers=None, **data):
+        with override_settings(SCRAPER_HTTP_CACHE=False,
+                               SCRAPER_RANGED_ROOT=os.path.join(self.tmp, 'ranged')), \
+                contextlib.redirect_stdout(io.StringIO()):
+            response = self.client.post(
+                '/api/scrape/', {'url': self.server.base_url + '/', **data},
+                content_type='application/json', headers=headers)
+            if response.streaming:
+                # The clone runs as the body is read, so read it under the settings
+                response.body = b''.join(response.streaming_content)
+            return response
+
+    def test_clone_page(self):
+        for engine in ('threads', 'async'):
+            with self.subTest(engine=engine):
+                response = self.scrape(engine=engine)
+                self.assertEqual(response.status_code, 200)
+                data = response.json()
+
+                resources = {r['original_path']: r for r in data['resources']}
+                self.assertEqual(set(resources),
+                                 {'css/site.css', 'js/app.js', 'img/logo.png', 'img/bg.png'})
+                self.assertTrue(all(r['downloaded'] for r in resources.values()))
+                self.assertEqual(resources['js/app.js']['content'], 'var a=1;')
+                # Found in the stylesheet once it was downloaded, and rewritten there
+                self.assertEqual(resources['img/bg.png']['type'], 'css-embedded')
+                self.assertEqual(resources['css/site.css']['content'],
+                                 'body{background:url(../img/bg.png)}')
+
+                self.assertEqual(data['title'], 'Fixture')
+                self.assertIn('href="css/site.css"', data['html'])
+                self.assertIn('src="js/app.js"', data['html'])
+                self.assertEqual(data['stats']['total_files'], 4)
+                self.assertEqual(data['stats']['images'], 2)
+
+    def test_stream(self):
+        response = self.scrape(stream='true')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        records = [json.loads(line) for line in response.body.splitlines()]
+
+        self.assertEqual([r['type'] for r in records], ['resource'] * 4 + ['page'])
+        self.assertEqual({r['resource']['original_path'] for r in records[:-1]},
+                         {'css/site.css', 'js/app.js', 'img/logo.png', 'img/bg.png'})
+        page = records[-1]
+        self.assertEqual(page['title'], 'Fixture')
+        self.assertIn('href="css/site.css"', page['html'])
+        self.assertEqual(page['stats']['total_files'], 4)
+
+    def test_zip_export_from_a_form(self):
+        # Posted as a form, like the frontend's download, flags as strings
+        with override_settings(SCRAPER_HTTP_CACHE=False), \
+                contextlib.redirect_stdout(io.StringIO()):
+            response = self.client.post('/api/export/zip/', {
+                'url': self.server.base_url + '/', 'optimize': 'false', 'crawl': 'false'})
+            body = b''.join(response.streaming_content)
+
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        self.assertIn('attachment; filename="127.0.0.1_', response['Content-Disposition'])
+        with zipfile.ZipFile(io.BytesIO(body)) as archive:
+            self.assertEqual(
+                set(archive.namelist()),
+                {'index.html', 'css/site.css', 'js/app.js', 'img/logo.png', 'img/bg.png'})
+            self.assertEqual(archive.read('img/logo.png'), b'\x89PNG logo')
+            self.assertIn(b'src="js/app.js"', archive.read('index.html'))
+
+    def test_clone_metrics(self):
+        self.scrape()
+        metrics = self.client.get('/api/metrics/').content.decode()
+        self.assertRegex(metrics, r'scraper_clones_total\{mode="page",outcome="done"\} [1-9]')
+        self.assertRegex(metrics, r'scraper_resources_total\{category="css",outcome="downloaded"\} [1-9]')
+        self.assertRegex(metrics, r'scraper_phase_seconds_count\{phase="download"\} [1-9]')
+        self.assertIn('scraper_downloads_in_flight{engine="threads"} 0\n', metrics)
+
+    def test_crawl(self):
+        self.server.files.update({
+            '/': ('text/html', SITE['/'][1].replace(
+                b'</body>', b'<a href="/about">a</a><a href="/big">b</a>'
+                            b'<a href="/report">r</a></body>')),
+            '/about': ('text/html', b'<html><title>About</title><img src="/img/logo.png"></html>'),
+            '/big': ('text/html', b'<html>' + b'x' * 2000 + b'</html>'),
+            '/report': ('application/pdf', b'%PDF'),
+        })
+        with override_settings(SCRAPER_CRAWL_MAX_PAGE_BYTES=1000):
+            data = self.scrape(crawl='true', depth=1).json()
+
+        self.assertEqual([page['path'] for page in data['pages']], ['index.html', 'about.html'])
+        self.assertIn('src="img/logo.png"', data['pages'][1]['html'])
+        self.assertIn('href="about.html"', data['html'])
+        # Over the page byte budget; the PDF is not a page at all
+        self.assertEqual([page['url'] for page in data['failed_pages']],
+                         [self.server.base_url + '/big'])
+        self.assertIn('over 1000 bytes', data['failed_pages'][0]['error'])
+
+    def test_failed_resources_load_from_the_origin(self):
+        page = SITE['/'][1].replace(b'</body>', b'<img src="img/gone.png"></body>')
+        self.server.files['/'] = ('text/html', page)
+        data = self.scrape().json()
+
+        gone = next(r for r in data['resources'] if r['original_path'] == 'img/gone.png')
+        self.assertFalse(gone['downloaded'])
+        self.assertIn(f'src="{self.server.base_url}/img/gone.png"', data['html'])
+        self.assertIn('src="img/logo.png"', data['html'])
+
+    def test_save_snapshot(self):
+        with mock.patch.object(blobs, '_blob_store', BlobStore(os.path.join(self.tmp, 'blobs'))):
+            data = self.scrape(save='true').json()
+            blob_count = Blob.objects.count()
+            second = self.scrape(save='true').json()
+            # Same bodies, no new blobs
+            self.assertEqual(Blob.objects.count(), blob_count)
+
+            listed = self.client.get('/api/snapshots/', {'url': data['url']}).json()
+            self.assertEqual([s['id'] for s in listed['snapshots']],
+                             [second['snapshot_id'], data['snapshot_id']])
+            self.assertEqual(listed['snapshots'][1]['title'], 'Fixture')
+
+            saved = self.client.get(f'/api/snapshots/{data["snapshot_id"]}/').json()
+            self.assertEqual(saved['html'], data['html'])
+            self.assertEqual({r['url']: r['content'] for r in saved['resources']},
+                             {r['url']: r['content'] for r in data['resources']})
+
+            saved = self.client.get(f'/api/snapshots/{data["snapshot_id"]}/',
+                                    {'binary_mode': 'blob'}).json()
+            logo = next(r for r in saved['resources'] if r['original_path'] == 'img/logo.png')
+            self.assertEqual(logo['content'], '')
+            body = self.client.get(f'/api/blob/{logo["hash"]}/').streaming_content
+            self.assertEqual(b''.join(body), b'\x89PNG logo')
+
+        self.assertEqual(self.client.get('/api/snapshots/999/').status_code, 404)
+
+    def test_previous(self):
+        first = self.scrape().json()
+        self.server.files['/js/app.js'] = ('application/javascript', b'var a=2;')
+        data = self.scrape(previous=first).json()
+
+        js = self.server.base_url + '/js/app.js'
+        self.assertEqual(data['delta'], {
+            'added': [], 'changed': [js], 'removed': [], 'unchanged': 3,
+            'html_changed': False, 'changed_pages': []})
+        self.assertEqual(data['stats']['unchanged'], 3)
+        # Bodies the server reported unchanged come from the previous clone
+        logo = next(r for r in data['resources'] if r['original_path'] == 'img/logo.png')
+        self.assertEqual(logo['content'], next(
+            r['content'] for r in first['resources'] if r['original_path'] == 'img/logo.png'))
+
+        self.server.files['/'] = ('text/html', SITE['/'][1].replace(
+            b'<img src="img/logo.png">', b''))
+        delta = self.scrape(previous=data).json()['delta']
+        self.assertEqual(delta['removed'], [self.server.base_url + '/img/logo.png'])
+        self.assertEqual(delta['changed_pages'], ['index.html'])
+
+        response = self.scrape(previous=12345)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['error'], 'Snapshot 12345 not found')
+
+    @skipUnless(can_optimize('js') and can_optimize('image'), 'needs rjsmin and Pillow')
+    def test_optimize(self):
+        png = png_bytes()
+        self.server.files.update({
+            '/': ('text/html', SITE['/'][1].replace(b'<body>', b'<body>\n  <!-- nav -->\n  ')),
+            '/css/site.css': ('text/css', b'body {\n  background: url(../img/bg.png);\n}\n'),
+            '/js/app.js': ('application/javascript', b'var a = 1;  // one\n'),
+            '/img/logo.png': ('image/png', png),
+        })
+        data = self.scrape(optimize='true').json()
+
+        resources = {r['original_path']: r for r in data['resources']}
+        self.assertEqual(resources['css/site.css']['content'], 'body{background:url(../img/bg.png)}')
+        self.assertEqual(resources['js/app.js']['content'], 'var a=1;')
+        self.assertLess(resources['img/logo.png']['size'], len(png))
+        # Not an image Pillow can read: kept as downloaded
+        self.assertEqual(resources['img/bg.png']['size'], len(SITE['/img/bg.png'][1]))
+        self.assertNotIn('nav', data['html'])
+
+        optimization = data['stats']['optimization']
+        self.assertEqual(optimization['image']['files'], 2)
+        self.assertEqual(optimization['image']['saved'],
+                         len(png) - resources['img/logo.png']['size'])
+        self.assertGreater(optimization['html']['saved'], 0)
+
+    @override_settings(SCRAPER_COMPRESS_MIN_BYTES=0)
+    def test_compressed(self):
+        plain = self.scrape().json()
+        for coding in AVAILABLE_ENCODINGS:
+            with self.subTest(coding=coding):
+                response = self.scrape(headers={'Accept-Encoding': f'identity, {coding}'})
+                self.assertEqual(response['Content-Encoding'], coding)
+                self.assertIn('Accept-Encoding', response['Vary'])
+                data = json.loads(decompress_body(response.content, coding))
+                self.assertEqual(data['html'], plain['html'])
+
+        # Streamed records are compressed as they go
+        response = self.scrape(headers={'Accept-Encoding': 'gzip'}, stream='true')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        lines = decompress_body(response.body, 'gzip').splitlines()
+        self.assertEqual(json.loads(lines[-1])['title'], 'Fixture')
+
+        self.assertNotIn('Content-Encoding', self.scrape(headers={'Accept-Encoding': 'identity'}))
+
+    @skipUnless(renderers.msgpack, 'needs msgpack')
+    def test_msgpack(self):
+        response = self.scrape(headers={'Accept': renderers.MSGPACK_CONTENT_TYPE})
+        self.assertEqual(response['Content-Type'], renderers.MSGPACK_CONTENT_TYPE)
+        data = renderers.msgpack.unpackb(response.content)
+        resources = {r['original_path']: r for r in data['resources']}
+        # Binary bodies as bytes, text as text
+        self.assertEqual(resources['img/logo.png']['content'], b'\x89PNG logo')
+        self.assertEqual(resources['js/app.js']['content'], 'var a=1;')
+        self.assertEqual(data['title'], 'Fixture')
+
+        response = self.scrape(headers={'Accept': renderers.MSGPACK_CONTENT_TYPE}, stream='true')
+        records = list(renderers.msgpack.Unpacker(io.BytesIO(response.body)))
+        self.assertEqual([r['type'] for r in records], ['resource'] * 4 + ['page'])
+        self.assertIn(b'\x89PNG logo', [r['resource']['content'] for r in records[:-1]])
+
+    @override_settings(SCRAPER_RETRY_ATTEMPTS=10, SCRAPER_RETRY_BACKOFF=0.01)
+    def test_retries(self):
+        # Every third request fails with a 503
+        self.server = RateLimitedFixtureServer(dict(SITE), error_every=3).start()
+        self.addCleanup(self.server.stop)
+        for engine in ('threads', 'async'):
+            with self.subTest(engine=engine):
+                data = self.scrape(engine=engine).json()
+                self.assertTrue(all(r['downloaded'] for r in data['resources']))
+                hosts = data['stats']['hosts'][self.server.base_url.split('//')[1]]
+                self.assertGreater(hosts['retries'], 0)
+                self.assertEqual(hosts['retries'], hosts['throttled'])
+                self.assertEqual(hosts['failed'], 0)
+
+    def test_missing_url(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            response = self.client.post('/api/scrape/', {}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('error', response.json())
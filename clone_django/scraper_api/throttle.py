@@ -0,0 +1,383 @@
+"""
+Per-host download scheduling: an AIMD concurrency window per origin,
+Retry-After pauses, and retries of failed GETs with jittered exponential
+backoff.
+
+Each host's window doubles every round trip at first (slow start, as in
+TCP) and then grows by about one download per round trip while
+responses are fast and clean. It halves when responses get slower than
+SCRAPER_HOST_LATENCY_TARGET or the recent error rate goes over
+SCRAPER_HOST_ERROR_RATE. A 429 (or a Retry-After) caps it just under
+the concurrency the server refused, for SCRAPER_HOST_PROBE_INTERVAL
+seconds, rather than running into the limit (and its Retry-After) over
+and over. Windows are process-wide, so clones downloading from the same
+origin share its limit.
+"""
+import email.utils
+import heapq
+import itertools
+import random
+import threading
+import time
+import weakref
+from collections import OrderedDict, deque
+from urllib.parse import urlsplit
+
+from django.conf import settings
+
+from .metrics import FAILED_TRIES
+
+# Statuses worth another try; 429 and 503 also mean the host is throttling us
+RETRY_STATUSES = frozenset((408, 425, 429, 500, 502, 503, 504))
+THROTTLE_STATUSES = frozenset((429, 503))
+
+# Seconds between checks of a queue blocked on windows other clones hold
+POLL_INTERVAL = 0.05
+
+# Weight of the latest try in a host's moving error rate (about the last 10)
+ERROR_RATE_WEIGHT = 0.1
+
+
+def get_retry_attempts():
+    """Tries per resource, the first one included"""
+    return getattr(settings, 'SCRAPER_RETRY_ATTEMPTS', 4)
+
+
+def get_retry_backoff():
+    """Base delay in seconds, doubled on every retry (with full jitter)"""
+    return getattr(settings, 'SCRAPER_RETRY_BACKOFF', 0.5)
+
+
+def get_retry_backoff_max():
+    """Longest delay between two tries, Retry-After included"""
+    return getattr(settings, 'SCRAPER_RETRY_BACKOFF_MAX', 60)
+
+
+def get_host_concurrency():
+    """Downloads in flight against a host it hasn't seen before"""
+    return getattr(settings, 'SCRAPER_HOST_CONCURRENCY', 6)
+
+
+def get_host_max_concurrency():
+    """Ceiling of a host's concurrency window"""
+    return getattr(settings, 'SCRAPER_HOST_MAX_CONCURRENCY', 32)
+
+
+def get_host_latency_target():
+    """Seconds; slower responses shrink the host's window"""
+    return getattr(settings, 'SCRAPER_HOST_LATENCY_TARGET', 5.0)
+
+
+def get_host_error_rate():
+    """Share of recent tries failing above which a host's window halves"""
+    return getattr(settings, 'SCRAPER_HOST_ERROR_RATE', 0.15)
+
+
+def get_host_probe_interval():
+    """
+    Seconds a host's window stays under the size that got rate limited
+    before it probes past it again
+    """
+    return getattr(settings, 'SCRAPER_HOST_PROBE_INTERVAL', 30)
+
+
+class RetryableError(Exception):
+    """
+    A failed try that may succeed later: a retryable status or a
+    connection error. delay is the server's Retry-After, when it sent one.
+    """
+
+    def __init__(self, message, status=None, delay=None):
+        super().__init__(message)
+        self.status = status
+        self.delay = delay
+
+    @property
+    def throttled(self):
+        return self.status in THROTTLE_STATUSES
+
+    @property
+    def rate_limited(self):
+        """The server said outright that we are over its limit"""
+        return self.status == 429 or (self.throttled and self.delay is not None)
+
+    @property
+    def reason(self):
+        if self.throttled:
+            return 'throttled'
+        return 'status' if self.status else 'connection'
+
+
+def parse_retry_after(value, now=None):
+    """Seconds to wait from a Retry-After header (delta or HTTP date), or None"""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when is None:
+        return None
+    return max(0.0, when.timestamp() - (now or time.time()))
+
+
+def check_status(status, headers):
+    """Raise RetryableError for a response worth retrying"""
+    if status in RETRY_STATUSES:
+        raise RetryableError(
+            f'HTTP {status}', status=status,
+            delay=parse_retry_after(headers.get('retry-after')))
+
+
+def backoff_delay(retry, error=None):
+    """
+    Seconds before retry number retry (1 for the first): full-jitter
+    exponential backoff, or the server's Retry-After when it is longer
+    """
+    cap = get_retry_backoff_max()
+    delay = random.uniform(0, min(cap, get_retry_backoff() * 2 ** (retry - 1)))
+    if error is not None and error.delay is not None:
+        delay = max(delay, min(cap, error.delay))
+    return delay
+
+
+def host_of(url):
+    return urlsplit(url).netloc.lower()
+
+
+class HostLimit:
+    """AIMD concurrency window and Retry-After pause of one host"""
+
+    def __init__(self, initial=None, maximum=None, latency_target=None, error_rate=None):
+        self.maximum = maximum or get_host_max_concurrency()
+        self.limit = float(min(initial or get_host_concurrency(), self.maximum))
+        self.latency_target = latency_target or get_host_latency_target()
+        self.max_error_rate = error_rate or get_host_error_rate()
+        self.in_flight = 0
+        self.error_rate = 0.0
+        self.paused_until = 0.0
+        self.ceiling = self.maximum
+        self.ceiling_until = 0.0
+        self.slow_start = True
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+
+    def try_acquire(self, now=None):
+        """
+        Take a download slot if the window and any pause allow it. Returns
+        the number of downloads in flight with this one, or 0.
+        """
+        with self._lock:
+            if (now or time.monotonic()) < self.paused_until:
+                return 0
+            if self.in_flight >= max(1, int(self.limit)):
+                return 0
+            self.in_flight += 1
+            return self.in_flight
+
+    def release(self, latency, ok, rate_limited=False, level=None):
+        """
+        Give a slot back, level being what try_acquire returned for it.
+
+        A fast success grows the window. A rate limited try caps it just
+        under the level it was rejected at. A slow response, or an error
+        rate over the threshold, halves it (once per latency target, so a
+        burst of failures from one window counts once).
+        """
+        now = time.monotonic()
+        with self._lock:
+            self.in_flight -= 1
+            self.error_rate += ERROR_RATE_WEIGHT * ((0.0 if ok else 1.0) - self.error_rate)
+
+            if rate_limited:
+                ceiling = max(1, (level or int(self.limit)) - 1)
+                if now < self.ceiling_until:
+                    ceiling = min(ceiling, self.ceiling)
+                self.ceiling, self.ceiling_until = ceiling, now + get_host_probe_interval()
+                self.limit = min(self.limit, float(ceiling))
+                self.slow_start = False
+            elif ok and latency <= self.latency_target:
+                ceiling = self.ceiling if now < self.ceiling_until else self.maximum
+                if self.limit < ceiling:
+                    step = 1 if self.slow_start else 1 / self.limit
+                    self.limit = min(ceiling, self.limit + step)
+            elif ((latency > self.latency_target or self.error_rate > self.max_error_rate)
+                    and now - self._last_decrease >= min(latency, self.latency_target)):
+                self.limit = max(1.0, self.limit / 2)
+                self.slow_start = False
+                self._last_decrease = now
+
+    def pause(self, seconds):
+        """No new downloads from this host for seconds (Retry-After)"""
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def wait_time(self, now=None):
+        with self._lock:
+            return max(0.0, self.paused_until - (now or time.monotonic()))
+
+
+class HostLimits:
+    """Process-wide HostLimit per host"""
+
+    def __init__(self):
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def get(self, host):
+        with self._lock:
+            limit = self._hosts.get(host)
+            if limit is None:
+                limit = self._hosts[host] = HostLimit()
+            return limit
+
+    def snapshot(self):
+        """{host: current window} for every host seen"""
+        with self._lock:
+            return {host: limit.limit for host, limit in self._hosts.items()}
+
+
+_host_limits = None
+_host_limits_lock = threading.Lock()
+
+
+def get_host_limits():
+    global _host_limits
+    if _host_limits is None:
+        with _host_limits_lock:
+            if _host_limits is None:
+                _host_limits = HostLimits()
+    return _host_limits
+
+
+# The HostSchedulers of running clones, for the saturation metrics
+_schedulers = weakref.WeakSet()
+_schedulers_lock = threading.Lock()
+
+
+def scheduled_resources():
+    """Resources queued for a host window and delayed for a retry, in all clones"""
+    with _schedulers_lock:
+        schedulers = list(_schedulers)
+    return {'queued': sum(scheduler.queued for scheduler in schedulers),
+            'delayed': sum(len(scheduler._delayed) for scheduler in schedulers)}
+
+
+class HostScheduler:
+    """
+    Resources of one clone waiting to be downloaded, queued per host and
+    handed out only as their host's window allows. Retries wait out their
+    backoff here rather than in a worker.
+    """
+
+    def __init__(self, limits=None):
+        self.limits = limits or get_host_limits()
+        self._queues = OrderedDict()
+        self._delayed = []
+        self._sequence = itertools.count()
+        self._started = {}
+        # Resources in _queues
+        self.queued = 0
+        with _schedulers_lock:
+            _schedulers.add(self)
+
+    def __bool__(self):
+        return bool(self._queues or self._delayed)
+
+    def add(self, resource):
+        self._queues.setdefault(host_of(resource['url']), deque()).append(resource)
+        self.queued += 1
+
+    def retry(self, resource, error):
+        """Queue another try after the backoff; False when out of tries"""
+        if error.throttled:
+            resource['throttled'] = resource.get('throttled', 0) + 1
+        FAILED_TRIES.inc(reason=error.reason)
+        retries = resource.get('retries', 0) + 1
+        if retries >= get_retry_attempts():
+            return False
+        resource['retries'] = retries
+        delay = backoff_delay(retries, error)
+        if error.throttled and error.delay is not None:
+            # The whole host asked us to slow down, not just this URL
+            self.limits.get(host_of(resource['url'])).pause(delay)
+        heapq.heappush(
+            self._delayed, (time.monotonic() + delay, next(self._sequence), resource))
+        return True
+
+    def ready(self, free=None):
+        """
+        Resources that may start now, at most free of them (the workers
+        idle to send them right away: a resource waiting for one would
+        count its wait as the host's latency). Each holds a slot of its
+        host until finished().
+        """
+        now = time.monotonic()
+        while self._delayed and self._delayed[0][0] <= now:
+            self.add(heapq.heappop(self._delayed)[2])
+
+        started = []
+        for host in list(self._queues):
+            queue = self._queues[host]
+            limit = self.limits.get(host)
+            while queue and (free is None or len(started) < free):
+                level = limit.try_acquire(now)
+                if not level:
+                    break
+                resource = queue.popleft()
+                self.queued -= 1
+                self._started[id(resource)] = (time.monotonic(), level)
+                started.append(resource)
+            if not queue:
+                del self._queues[host]
+        return started
+
+    def finished(self, resource, error=None):
+        """
+        Give back the slot of a try that ended, feeding its latency and
+        outcome (error is what it failed with) to the window
+        """
+        started, level = self._started.pop(id(resource))
+        self.limits.get(host_of(resource['url'])).release(
+            time.monotonic() - started, error is None,
+            getattr(error, 'rate_limited', False), level)
+
+    def wait_time(self):
+        """
+        Seconds until queued resources should be looked at again, or None
+        when nothing is waiting. A window can free up without this clone
+        noticing (another clone's download finished), so queues are polled.
+        """
+        now = time.monotonic()
+        waits = [POLL_INTERVAL] if self._queues else []
+        waits += [self.limits.get(host).wait_time(now) for host in self._queues]
+        if self._delayed:
+            waits.append(self._delayed[0][0] - now)
+        return max(0.0, min(waits)) if waits else None
+
+
+def host_stats(resources):
+    """
+    Per-host retry, throttle and failure counts of a clone, with each
+    host's current concurrency window; None when every try went through
+    """
+    hosts = {}
+    for resource in resources:
+        if not resource.get('retries') and not resource.get('throttled'):
+            continue
+        host = host_of(resource['url'])
+        counts = hosts.setdefault(host, {'retries': 0, 'throttled': 0, 'failed': 0})
+        counts['retries'] += resource.get('retries', 0)
+        counts['throttled'] += resource.get('throttled', 0)
+        if not resource.get('downloaded') and not resource.get('skipped'):
+            counts['failed'] += 1
+
+    if not hosts:
+        return None
+    windows = get_host_limits().snapshot()
+    for host, counts in hosts.items():
+        counts['concurrency'] = round(float(windows.get(host, 0)), 1)
+    return hosts
@@ -0,0 +1,137 @@
+import threading
+import queue
+from contextlib import contextmanager
+from http.cookiejar import DefaultCookiePolicy
+
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+
+
+DOWNLOAD_ENGINES = ('threads', 'async', 'http2')
+
+
+def get_download_engine():
+    """Default download engine ('threads', 'async' or 'http2')"""
+    return getattr(settings, 'SCRAPER_DOWNLOAD_ENGINE', 'threads')
+
+
+def get_resource_timeout():
+    """Per-resource timeout in seconds"""
+    return getattr(settings, 'SCRAPER_RESOURCE_TIMEOUT', 30)
+
+
+def get_connect_timeout():
+    """Seconds to wait for a connection, so a dead host fails (and retries) fast"""
+    return getattr(settings, 'SCRAPER_CONNECT_TIMEOUT', 10)
+
+
+def get_request_timeout():
+    """(connect, read) timeout for a resource request"""
+    return min(get_connect_timeout(), get_resource_timeout()), get_resource_timeout()
+
+
+def get_download_workers():
+    """Number of worker threads used to download resources"""
+    return getattr(settings, 'SCRAPER_DOWNLOAD_WORKERS', 10)
+
+
+def get_pool_size():
+    """Pooled sessions, and keep-alive connections kept per host"""
+    return getattr(settings, 'SCRAPER_POOL_SIZE', None) or get_download_workers()
+
+
+class SessionPool:
+    """
+    Thread-safe pool of keep-alive sessions.
+
+    Every session mounts the same HTTPAdapter, so all of them draw from one
+    set of per-host connection pools and a connection opened by one worker
+    is reused by the next one talking to the same origin.
+
+    The pool is shared by every clone, so sessions never keep cookies: one
+    site's session cookie must not be sent along with another user's clone.
+    """
+
+    def __init__(self, size=None, pool_maxsize=None, pool_connections=None):
+        self.size = size or get_pool_size()
+        self.pool_maxsize = pool_maxsize or get_pool_size()
+        self.pool_connections = pool_connections or getattr(
+            settings, 'SCRAPER_POOL_HOSTS', 100)
+
+        self.adapter = HTTPAdapter(
+            pool_connections=self.pool_connections,
+            pool_maxsize=self.pool_maxsize,
+        )
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _new_session(self):
+        session = requests.Session()
+        # No domain may set a cookie in (or get one from) the session's jar
+        session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        session.mount('http://', self.adapter)
+        session.mount('https://', self.adapter)
+        return session
+
+    def acquire(self):
+        """Take an idle session, creating one while under the pool size"""
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                return self._new_session()
+
+        return self._idle.get()
+
+    def release(self, session):
+        """Return a session to the pool"""
+        self._idle.put(session)
+
+    @contextmanager
+    def session(self):
+        session = self.acquire()
+        try:
+            yield session
+        finally:
+            self.release(session)
+
+    def get(self, url, **kwargs):
+        """GET through a pooled session"""
+        with self.session() as session:
+            return session.get(url, **kwargs)
+
+    def close(self):
+        """Drop idle sessions and close every pooled connection"""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+        with self._lock:
+            self._created = 0
+        self.adapter.close()
+
+
+_session_pool = None
+_session_pool_lock = threading.Lock()
+
+
+def get_session_pool():
+    """Process-wide session pool, shared across API requests"""
+    global _session_pool
+    if _session_pool is None:
+        with _session_pool_lock:
+            if _session_pool is None:
+                _session_pool = SessionPool()
+    return _session_pool
+
+
+def fetch(url, headers=None, timeout=30, **kwargs):
+    """Fetch a URL through the shared keep-alive session pool"""
+    return get_session_pool().get(url, headers=headers, timeout=timeout, **kwargs)
@@ -3,4 +3,12 @@ from . import views
 
 urlpatterns = [
     path('scrape/', views.scrape_website, name='scrape_website'),
+    path('export/zip/', views.export_zip, name='export_zip'),
+    path('batch/', views.batch_clone, name='batch_clone'),
+    path('blob/<str:digest>/', views.get_blob, name='get_blob'),
+    path('jobs/<str:job_id>/', views.job_status, name='job_status'),
+    path('jobs/<str:job_id>/result/', views.job_result, name='job_result'),
+    path('snapshots/', views.snapshot_list, name='snapshot_list'),
+    path('snapshots/<int:snapshot_id>/', views.snapshot_detail, name='snapshot_detail'),
+    path('metrics/', views.metrics, name='metrics'),
 ]
@@ -1,95 +1,110 @@
-from rest_framework.decorators import api_view
+from rest_framework.decorators import api_view, renderer_classes
 from rest_framework.response import Response
 from rest_framework import status
+from django.http import StreamingHttpResponse
 import requests
-from bs4 import BeautifulSoup
 import re
 from urllib.parse import urljoin, urlparse, unquote
 import time
 import base64
+import json
+import queue
 import traceback
+import zipfile
 import os
-import mimetypes
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, wait, as_completed, FIRST_COMPLETED
 import threading
+from functools import partial
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified
+from django.views.decorators.http import require_GET
+from .transport import (
+    fetch, get_download_workers, get_resource_timeout, get_request_timeout,
+    DOWNLOAD_ENGINES, get_download_engine
+)
+from .throttle import HostScheduler, RetryableError, check_status, host_stats
+from .async_engine import download_all_resources_async
+from .blobs import BINARY_MODES, BLOB_HASH_RE, get_binary_mode, get_blob_store
+from .exports import ZipStreamBuffer, resource_body_bytes, zip_entry_name, zip_compress_type
+from .http_cache import get_http_cache, store_cached, cache_stats, decode_body
+from .dom_index import DomIndex
+from .dedup import UNFETCHED_URLS, ResourceIndex, canonical_url
+from .coalesce import get_single_flight, store_coalesced
+from .rewrite import LinkRewriter, build_link_table, rewrite_document
+from .spool import SPOOL_CHUNK_SIZE, BodySpooler, body_size, parse_content_length, read_body
+from .ranged import accepts_ranges, download_ranged, has_checkpoint
+from .models import Snapshot
+from .snapshots import (
+    get_save_snapshots, get_snapshot_list_limit, save_snapshot, snapshot_result,
+    snapshot_summary)
+from .incremental import (
+    Baseline, body_hash, build_delta, read_snapshot, record_validators, text_hash)
+from .optimize import Optimizer, get_optimize, optimize_clone
+from . import processes
+from .batch import read_batch_urls, run_batch
+from .compression import UPSTREAM_ACCEPT_ENCODING
+from .renderers import CLONE_RENDERERS, MSGPACK_CONTENT_TYPE, msgpack_record
+from .metrics import (
+    CLONES, CONTENT_TYPE as METRICS_CONTENT_TYPE, in_flight, record_resource, render_metrics,
+    timed_phase
+)
+from .jobs import JOB_DONE, JOB_FAILED, JobQueueFull, Progress, get_job_queue
+from .parsing import PARSER_BACKENDS, get_parser_backend, parse_html
+from .css import find_css_references, get_css_max_depth, is_stylesheet
+from .crawler import (
+    CRAWL_SCOPES, Frontier, PageTooLarge, get_crawl_concurrency, get_crawl_max_depth,
+    get_crawl_max_page_bytes, get_crawl_max_pages, page_local_path
+)
+
+# Set headers to mimic a real browser
+BROWSER_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8',
+    'Accept-Language': 'en-US,en;q=0.9',
+    'Accept-Encoding': UPSTREAM_ACCEPT_ENCODING,
+    'Connection': 'keep-alive',
+    'Upgrade-Insecure-Requests': '1',
+    'Sec-Fetch-Dest': 'document',
+    'Sec-Fetch-Mode': 'navigate',
+    'Sec-Fetch-Site': 'none',
+    'Cache-Control': 'max-age=0'
+}
+
+# Scheme and host of an absolute http(s) URL, then its path
+URL_PATH_RE = re.compile(r'https?://[^/?#]*([^?#]*)')
 
-# Thread-safe counter for progress tracking
-download_progress = {'current': 0, 'total': 0, 'lock': threading.Lock()}
 
 
 @api_view(['POST'])
+@renderer_classes(CLONE_RENDERERS)
 def scrape_website(request):
     """
     Complete website cloner - 100% of everything with perfect structure
     """
     try:
-        url = request.data.get('url')
-
-        if not url:
+        options, error = read_scrape_options(request.data)
+        if error:
             return Response(
-                {'error': 'URL is required'},
+                {'error': error},
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        # Validate URL format
-        if not url.startswith(('http://', 'https://')):
-            url = 'https://' + url
+        url = options['url']
 
         print(f"🚀 Starting complete website clone: {url}")
 
         # Set headers to mimic a real browser
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8',
-            'Accept-Language': 'en-US,en;q=0.9',
-            'Accept-Encoding': 'gzip, deflate, br',
-            'Connection': 'keep-alive',
-            'Upgrade-Insecure-Requests': '1',
-            'Sec-Fetch-Dest': 'document',
-            'Sec-Fetch-Mode': 'navigate',
-            'Sec-Fetch-Site': 'none',
-            'Cache-Control': 'max-age=0'
-        }
+        headers = dict(BROWSER_HEADERS)
 
-        # Fetch the main webpage
-        print("📄 Fetching main HTML...")
-        response = requests.get(url, headers=headers, timeout=30)
-        response.raise_for_status()
+        if options['background']:
+            return start_clone_job(url, headers, options)
 
-        # Parse HTML
-        soup = BeautifulSoup(response.content, 'html.parser')
-
-        # Initialize progress tracking
-        with download_progress['lock']:
-            download_progress['current'] = 0
-            download_progress['total'] = 0
-
-        print("🔍 Analyzing website structure...")
-
-        # Extract ALL resources with complete structure
-        all_resources = extract_all_resources(soup, url, headers)
-
-        # Process HTML and update links to local files
-        processed_html = process_html_links(soup, all_resources, url)
-
-        print(f"✅ Complete! Extracted {len(all_resources)} total files")
-
-        return Response({
-            'html': str(processed_html),
-            'resources': all_resources,
-            'url': url,
-            'title': soup.title.string if soup.title else 'Untitled',
-            'scraped_at': time.strftime('%Y-%m-%d %H:%M:%S'),
-            'stats': {
-                'total_files': len(all_resources),
-                'css_files': len([r for r in all_resources if r['category'] == 'css']),
-                'js_files': len([r for r in all_resources if r['category'] == 'javascript']),
-                'images': len([r for r in all_resources if r['category'] == 'image']),
-                'fonts': len([r for r in all_resources if r['category'] == 'font']),
-                'libraries': len([r for r in all_resources if r['category'] == 'library']),
-                'other': len([r for r in all_resources if r['category'] == 'other'])
-            }
-        })
+        if options['stream']:
+            soup = fetch_page(url, headers, options['parser'])
+            return stream_scrape_response(
+                soup, url, headers, options,
+                msgpack=request.accepted_renderer.format == 'msgpack')
+
+        return Response(clone_website(url, headers, options))
 
     except requests.exceptions.RequestException as e:
         print(f"❌ Request error: {str(e)}")
@@ -106,64 +121,922 @@ def scrape_website(request):
         )
 
 
-def extract_all_resources(soup, base_url, headers):
+@api_view(['POST'])
+def export_zip(request):
+    """
+    Clone a website and stream it back as a ZIP archive
+    """
+    try:
+        options, error = read_scrape_options(request.data)
+        if error:
+            return Response(
+                {'error': error},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        if options['previous']:
+            return Response(
+                {'error': 'Incremental clones are not supported for ZIP exports'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        url = options['url']
+        print(f"📦 Starting ZIP export: {url}")
+
+        headers = dict(BROWSER_HEADERS)
+
+        if options['crawl']:
+            pages, all_resources, _ = crawl_site(url, headers, options)
+        else:
+            soup = fetch_page(url, headers, options['parser'])
+            pages = [make_page(soup, url)]
+            all_resources = discover_all_resources(soup, url)
+
+        return stream_zip_response(pages, all_resources, headers, options)
+
+    except requests.exceptions.RequestException as e:
+        print(f"❌ Request error: {str(e)}")
+        return Response(
+            {'error': f'Failed to fetch website: {str(e)}'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    except Exception as e:
+        print(f"❌ General error: {str(e)}")
+        print(f"Traceback: {traceback.format_exc()}")
+        return Response(
+            {'error': f'Export failed: {str(e)}'},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+
+@api_view(['POST'])
+@renderer_classes(CLONE_RENDERERS)
+def batch_clone(request):
+    """
+    Clone every page of a list of URLs with the same options, streaming
+    back one NDJSON record per URL as its clone finishes
+    """
+    urls, error = read_batch_urls(request.data)
+    if error:
+        return Response(
+            {'error': error},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    options, error = read_scrape_options({**request.data, 'url': urls[0]})
+    if not error and (options['crawl'] or options['stream'] or options['background']
+                      or options['previous']):
+        error = 'crawl, stream, background and previous are not supported for batches'
+    if error:
+        return Response(
+            {'error': error},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    print(f"🚀 Starting batch clone of {len(urls)} pages")
+    msgpack = request.accepted_renderer.format == 'msgpack'
+    return stream_batch_response(urls, dict(BROWSER_HEADERS), options, msgpack)
+
+
+@api_view(['GET'])
+def get_blob(request, digest):
+    """
+    Serve a stored resource body by its SHA-256 hash
+    """
+    blob_store = get_blob_store()
+    if not BLOB_HASH_RE.match(digest) or not blob_store.exists(digest):
+        return Response(
+            {'error': 'Blob not found'},
+            status=status.HTTP_404_NOT_FOUND
+        )
+
+    # Blobs are immutable, so the hash is a perfect validator
+    etag = f'"{digest}"'
+    if etag in request.headers.get('If-None-Match', ''):
+        response = HttpResponseNotModified()
+    else:
+        try:
+            meta = blob_store.meta(digest)
+            body = blob_store.open(digest)
+        except OSError:
+            # Pruned since the check
+            return Response(
+                {'error': 'Blob not found'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        response = FileResponse(
+            body, content_type=meta['content_type'] or 'application/octet-stream')
+    response['ETag'] = etag
+    response['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+
+@api_view(['GET'])
+def job_status(request, job_id):
+    """
+    Status and download progress of a background clone
+    """
+    job = get_job_queue().get(job_id)
+    if job is None:
+        return Response(
+            {'error': 'Job not found'},
+            status=status.HTTP_404_NOT_FOUND
+        )
+    return Response(job.as_dict())
+
+
+@api_view(['GET'])
+@renderer_classes(CLONE_RENDERERS)
+def job_result(request, job_id):
+    """
+    Result of a finished background clone, same shape as a direct clone
+    """
+    job = get_job_queue().get(job_id)
+    if job is None:
+        return Response(
+            {'error': 'Job not found'},
+            status=status.HTTP_404_NOT_FOUND
+        )
+
+    if job.status == JOB_FAILED:
+        return Response({'error': job.error}, status=job.error_status)
+
+    if job.status != JOB_DONE:
+        return Response(
+            {'error': 'Job is not finished', **job.as_dict()},
+            status=status.HTTP_409_CONFLICT
+        )
+
+    return Response(job.result)
+
+
+@api_view(['GET'])
+def snapshot_list(request):
+    """
+    Saved snapshots, newest first, optionally only those of ?url=
+    """
+    snapshots = Snapshot.objects.all()
+    if request.query_params.get('url'):
+        snapshots = snapshots.filter(url=request.query_params['url'])
+
+    try:
+        limit = int(request.query_params.get('limit', get_snapshot_list_limit()))
+    except ValueError:
+        return Response(
+            {'error': 'limit must be an integer'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    limit = max(1, min(limit, get_snapshot_list_limit()))
+
+    return Response({
+        'snapshots': [snapshot_summary(snapshot) for snapshot in snapshots[:limit]],
+    })
+
+
+@api_view(['GET'])
+@renderer_classes(CLONE_RENDERERS)
+def snapshot_detail(request, snapshot_id):
+    """
+    A saved snapshot, same shape as a direct clone, without scraping again
+    """
+    snapshot = Snapshot.objects.filter(pk=snapshot_id).first()
+    if snapshot is None:
+        return Response(
+            {'error': 'Snapshot not found'},
+            status=status.HTTP_404_NOT_FOUND
+        )
+
+    binary_mode = request.query_params.get('binary_mode') or get_binary_mode()
+    if binary_mode not in BINARY_MODES:
+        return Response(
+            {'error': f'Unknown binary mode: {binary_mode}'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    return Response(snapshot_result(snapshot, binary_mode))
+
+
+@require_GET
+def metrics(request):
+    """
+    Pipeline metrics in the Prometheus text format
+    """
+    return HttpResponse(render_metrics(), content_type=METRICS_CONTENT_TYPE)
+
+
+def start_clone_job(url, headers, options):
+    """
+    Queue a clone on the background job pool and answer with its id
+    """
+    try:
+        job = get_job_queue().submit(
+            clone_website, url, headers, options, error_handler=clone_error)
+    except JobQueueFull as e:
+        return Response(
+            {'error': f'Too many clones queued, try again later ({e})'},
+            status=status.HTTP_503_SERVICE_UNAVAILABLE
+        )
+
+    print(f"🧵 Queued clone job {job.id}: {url}")
+
+    return Response({
+        **job.as_dict(),
+        'status_url': f'/api/jobs/{job.id}/',
+        'result_url': f'/api/jobs/{job.id}/result/',
+    }, status=status.HTTP_202_ACCEPTED)
+
+
+def clone_error(error):
+    """(message, HTTP status) for a clone that failed"""
+    if isinstance(error, requests.exceptions.RequestException):
+        print(f"❌ Request error: {str(error)}")
+        return f'Failed to fetch website: {str(error)}', status.HTTP_400_BAD_REQUEST
+    print(f"❌ General error: {str(error)}")
+    return f'Scraping failed: {str(error)}', status.HTTP_500_INTERNAL_SERVER_ERROR
+
+
+def clone_website(url, headers, options, progress=None):
+    """
+    Clone a page (or a whole site in crawl mode) and return the response
+    data, counting downloads on progress
+    """
+    mode = 'crawl' if options['crawl'] else 'page'
+    try:
+        with timed_phase('clone'):
+            if options['crawl']:
+                result = crawl_website(url, headers, options, progress)
+            else:
+                result = clone_page(url, headers, options, progress)
+    except Exception:
+        CLONES.inc(mode=mode, outcome='failed')
+        raise
+
+    CLONES.inc(mode=mode, outcome='done')
+    return finish_clone(result, options)
+
+
+def finish_clone(result, options):
+    """Optimize, compare and save a clone as its options ask"""
+    if options.get('optimize'):
+        with timed_phase('optimize'):
+            optimize_clone(result)
+        for page in result.get('pages', []) + [result]:
+            page['html_hash'] = text_hash(page['html'])
+
+    if options.get('previous'):
+        result['delta'] = build_delta(result, options['previous'])
+        # Counted by the delta, so the two can't disagree
+        if result['delta']['unchanged']:
+            result['stats']['unchanged'] = result['delta']['unchanged']
+
+    if options.get('save'):
+        with timed_phase('save'):
+            result['snapshot_id'] = save_snapshot(result).id
+        print(f"💾 Saved snapshot {result['snapshot_id']}")
+
+    return result
+
+
+def clone_page(url, headers, options, progress=None):
+    """
+    Clone a single page and return the response data
+    """
+    # Fetch and parse the main webpage
+    soup = fetch_page(url, headers, options['parser'])
+
+    print("🔍 Analyzing website structure...")
+
+    # Extract ALL resources with complete structure
+    all_resources = extract_all_resources(soup, url, headers, options, progress)
+
+    # Process HTML and update links to local files
+    processed_html = process_html_links(soup, all_resources, url)
+
+    print(f"✅ Complete! Extracted {len(all_resources)} total files")
+
+    with timed_phase('serialize'):
+        html = str(processed_html)
+
+    result = {
+        'html': html,
+        'html_hash': text_hash(html),
+        'resources': all_resources,
+        'url': url,
+        'title': soup.title.string if soup.title else 'Untitled',
+        'scraped_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'stats': build_stats(all_resources)
+    }
+    return result
+
+
+def default_scrape_options():
+    """Pipeline options used when a request doesn't set them"""
+    return {
+        'engine': get_download_engine(),
+        'binary_mode': get_binary_mode(),
+        'parser': get_parser_backend(),
+        'stream': False,
+        'cache': True,
+        'crawl': False,
+        'depth': get_crawl_max_depth(),
+        'max_pages': get_crawl_max_pages(),
+        'scope': 'origin',
+        'background': False,
+        'previous': None,
+        'save': get_save_snapshots(),
+        'optimize': get_optimize(),
+    }
+
+
+def resolve_scrape_options(options=None):
+    """Fill in defaults for any option that isn't set"""
+    resolved = default_scrape_options()
+    resolved.update({k: v for k, v in (options or {}).items() if v is not None})
+    return resolved
+
+
+def read_flag(value):
+    """
+    An on/off option as JSON or a form sends it: false, 0, '', '0',
+    'false', 'off' and 'no' (any case) are off
+    """
+    if isinstance(value, str):
+        value = value.strip().lower()
+    return value not in (False, 'false', '0', 0, '', 'off', 'no', None)
+
+
+def read_scrape_options(data):
+    """
+    Read the options shared by the scrape endpoints.
+    Returns (options, error) where error is a message for a 400 response.
+    """
+    options = resolve_scrape_options({
+        'url': data.get('url'),
+        'engine': data.get('engine') or None,
+        'binary_mode': data.get('binary_mode') or None,
+        'parser': data.get('parser') or None,
+        'stream': read_flag(data.get('stream', False)),
+        'cache': read_flag(data.get('cache', True)),
+        'crawl': read_flag(data.get('crawl', False)),
+        'depth': data.get('depth'),
+        'max_pages': data.get('max_pages'),
+        'scope': data.get('scope') or None,
+        'background': read_flag(data.get('background', False)),
+        'previous': data.get('previous'),
+        'save': data.get('save'),
+        'optimize': data.get('optimize'),
+    })
+
+    if not options.get('url'):
+        return options, 'URL is required'
+
+    if options['engine'] not in DOWNLOAD_ENGINES:
+        return options, f"Unknown download engine: {options['engine']}"
+
+    if options['binary_mode'] not in BINARY_MODES:
+        return options, f"Unknown binary mode: {options['binary_mode']}"
+
+    if options['parser'] not in PARSER_BACKENDS:
+        return options, f"Unknown parser: {options['parser']}"
+
+    if options['scope'] not in CRAWL_SCOPES:
+        return options, f"Unknown crawl scope: {options['scope']}"
+
+    for name, minimum in (('depth', 0), ('max_pages', 1)):
+        try:
+            options[name] = int(options[name])
+        except (TypeError, ValueError):
+            return options, f"{name} must be an integer"
+        if options[name] < minimum:
+            return options, f"{name} must be at least {minimum}"
+
+    if options['crawl'] and options['stream']:
+        return options, 'Streaming is not supported for crawls'
+
+    if options['background'] and options['stream']:
+        return options, 'Streaming is not supported for background jobs'
+
+    options['previous'], error = read_snapshot(options['previous'])
+    if error:
+        return options, error
+
+    if options['previous'] and options['stream']:
+        return options, 'Streaming is not supported for incremental clones'
+
+    options['save'] = read_flag(options['save'])
+    options['optimize'] = read_flag(options['optimize'])
+
+    if options['optimize'] and options['stream']:
+        return options, 'Optimization is not supported for streamed clones'
+
+    # Validate URL format
+    if not options['url'].startswith(('http://', 'https://')):
+        options['url'] = 'https://' + options['url']
+
+    return options, None
+
+
+def fetch_page(url, headers, parser=None):
+    """
+    Fetch and parse the main HTML page
+    """
+    content = fetch_page_content(url, headers)
+
+    # Parse HTML
+    with timed_phase('parse'):
+        return parse_html(content, parser)
+
+
+def fetch_page_content(url, headers):
+    """Fetch the main HTML page, returns its body"""
+    print("📄 Fetching main HTML...")
+    with timed_phase('fetch'):
+        response = fetch(url, headers=headers, timeout=30)
+        response.raise_for_status()
+    return response.content
+
+
+def stream_batch_response(urls, headers, options, msgpack=False):
+    """
+    Stream a batch clone: a 'result' record (index, url and the clone) or
+    an 'error' record per URL in the order they finish, then a 'done'
+    record with the counts. As NDJSON, or MessagePack maps with msgpack.
+    """
+    record = msgpack_record if msgpack else ndjson_record
+
+    def records():
+        started = time.perf_counter()
+        failed = 0
+        for index, result, error in run_batch(
+                urls, partial(clone_batch_page, headers=headers, options=options)):
+            if error is None:
+                yield record('result', index=index, url=urls[index], result=result)
+                continue
+            failed += 1
+            message, error_status = clone_error(error)
+            yield record('error', index=index, url=urls[index],
+                         error=message, status=error_status)
+
+        print(f"✅ Batch complete! {len(urls) - failed} of {len(urls)} pages cloned")
+        yield record('done', total=len(urls), failed=failed,
+                     seconds=round(time.perf_counter() - started, 3))
+
+    response = StreamingHttpResponse(
+        records(), content_type=MSGPACK_CONTENT_TYPE if msgpack else 'application/x-ndjson')
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def clone_batch_page(url, headers, options):
+    """
+    Clone one page of a batch, same result as clone_page. The page is
+    parsed in a worker process, for discovery (discover_page_content) and
+    again for rendering once the downloads are done (render_page_content),
+    while this thread does the I/O.
+    """
+    if not url.startswith(('http://', 'https://')):
+        url = 'https://' + url
+
+    try:
+        with timed_phase('clone'):
+            content = fetch_page_content(url, headers)
+            all_resources, title = processes.submit(
+                discover_page_content, url, content, options['parser']).result()
+            download_all_resources(all_resources, headers, options)
+            html = processes.submit(
+                render_page_content, url, content, options['parser'],
+                build_link_table(all_resources)).result()
+    except Exception:
+        CLONES.inc(mode='batch', outcome='failed')
+        raise
+
+    CLONES.inc(mode='batch', outcome='done')
+    result = {
+        'html': html,
+        'html_hash': text_hash(html),
+        'resources': all_resources,
+        'url': url,
+        'title': title,
+        'scraped_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'stats': build_stats(all_resources)
+    }
+    return finish_clone(result, options)
+
+
+def discover_page_content(url, content, parser=None):
+    """
+    Parse a fetched page and discover its resources, in a worker process.
+    Returns (resources, title).
+    """
+    with timed_phase('parse'):
+        soup = parse_html(content, parser)
+    all_resources = discover_all_resources(soup, url)
+    title = soup.title.string if soup.title else 'Untitled'
+    # Plain str: a NavigableString would carry its whole tree back
+    return all_resources, None if title is None else str(title)
+
+
+def render_page_content(url, content, parser, table):
+    """
+    Parse a fetched page and rewrite its links with the clone's link
+    table, in a worker process. Returns the rewritten HTML.
+    """
+    with timed_phase('parse'):
+        soup = parse_html(content, parser)
+    soup = process_html_links(soup, None, url, table=table)
+    with timed_phase('serialize'):
+        return str(soup)
+
+
+def iter_completed_resources(all_resources, headers, options=None, store_body=None,
+                             resume=None):
+    """
+    Download resources in the background and yield each one as it finishes.
+    Inline and embedded resources (and any marked downloaded already) come
+    first; a download failure of the whole batch is yielded as {'error': ...}.
+    """
+    finished = queue.Queue()
+    # Stylesheet references get appended to all_resources during the download
+    ready = [resource for resource in all_resources if resource['downloaded']]
+
+    def download():
+        try:
+            download_all_resources(
+                all_resources, headers, options, on_complete=finished.put,
+                store_body=store_body, resume=resume)
+        except Exception as e:
+            print(f"❌ Download error: {str(e)}")
+            finished.put({'error': str(e)})
+        finally:
+            finished.put(None)
+
+    threading.Thread(target=download, daemon=True).start()
+
+    # Inline and embedded resources are complete before any download
+    yield from ready
+
+    while True:
+        resource = finished.get()
+        if resource is None:
+            break
+        yield resource
+
+
+def stream_scrape_response(soup, base_url, headers, options=None, msgpack=False):
+    """
+    Stream the clone as NDJSON: one record per resource as its download
+    finishes, then a final 'page' record with the rewritten HTML and stats.
+    With msgpack, the records are a sequence of MessagePack maps instead.
+    """
+    all_resources = discover_all_resources(soup, base_url)
+    record = msgpack_record if msgpack else ndjson_record
+
+    def records():
+        for resource in iter_completed_resources(all_resources, headers, options):
+            if 'url' not in resource:
+                yield record('error', error=resource['error'])
+                continue
+            yield record('resource', resource=resource)
+            # The body has been sent, don't keep it for the rest of the clone
+            resource['content'] = ''
+
+        processed_html = process_html_links(soup, all_resources, base_url)
+
+        print(f"✅ Complete! Streamed {len(all_resources)} total files")
+
+        yield record(
+            'page',
+            html=str(processed_html),
+            url=base_url,
+            title=soup.title.string if soup.title else 'Untitled',
+            scraped_at=time.strftime('%Y-%m-%d %H:%M:%S'),
+            stats=build_stats(all_resources),
+        )
+
+    response = StreamingHttpResponse(
+        records(), content_type=MSGPACK_CONTENT_TYPE if msgpack else 'application/x-ndjson')
+    # Stop reverse proxies from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def stream_zip_response(pages, all_resources, headers, options=None):
+    """
+    Stream the clone as a ZIP laid out by original_path, writing each entry
+    as its download finishes and the pages (index.html first) last. With
+    the optimize option, entries are written as their optimization finishes.
+    """
+    page_paths = {page['url']: page['path'] for page in pages}
+    optimizer = Optimizer() if options and options.get('optimize') else None
+
+    def chunks():
+        buffer = ZipStreamBuffer()
+        written = set(page_paths.values())
+        optimizing = {}
+
+        def write(name, resource):
+            archive.writestr(
+                name, resource_body_bytes(resource),
+                compress_type=zip_compress_type(name))
+            # The entry is in the archive, don't keep the body around
+            resource['content'] = ''
+
+        def write_optimized(future):
+            name, resource = optimizing.pop(future)
+            optimizer.apply(resource, future)
+            write(name, resource)
+
+        with zipfile.ZipFile(buffer, 'w') as archive:
+            for resource in iter_completed_resources(all_resources, headers, options):
+                if not resource.get('downloaded'):
+                    continue
+
+                name = zip_entry_name(resource['original_path'])
+                if name in written:
+                    continue
+                written.add(name)
+
+                future = optimizer.submit(resource) if optimizer else None
+                if future is None:
+                    write(name, resource)
+                else:
+                    optimizing[future] = (name, resource)
+                for done in [future for future in optimizing if future.done()]:
+                    write_optimized(done)
+                yield buffer.pop()
+
+            for future in as_completed(list(optimizing)):
+                write_optimized(future)
+                yield buffer.pop()
+
+            table = build_link_table(all_resources)
+            for page in pages:
+                html = render_page(page, all_resources, page_paths, table)
+                if optimizer:
+                    html = optimizer.page(html, optimizer.submit_page(html))
+                archive.writestr(
+                    page['path'], html.encode('utf-8'),
+                    compress_type=zipfile.ZIP_DEFLATED)
+                yield buffer.pop()
+
+        print(f"✅ Complete! Exported {len(written)} files to ZIP")
+        yield buffer.pop()
+
+    filename = (urlparse(pages[0]['url']).netloc or 'website').replace(':', '_')
+    response = StreamingHttpResponse(chunks(), content_type='application/zip')
+    response['Content-Disposition'] = f'attachment; filename="{filename}.zip"'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def make_page(soup, url, path='index.html', depth=0):
+    """A parsed page of a clone and where it is saved"""
+    return {'url': url, 'path': path, 'depth': depth, 'soup': soup}
+
+
+def render_page(page, all_resources, page_paths=None, table=None):
+    """
+    Rewritten HTML for a page. Links to downloaded files, and to other
+    pages of a crawl, are made relative to where the page is saved.
+    """
+    soup = process_html_links(
+        page['soup'], all_resources, page['url'], page['path'], page_paths, table)
+    with timed_phase('serialize'):
+        return str(soup)
+
+
+def crawl_website(url, headers, options, progress=None):
+    """
+    Clone every page reachable from url within the crawl limits, downloading
+    the assets they share once
+    """
+    pages, all_resources, failed_pages = crawl_site(url, headers, options)
+
+    download_all_resources(all_resources, headers, options, progress=progress)
+
+    page_paths = {page['url']: page['path'] for page in pages}
+    table = build_link_table(all_resources)
+    rendered = [{
+        'url': page['url'],
+        'path': page['path'],
+        'depth': page['depth'],
+        'title': page['soup'].title.string if page['soup'].title else 'Untitled',
+        'html': render_page(page, all_resources, page_paths, table),
+    } for page in pages]
+    for page in rendered:
+        page['html_hash'] = text_hash(page['html'])
+
+    stats = build_stats(all_resources)
+    stats['pages'] = len(pages)
+    stats['failed_pages'] = len(failed_pages)
+
+    print(f"✅ Complete! Crawled {len(pages)} pages, {len(all_resources)} total files")
+
+    result = {
+        'html': rendered[0]['html'],
+        'html_hash': rendered[0]['html_hash'],
+        'resources': all_resources,
+        'url': url,
+        'title': rendered[0]['title'],
+        'scraped_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'stats': stats,
+        'pages': rendered,
+        'failed_pages': failed_pages,
+    }
+    return result
+
+
+def crawl_site(seed_url, headers, options):
+    """
+    Fetch pages breadth-first from seed_url, up to options['depth'] link
+    hops and options['max_pages'] pages within options['scope'], keeping
+    options-bounded numbers of page fetches in flight.
+
+    Every page's resources are discovered into one shared list, so an asset
+    used by many pages is downloaded once. Returns (pages, all_resources,
+    failed_pages); nothing is downloaded yet.
+    """
+    frontier = Frontier(
+        seed_url, options['depth'], options['max_pages'], options['scope'])
+    concurrency = get_crawl_concurrency()
+    pages = []
+    resources = ResourceIndex()
+    failed_pages = []
+    # Saved paths given out so far, so no two pages share one
+    taken = set()
+
+    print(f"🕸️ Crawling {frontier.seed} (depth {options['depth']}, "
+          f"up to {options['max_pages']} pages)...")
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        in_flight = {}
+
+        while frontier or in_flight:
+            while frontier and len(in_flight) < concurrency:
+                page_url, depth = frontier.pop()
+                # The seed is parsed whatever its type, like a single-page clone
+                fetcher = fetch_page if depth == 0 else fetch_crawl_page
+                future = executor.submit(fetcher, page_url, headers, options['parser'])
+                in_flight[future] = (page_url, depth)
+
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                page_url, depth = in_flight.pop(future)
+                try:
+                    soup = future.result()
+                except requests.exceptions.RequestException as e:
+                    if depth == 0:
+                        raise
+                    print(f"❌ Failed to fetch page {page_url}: {e}")
+                    failed_pages.append({'url': page_url, 'error': str(e)})
+                    continue
+                if soup is None:
+                    continue
+
+                pages.append(make_page(
+                    soup, page_url, page_local_path(page_url, frontier.seed, taken),
+                    depth))
+                print(f"📄 Page {len(pages)}: {page_url}")
+
+                for resource in discover_all_resources(soup, page_url):
+                    # Inline copies only for the seed, other pages keep
+                    # theirs in the HTML
+                    if depth == 0 or resource['url'] not in UNFETCHED_URLS:
+                        resources.add(resource)
+
+                for link in soup.find_all('a', href=True):
+                    frontier.add(urljoin(page_url, link['href']), depth + 1)
+
+    return pages, resources.resources, failed_pages
+
+
+def fetch_crawl_page(url, headers, parser=None):
+    """
+    Fetch and parse a crawled page, or return None when the link turned out
+    not to be HTML. The body is streamed: nothing of it is read unless the
+    page is HTML, and no more than the page byte budget (PageTooLarge).
+    """
+    max_bytes = get_crawl_max_page_bytes()
+    with timed_phase('fetch'):
+        with fetch(url, headers=headers, timeout=30, stream=True) as response:
+            response.raise_for_status()
+            if 'html' not in response.headers.get('content-type', '').lower():
+                return None
+
+            size = parse_content_length(response.headers.get('content-length'))
+            content = bytearray()
+            if size is None or size <= max_bytes:
+                for chunk in response.iter_content(SPOOL_CHUNK_SIZE):
+                    content += chunk
+                    if len(content) > max_bytes:
+                        break
+            if (size is not None and size > max_bytes) or len(content) > max_bytes:
+                raise PageTooLarge(f'Page is over {max_bytes} bytes')
+
+    with timed_phase('parse'):
+        return parse_html(bytes(content), parser)
+
+
+def ndjson_record(record_type, **fields):
+    """Encode one NDJSON line"""
+    return (json.dumps({'type': record_type, **fields}, ensure_ascii=False) + '\n').encode('utf-8')
+
+
+def build_stats(all_resources):
+    """Per-category file counts for a clone"""
+    stats = {
+        'total_files': len(all_resources),
+        'css_files': len([r for r in all_resources if r['category'] == 'css']),
+        'js_files': len([r for r in all_resources if r['category'] == 'javascript']),
+        'images': len([r for r in all_resources if r['category'] == 'image']),
+        'fonts': len([r for r in all_resources if r['category'] == 'font']),
+        'libraries': len([r for r in all_resources if r['category'] == 'library']),
+        'other': len([r for r in all_resources if r['category'] == 'other'])
+    }
+
+    skipped = [r for r in all_resources if r.get('skipped')]
+    if skipped:
+        stats['skipped'] = len(skipped)
+
+    coalesced = [r for r in all_resources if r.get('coalesced')]
+    if coalesced:
+        stats['coalesced'] = len(coalesced)
+
+    ranged = [r for r in all_resources if r.get('ranged')]
+    if ranged:
+        stats['ranged'] = len(ranged)
+
+    hosts = host_stats(all_resources)
+    if hosts:
+        stats['hosts'] = hosts
+
+    if any('cache' in r for r in all_resources):
+        stats['cache'] = cache_stats(all_resources)
+
+    return stats
+
+
+def extract_all_resources(soup, base_url, headers, options=None, progress=None):
     """
     Extract 100% of all resources from the website
     """
-    all_resources = []
-    resource_urls = set()  # Prevent duplicates
+    all_resources = discover_all_resources(soup, base_url)
+
+    # Download all resources with the selected engine
+    download_all_resources(all_resources, headers, options, progress=progress)
+
+    return all_resources
+
+
+def discover_all_resources(soup, base_url):
+    """
+    Discover every resource on the page without downloading anything
+    """
+    # One entry per canonical URL, however many tags reference it
+    resources = ResourceIndex()
 
     print("🎯 Discovering all resources...")
 
+    # One traversal of the tree; every discover_* step reads from the index
+    with timed_phase('discover_index'):
+        index = DomIndex(soup)
+
     # 1. CSS FILES - All stylesheets
-    css_resources = discover_css_resources(soup, base_url)
-    all_resources.extend(css_resources)
-    resource_urls.update([r['url']
-                         for r in css_resources if r['url'] != 'inline'])
+    css_resources = discover_css_resources(index, base_url)
+    resources.extend(css_resources)
 
     # 2. JAVASCRIPT FILES - All scripts
-    js_resources = discover_js_resources(soup, base_url)
-    all_resources.extend(js_resources)
-    resource_urls.update([r['url']
-                         for r in js_resources if r['url'] != 'inline'])
+    resources.extend(discover_js_resources(index, base_url))
 
     # 3. IMAGES - All images from everywhere
-    image_resources = discover_all_images(soup, base_url)
-    all_resources.extend(image_resources)
-    resource_urls.update(
-        [r['url'] for r in image_resources if not r['url'].startswith('data:')])
+    resources.extend(discover_all_images(index, base_url))
 
     # 4. FONTS - All font files
-    font_resources = discover_font_resources(soup, base_url)
-    all_resources.extend(font_resources)
-    resource_urls.update([r['url'] for r in font_resources])
+    resources.extend(discover_font_resources(index, base_url))
 
     # 5. OTHER RESOURCES - Videos, audio, documents, etc.
-    other_resources = discover_other_resources(soup, base_url)
-    all_resources.extend(other_resources)
-    resource_urls.update([r['url'] for r in other_resources])
+    resources.extend(discover_other_resources(index, base_url))
 
-    # 6. DEEP CSS ANALYSIS - Extract resources from CSS files
-    css_embedded_resources = extract_resources_from_css(
-        all_resources, base_url)
-    all_resources.extend(css_embedded_resources)
-
-    print(f"📊 Found {len(all_resources)} total resources")
+    # 6. DEEP CSS ANALYSIS - References inside <style> blocks. External
+    # stylesheets are scanned as their downloads finish.
+    for css_resource in css_resources:
+        if css_resource['url'] == 'inline':
+            extract_resources_from_css(css_resource, base_url, resources)
 
-    # Download all resources with threading
-    download_all_resources(all_resources, headers)
+    print(f"📊 Found {len(resources)} total resources")
 
-    return all_resources
+    return resources.resources
 
 
-def discover_css_resources(soup, base_url):
+@timed_phase('discover_css')
+def discover_css_resources(index, base_url):
     """
     Discover all CSS resources
     """
     css_resources = []
 
     # Inline styles
-    style_tags = soup.find_all('style')
+    style_tags = index.find_all('style')
     for i, style in enumerate(style_tags):
         if style.string and style.string.strip():
             css_resources.append({
@@ -178,14 +1051,17 @@ def discover_css_resources(soup, base_url):
             })
 
     # External stylesheets
-    link_tags = soup.find_all('link')
+    link_tags = index.find_all('link')
     for link in link_tags:
         href = link.get('href')
         rel = link.get('rel', [])
 
-        if href and ('stylesheet' in rel or 'preload' in rel):
+        # A preload is a stylesheet only with as="style"; scripts, images and
+        # fonts it preloads are found by their own discover step
+        preload = 'preload' in rel and link.get('as', '').lower() == 'style'
+        if href and ('stylesheet' in rel or preload):
             full_url = urljoin(base_url, href)
-            original_path = clean_path(href)
+            original_path = clean_path(full_url)
 
             # Ensure CSS extension
             if not original_path.endswith('.css'):
@@ -197,7 +1073,7 @@ def discover_css_resources(soup, base_url):
                 'url': full_url,
                 'content': '',
                 'category': 'css',
-                'type': 'external',
+                'type': 'external' if 'stylesheet' in rel else 'preload',
                 'size': 0,
                 'downloaded': False
             })
@@ -205,14 +1081,15 @@ def discover_css_resources(soup, base_url):
     return css_resources
 
 
-def discover_js_resources(soup, base_url):
+@timed_phase('discover_js')
+def discover_js_resources(index, base_url):
     """
     Discover all JavaScript resources
     """
     js_resources = []
 
     # All script tags
-    script_tags = soup.find_all('script')
+    script_tags = index.find_all('script')
     inline_count = 0
 
     for i, script in enumerate(script_tags):
@@ -233,7 +1110,7 @@ def discover_js_resources(soup, base_url):
             # External JavaScript
             src = script.get('src')
             full_url = urljoin(base_url, src)
-            original_path = clean_path(src)
+            original_path = clean_path(full_url)
 
             # Ensure JS extension
             if not original_path.endswith('.js'):
@@ -256,7 +1133,8 @@ def discover_js_resources(soup, base_url):
     return js_resources
 
 
-def discover_all_images(soup, base_url):
+@timed_phase('discover_images')
+def discover_all_images(index, base_url):
     """
     Discover ALL images from everywhere
     """
@@ -264,7 +1142,7 @@ def discover_all_images(soup, base_url):
     image_urls = set()
 
     # 1. IMG tags
-    img_tags = soup.find_all('img')
+    img_tags = index.find_all('img')
     for img in img_tags:
         src = img.get('src') or img.get(
             'data-src') or img.get('data-lazy-src') or img.get('data-original')
@@ -273,8 +1151,17 @@ def discover_all_images(soup, base_url):
             image_resources.append(create_image_resource(
                 src, base_url, img.get('alt', '')))
 
+        # Responsive candidates of the same image
+        srcset = img.get('srcset') or img.get('data-srcset')
+        if srcset:
+            for url in parse_srcset(srcset):
+                if url and url not in image_urls:
+                    image_urls.add(url)
+                    image_resources.append(create_image_resource(
+                        url, base_url, img.get('alt', '')))
+
     # 2. Picture/source tags
-    source_tags = soup.find_all('source')
+    source_tags = index.find_all('source')
     for source in source_tags:
         srcset = source.get('srcset') or source.get('data-srcset')
         if srcset:
@@ -287,11 +1174,10 @@ def discover_all_images(soup, base_url):
                         create_image_resource(url, base_url))
 
     # 3. CSS background images (from style attributes)
-    elements_with_style = soup.find_all(attrs={'style': True})
+    elements_with_style = index.find_all(attrs={'style': True})
     for element in elements_with_style:
         style = element.get('style', '')
-        bg_images = re.findall(
-            r'background-image:\s*url$$["\']?([^"\']+)["\']?$$', style)
+        bg_images = [ref for ref, _ in find_css_references(style)]
         for bg_url in bg_images:
             if bg_url and bg_url not in image_urls:
                 image_urls.add(bg_url)
@@ -299,7 +1185,7 @@ def discover_all_images(soup, base_url):
                     bg_url, base_url, 'Background image'))
 
     # 4. Link tags for icons
-    link_tags = soup.find_all('link')
+    link_tags = index.find_all('link')
     for link in link_tags:
         rel = link.get('rel', [])
         href = link.get('href')
@@ -311,7 +1197,7 @@ def discover_all_images(soup, base_url):
                     create_image_resource(href, base_url, 'Icon'))
 
     # 5. Meta tags for social media images
-    meta_tags = soup.find_all('meta')
+    meta_tags = index.find_all('meta')
     for meta in meta_tags:
         property_val = meta.get('property', '') or meta.get('name', '')
         content = meta.get('content', '')
@@ -322,17 +1208,27 @@ def discover_all_images(soup, base_url):
                 image_resources.append(create_image_resource(
                     content, base_url, 'Social media image'))
 
+    # 6. Video posters
+    video_tags = index.find_all('video')
+    for video in video_tags:
+        poster = video.get('poster')
+        if poster and poster not in image_urls:
+            image_urls.add(poster)
+            image_resources.append(create_image_resource(
+                poster, base_url, 'Video poster'))
+
     return image_resources
 
 
-def discover_font_resources(soup, base_url):
+@timed_phase('discover_fonts')
+def discover_font_resources(index, base_url):
     """
     Discover all font resources
     """
     font_resources = []
 
     # Link tags for fonts
-    link_tags = soup.find_all('link')
+    link_tags = index.find_all('link')
     for link in link_tags:
         href = link.get('href')
         rel = link.get('rel', [])
@@ -342,7 +1238,7 @@ def discover_font_resources(soup, base_url):
 
             # Check if it's a font URL
             if is_font_url(full_url) or 'font' in href.lower():
-                original_path = clean_path(href)
+                original_path = clean_path(full_url)
 
                 font_resources.append({
                     'filename': os.path.basename(original_path),
@@ -358,14 +1254,15 @@ def discover_font_resources(soup, base_url):
     return font_resources
 
 
-def discover_other_resources(soup, base_url):
+@timed_phase('discover_other')
+def discover_other_resources(index, base_url):
     """
     Discover other resources (videos, audio, documents, etc.)
     """
     other_resources = []
 
     # Video tags
-    video_tags = soup.find_all('video')
+    video_tags = index.find_all('video')
     for video in video_tags:
         src = video.get('src')
         if src:
@@ -373,7 +1270,7 @@ def discover_other_resources(soup, base_url):
                 create_media_resource(src, base_url, 'video'))
 
         # Source tags within video
-        source_tags = video.find_all('source')
+        source_tags = index.sources_in(video)
         for source in source_tags:
             src = source.get('src')
             if src:
@@ -381,7 +1278,7 @@ def discover_other_resources(soup, base_url):
                     create_media_resource(src, base_url, 'video'))
 
     # Audio tags
-    audio_tags = soup.find_all('audio')
+    audio_tags = index.find_all('audio')
     for audio in audio_tags:
         src = audio.get('src')
         if src:
@@ -389,7 +1286,7 @@ def discover_other_resources(soup, base_url):
                 create_media_resource(src, base_url, 'audio'))
 
         # Source tags within audio
-        source_tags = audio.find_all('source')
+        source_tags = index.sources_in(audio)
         for source in source_tags:
             src = source.get('src')
             if src:
@@ -397,7 +1294,7 @@ def discover_other_resources(soup, base_url):
                     create_media_resource(src, base_url, 'audio'))
 
     # Embed and object tags
-    embed_tags = soup.find_all(['embed', 'object'])
+    embed_tags = index.find_all(['embed', 'object'])
     for embed in embed_tags:
         src = embed.get('src') or embed.get('data')
         if src:
@@ -405,7 +1302,7 @@ def discover_other_resources(soup, base_url):
                 create_media_resource(src, base_url, 'other'))
 
     # Links to documents
-    a_tags = soup.find_all('a', href=True)
+    a_tags = index.find_all('a', href=True)
     for a in a_tags:
         href = a.get('href')
         if href and is_document_url(href):
@@ -415,154 +1312,370 @@ def discover_other_resources(soup, base_url):
     return other_resources
 
 
-def extract_resources_from_css(css_resources, base_url):
+def extract_resources_from_css(css_resource, css_url, known):
     """
-    Extract resources referenced in CSS files
+    Extract resources referenced by a stylesheet (url() and @import),
+    resolved against the stylesheet's own URL. URLs already in known (a
+    ResourceIndex) are skipped; new resources are added to it.
     """
     embedded_resources = []
+    depth = css_resource.get('depth', 0) + 1
+
+    for url_match, is_import in find_css_references(css_resource['content']):
+        full_url = urljoin(css_url, url_match)
+        if not full_url.startswith(('http://', 'https://')) or full_url in known:
+            continue
+
+        original_path = clean_path(full_url)
+
+        # Determine resource type
+        if is_import:
+            category = 'css'
+        elif is_image_url(original_path):
+            category = 'image'
+        elif is_font_url(original_path):
+            category = 'font'
+        else:
+            category = 'other'
 
-    for css_resource in css_resources:
-        if css_resource['category'] == 'css' and css_resource.get('content'):
-            css_content = css_resource['content']
-
-            # Find all url() references in CSS
-            url_matches = re.findall(
-                r'url$$["\']?([^"\']+)["\']?$$', css_content)
-
-            for url_match in url_matches:
-                if not url_match.startswith('data:'):
-                    full_url = urljoin(base_url, url_match)
-
-                    # Determine resource type
-                    if is_image_url(url_match):
-                        category = 'image'
-                    elif is_font_url(url_match):
-                        category = 'font'
-                    else:
-                        category = 'other'
-
-                    original_path = clean_path(url_match)
-
-                    embedded_resources.append({
-                        'filename': os.path.basename(original_path),
-                        'original_path': original_path,
-                        'url': full_url,
-                        'content': '',
-                        'category': category,
-                        'type': 'css-embedded',
-                        'size': 0,
-                        'downloaded': False
-                    })
+        resource = {
+            'filename': os.path.basename(original_path),
+            'original_path': original_path,
+            'url': full_url,
+            'content': '',
+            'category': category,
+            'type': 'css-embedded',
+            'size': 0,
+            'downloaded': False,
+            'depth': depth
+        }
+        known.add(resource)
+        embedded_resources.append(resource)
 
     return embedded_resources
 
 
-def download_all_resources(resources, headers):
+def download_all_resources(resources, headers, options=None, on_complete=None,
+                           progress=None, store_body=None, resume=None):
     """
-    Download all resources using threading for speed
+    Download all resources with the configured engine ('threads', 'async' or
+    'http2', the async engine over HTTP/2),
+    calling on_complete(resource) as each one finishes and counting them on
+    progress (a jobs.Progress). Bodies are spooled within the per-resource
+    and per-clone byte budgets; what doesn't fit is marked skipped. With
+    options['previous'] (a snapshot), resources it has are revalidated
+    instead of downloaded again. store_body replaces store_resource_body to
+    keep bodies somewhere else than in the resource dicts, and resume(resource)
+    returns True for a resource an earlier run stored already (filling it
+    in), which is then neither downloaded nor passed to on_complete.
+
+    Each stylesheet is scanned as soon as it arrives; what it references is
+    appended to resources and scheduled on the same pool while the other
+    downloads are still running, and its url()s are rewritten to the local
+    copies.
     """
+    options = resolve_scrape_options(options)
+    engine = options['engine']
+    store_body = store_body or partial(store_resource_body, binary_mode=options['binary_mode'])
+    cache = get_http_cache() if options['cache'] else None
+    spooler = BodySpooler()
+    flights = get_single_flight()
+    baseline = Baseline(options['previous']) if options['previous'] else None
     to_download = [r for r in resources if not r['downloaded']
-                   and r['url'] not in ['inline', 'data:embedded']]
+                   and r['url'] not in ['inline', 'data:embedded']
+                   and not (resume and resume(r))]
+
+    progress = progress or Progress()
+    progress.reset(len(to_download))
+
+    print(f"⬇️ Downloading {len(to_download)} resources ({engine})...")
+
+    max_css_depth = get_css_max_depth()
+    known = ResourceIndex(resources)
+
+    def finished(resource):
+        nested = []
+        if is_stylesheet(resource):
+            if resource.get('depth', 0) < max_css_depth:
+                nested = extract_resources_from_css(resource, resource['url'], known)
+                resources.extend(nested)
+                if resume:
+                    nested = [r for r in nested if not resume(r)]
+                progress.add_total(len(nested))
+            # Everything it references is known now; point it at the local
+            # copies, and at the origin for what's past the depth limit
+            resource['content'] = LinkRewriter(
+                known.paths, resource['url'], resource['original_path'],
+                absolutize=True).css(resource['content'])
+
+        record_download_progress(resource, progress)
+        record_resource(resource)
+        if on_complete:
+            on_complete(resource)
+        # The engine schedules these alongside the downloads still in flight
+        return nested
+
+    with timed_phase('download'):
+        if engine in ('async', 'http2'):
+            download_all_resources_async(
+                to_download, headers, store_body, on_complete=finished, cache=cache,
+                spooler=spooler, flights=flights, baseline=baseline,
+                http2=engine == 'http2')
+        else:
+            download_all_resources_threaded(
+                to_download, headers, finished, store_body, cache, spooler, flights,
+                baseline)
 
-    with download_progress['lock']:
-        download_progress['total'] = len(to_download)
-        download_progress['current'] = 0
 
-    print(f"⬇️ Downloading {len(to_download)} resources...")
+def download_all_resources_threaded(to_download, headers, on_complete, store_body,
+                                    cache=None, spooler=None, flights=None, baseline=None):
+    """
+    Download resources using threading for speed. Whatever on_complete
+    returns for a finished resource is downloaded on the same pool.
 
-    # Use ThreadPoolExecutor for parallel downloads
-    with ThreadPoolExecutor(max_workers=10) as executor:
-        future_to_resource = {
-            executor.submit(download_single_resource, resource, headers): resource
-            for resource in to_download
-        }
+    A HostScheduler hands resources to the pool as each host's adaptive
+    window allows, and queues failed tries again after their backoff.
+    """
+    scheduler = HostScheduler()
+    for resource in to_download:
+        scheduler.add(resource)
+
+    # Use ThreadPoolExecutor for parallel downloads over pooled connections
+    workers = get_download_workers()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        future_to_resource = {}
+        completed = queue.Queue()
+
+        def download(resource):
+            with in_flight('threads'):
+                return download_single_resource(
+                    resource, headers, store_body, cache, spooler, flights, baseline)
+
+        def submit_ready():
+            for resource in scheduler.ready(workers - len(future_to_resource)):
+                future = executor.submit(download, resource)
+                future_to_resource[future] = resource
+                future.add_done_callback(completed.put)
+
+        submit_ready()
+        while future_to_resource or scheduler:
+            try:
+                future = completed.get(timeout=scheduler.wait_time())
+            except queue.Empty:
+                submit_ready()
+                continue
 
-        for future in as_completed(future_to_resource):
-            resource = future_to_resource[future]
+            resource = future_to_resource.pop(future)
             try:
-                success = future.result()
-                with download_progress['lock']:
-                    download_progress['current'] += 1
-                    progress = (
-                        download_progress['current'] / download_progress['total']) * 100
-                    print(
-                        f"📥 Progress: {progress:.1f}% - {resource['filename']}")
+                future.result()
+            except RetryableError as e:
+                scheduler.finished(resource, e)
+                if scheduler.retry(resource, e):
+                    print(f"🔁 Retrying {resource['filename']} ({e})")
+                    submit_ready()
+                    continue
+                resource['error'] = str(e)
+                resource['downloaded'] = False
             except Exception as e:
+                scheduler.finished(resource, e)
                 print(f"❌ Failed to download {resource['filename']}: {e}")
                 resource['error'] = str(e)
+            else:
+                scheduler.finished(resource)
+
+            for nested in on_complete(resource) or ():
+                scheduler.add(nested)
+            submit_ready()
+
 
+def record_download_progress(resource, progress):
+    """Count one finished download"""
+    percent = progress.advance()
+    if resource.get('skipped'):
+        print(f"⏭️ Skipped {resource['filename']} ({resource['skipped']}, "
+              f"advertised size {resource.get('advertised_size')})")
+    print(
+        f"📥 Progress: {percent:.1f}% - {resource['filename']}")
 
-def download_single_resource(resource, headers):
+
+def download_single_resource(resource, headers, store_body=None, cache=None,
+                             spooler=None, flights=None, baseline=None):
     """
-    Download a single resource
+    Download a single resource, going through the HTTP cache when given one.
+    The body is streamed into a spooled file within the spooler's budgets.
+    With flights (a SingleFlight), a URL another clone is already
+    downloading is waited for instead of fetched again. With a baseline
+    (an incremental clone), a resource of the previous snapshot is
+    revalidated and its body reused when the server answers 304.
+
+    A large body the server serves by ranges is downloaded in parallel
+    segments with checkpoints (see ranged.py); a try that failed part way
+    is carried on by the next one.
+
+    A retryable status or connection error raises RetryableError, for the
+    engine to try again later.
     """
+    store_body = store_body or store_resource_body
+    spooler = spooler or BodySpooler()
+    flight, leader = None, False
     try:
-        response = requests.get(
-            resource['url'], headers=headers, timeout=30, stream=True)
-        response.raise_for_status()
-
-        # Handle binary vs text content
-        if is_binary_content(response.headers.get('content-type', '')):
-            resource['content'] = base64.b64encode(
-                response.content).decode('utf-8')
-            resource['is_binary'] = True
+        entry, fresh = cache.lookup(resource['url']) if cache else (None, False)
+
+        if fresh:
+            stored = store_cached(resource, cache, entry, store_body, spooler)
+            if stored is None:
+                entry = None  # Evicted since the lookup
+            elif not stored:
+                return False
+            else:
+                record_validators(resource, entry['headers'])
+                resource['cache'] = 'hit'
+                return True
+
+        if flights:
+            flight, leader = flights.join(resource['url'])
+            if not leader:
+                stored = store_coalesced(
+                    resource, flight, flight.wait(get_resource_timeout()),
+                    store_body, spooler)
+                if stored is not None:
+                    return stored
+
+        previous = not entry and baseline is not None and resource['url'] in baseline
+        request_headers = dict(headers)
+        if entry:
+            request_headers.update(cache.conditional_headers(entry))
+        elif previous:
+            request_headers.update(baseline.conditional_headers(resource['url']))
+
+        if not entry and not previous and has_checkpoint(resource):
+            # An earlier try stopped part way, carry on where it did
+            body, response_headers = download_ranged(resource, headers, spooler)
+            if body is None:
+                return False
         else:
-            resource['content'] = response.text
-            resource['is_binary'] = False
-
-        resource['size'] = len(response.content)
-        resource['downloaded'] = True
-        resource['content_type'] = response.headers.get('content-type', '')
+            response = fetch(
+                resource['url'], headers=request_headers,
+                timeout=get_request_timeout(), stream=True)
+
+            with response:
+                if entry and response.status_code == 304:
+                    cache.refresh(entry, response.headers)
+                    stored = store_cached(
+                        resource, cache, entry, store_body, spooler,
+                        partial(flights.finish, resource['url'], flight) if leader else None)
+                    if stored is None:
+                        raise RetryableError('Cached body evicted while revalidating')
+                    if not stored:
+                        return False
+                    record_validators(resource, entry['headers'])
+                    resource['cache'] = 'revalidated'
+                    return True
+
+                if previous and response.status_code == 304:
+                    return baseline.reuse(resource, store_body, spooler)
+
+                check_status(response.status_code, response.headers)
+                response.raise_for_status()
+
+                response_headers = response.headers
+                ranged = resource.get('ranged') is not False and accepts_ranges(response_headers)
+                if not ranged:
+                    body = spooler.spool(
+                        resource, response_headers.get('content-length'),
+                        response.iter_content(SPOOL_CHUNK_SIZE))
+                    if body is None:
+                        return False
+
+            if ranged:
+                # Closed unread: the body is fetched again by Range requests
+                body, response_headers = download_ranged(
+                    resource, headers, spooler, response_headers)
+                if body is None:
+                    return False
+
+        with body:
+            content_type = response_headers.get('content-type', '')
+            if leader:
+                flights.finish(resource['url'], flight, body, content_type)
+
+            if cache:
+                cache.store(resource['url'], body, response_headers)
+                resource['cache'] = 'miss'
+                body.seek(0)
+
+            store_body(resource, body, content_type)
+            record_validators(resource, response_headers)
 
         return True
 
+    except RetryableError:
+        raise
+    except (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+            requests.exceptions.ChunkedEncodingError) as e:
+        raise RetryableError(str(e)) from e
     except Exception as e:
         resource['error'] = str(e)
         resource['downloaded'] = False
         return False
 
+    finally:
+        # Waiters take the error, or download it themselves after a skip
+        # or a failed try
+        if leader:
+            flights.finish(resource['url'], flight, error=resource.get('error'))
 
-def process_html_links(soup, resources, base_url):
+
+def store_resource_body(resource, content, content_type, text=None, binary_mode='inline'):
     """
-    Process HTML and update all links to point to local files
+    Fill a resource dict from a downloaded body, given as bytes or as a
+    spooled file positioned at its start.
+
+    Every body's SHA-256 is kept as 'hash'. In 'blob' mode binary bodies go
+    to the content-addressed blob store and the resource carries only that
+    hash (served by /api/blob/<hash>/), with no content.
     """
-    print("🔗 Processing HTML links...")
+    size = body_size(content)
+
+    # Handle binary vs text content
+    if is_binary_content(content_type):
+        if binary_mode == 'blob':
+            # Copied from the spooled file without loading it into memory
+            resource['content'] = ''
+            resource['hash'] = get_blob_store().put(content, content_type)
+        else:
+            resource['hash'] = body_hash(content)
+            resource['content'] = base64.b64encode(read_body(content)).decode('utf-8')
+        resource['is_binary'] = True
+    else:
+        resource['hash'] = body_hash(content)
+        resource['content'] = text if text is not None else decode_body(
+            read_body(content), content_type)
+        resource['is_binary'] = False
 
-    # Create URL to local path mapping
-    url_to_local = {}
-    for resource in resources:
-        if resource['url'] not in ['inline', 'data:embedded']:
-            url_to_local[resource['url']] = resource['original_path']
+    resource['size'] = size
+    resource['downloaded'] = True
+    resource['content_type'] = content_type
 
-    # Update CSS links
-    for link in soup.find_all('link', href=True):
-        href = link.get('href')
-        full_url = urljoin(base_url, href)
-        if full_url in url_to_local:
-            link['href'] = url_to_local[full_url]
 
-    # Update script sources
-    for script in soup.find_all('script', src=True):
-        src = script.get('src')
-        full_url = urljoin(base_url, src)
-        if full_url in url_to_local:
-            script['src'] = url_to_local[full_url]
+@timed_phase('rewrite')
+def process_html_links(soup, resources, base_url, page_path='index.html',
+                       page_paths=None, table=None):
+    """
+    Process HTML and update all links to point to local files, relative to
+    page_path (where the page itself is saved). Links to other crawled
+    pages (page_paths, {url: path}) point at their local copies too.
 
-    # Update image sources
-    for img in soup.find_all('img', src=True):
-        src = img.get('src')
-        full_url = urljoin(base_url, src)
-        if full_url in url_to_local:
-            img['src'] = url_to_local[full_url]
+    table is the clone's build_link_table(resources), when the caller
+    renders several pages from the same resources.
+    """
+    print("🔗 Processing HTML links...")
 
-    # Update other attributes that might contain URLs
-    for element in soup.find_all(attrs={'data-src': True}):
-        data_src = element.get('data-src')
-        full_url = urljoin(base_url, data_src)
-        if full_url in url_to_local:
-            element['data-src'] = url_to_local[full_url]
+    if table is None:
+        table = build_link_table(resources)
+    page_paths = {canonical_url(url): path for url, path in (page_paths or {}).items()}
 
-    return soup
+    return rewrite_document(soup, LinkRewriter(table, base_url, page_path, page_paths))
 
 # Helper functions
 
@@ -572,8 +1685,16 @@ def clean_path(path):
     if path.startswith('//'):
         path = 'https:' + path
     if path.startswith('http'):
-        parsed = urlparse(path)
-        path = parsed.path
+        match = URL_PATH_RE.match(path)
+        if match:
+            # urlparse's path without parsing the rest: params (after a ';'
+            # in the last segment) dropped like it does
+            path = match.group(1)
+            semicolon = path.find(';', path.rfind('/'))
+            if semicolon >= 0:
+                path = path[:semicolon]
+        else:
+            path = urlparse(path).path
 
     path = unquote(path).strip('/')
 
@@ -619,7 +1740,7 @@ def create_image_resource(src, base_url, alt=''):
         }
     else:
         full_url = urljoin(base_url, src)
-        original_path = clean_path(src)
+        original_path = clean_path(full_url)
 
         return {
             'filename': os.path.basename(original_path),
@@ -637,7 +1758,7 @@ def create_image_resource(src, base_url, alt=''):
 def create_media_resource(src, base_url, media_type):
     """Create a media resource object"""
     full_url = urljoin(base_url, src)
-    original_path = clean_path(src)
+    original_path = clean_path(full_url)
 
     return {
         'filename': os.path.basename(original_path),
@@ -689,7 +1810,8 @@ def is_document_url(url):
     """Check if URL is a document file"""
     doc_extensions = ['.pdf', '.doc', '.docx', '.xls',
                       '.xlsx', '.ppt', '.pptx', '.zip', '.rar']
-    return any(url.lower().endswith(ext) for ext in doc_extensions)
+    path = urlparse(url).path.lower()
+    return any(path.endswith(ext) for ext in doc_extensions)
 
 
 def is_binary_content(content_type):